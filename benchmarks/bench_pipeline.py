@@ -0,0 +1,155 @@
+"""
+Throughput and peak memory of every pipeline stage on synthetic WhatsApp exports.
+
+    python -m benchmarks.bench_pipeline --output results.json
+    python -m benchmarks.bench_pipeline --sizes 10000 --compare benchmarks/baseline.json
+
+Every stage runs once timed and once under tracemalloc for its peak memory, unless --no-memory is given.
+benchmarks/baseline.json holds the results of the DEFAULT_SIZES. Larger sizes such as 10_000_000 messages are
+measured on request only, as they need tens of GiB of memory.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List, Dict, Any, Tuple
+
+import pandas as pd
+
+from chat_analyzer.data_processing.extract import merge_consecutive_msg
+from chat_analyzer.data_processing.feature_engineering import extract_single_chat_features, add_features
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations, read_whatsapp_file
+from chat_analyzer.data_processing.search_index import update_search_index
+from chat_analyzer.utils.synthetic import write_whatsapp_export
+from chat_analyzer.utils.validation import VALIDATION_MODES, set_validation_mode
+from chat_analyzer.visualization.visualize import create_chat_html
+
+DEFAULT_SIZES = [10_000, 1_000_000]
+N_AGGREGATE_CHATS = 4
+REGRESSION_THRESHOLD = 1.2  # slower than baseline by more than this factor fails --compare
+
+
+def measure(stage: str, n_messages: int, func: Callable[[], Any], rows_in: int,
+            with_memory: bool) -> Tuple[dict, Any]:
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+
+    peak_mib = None
+    if with_memory:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mib = round(peak / 2 ** 20, 1)
+
+    rows_out = None if result is None else len(result)
+    record = {'stage': stage, 'n_messages': n_messages, 'rows_in': rows_in, 'rows_out': rows_out,
+              'seconds': round(seconds, 4), 'rows_per_s': round(rows_in / seconds) if seconds else None,
+              'peak_mib': peak_mib}
+    print(f"{stage:>30} {n_messages:>10}: {seconds:8.3f}s {record['rows_per_s']:>12} rows/s "
+          f"peak {peak_mib} MiB", file=sys.stderr)
+    return record, result
+
+
+def bench_size(n_messages: int, with_memory: bool, path_html: str) -> List[dict]:
+    records = []
+
+    # Exports are streamed from disk in batches, as in the pipeline
+    with tempfile.TemporaryDirectory() as path_export:
+        path_export = os.path.join(path_export, "WhatsApp Chat with Contact 1.txt")
+        write_whatsapp_export(path_export, n_messages, seed=0)
+        record, df_raw = measure('read_whatsapp_file', n_messages, lambda: read_whatsapp_file(path_export)[0],
+                                 n_messages, with_memory)
+        records.append(record)
+
+    record, df_combined = measure('merge_consecutive_msg', n_messages, lambda: merge_consecutive_msg(df_raw),
+                                  len(df_raw), with_memory)
+    records.append(record)
+
+    record, df_single = measure('extract_single_chat_features', n_messages,
+                                lambda: extract_single_chat_features(df_combined), len(df_combined),
+                                with_memory)
+    records.append(record)
+
+    record, df_features = measure('add_features', n_messages, lambda: add_features(df_single),
+                                  len(df_single), with_memory)
+    records.append(record)
+
+    chat = df_features.chat.iloc[0]
+    record, _ = measure('create_chat_html', n_messages,
+                        lambda: create_chat_html(df_features.copy(), chat, path_html, offline=False),
+                        len(df_features), with_memory)
+    records.append(record)
+
+    record, _ = measure('create_chat_html_offline', n_messages,
+                        lambda: create_chat_html(df_features.copy(), chat, path_html, offline=True),
+                        len(df_features), with_memory)
+    records.append(record)
+
+    with tempfile.TemporaryDirectory() as path_index:
+        record, _ = measure('update_search_index', n_messages, lambda: update_search_index(df_features, path_index),
+                            len(df_features), with_memory)
+        records.append(record)
+
+    # Whole ingestion of the chat, split into N_AGGREGATE_CHATS exports
+    with tempfile.TemporaryDirectory() as path_chats:
+        for i in range(N_AGGREGATE_CHATS):
+            write_whatsapp_export(os.path.join(path_chats, f"WhatsApp Chat with Contact {i}.txt"),
+                                  n_messages // N_AGGREGATE_CHATS, seed=i)
+        record, _ = measure('aggregate_whatsapp_conversations', n_messages,
+                            lambda: aggregate_whatsapp_conversations(path_chats, n_workers=1), n_messages,
+                            with_memory)
+        records.append(record)
+    return records
+
+
+def compare(results: List[dict], baseline: List[dict]) -> bool:
+    """Print the time ratio to the baseline of every stage. Returns False on any regression."""
+    baseline_by_key = {(r['stage'], r['n_messages']): r for r in baseline}
+    ok = True
+    for r in results:
+        b = baseline_by_key.get((r['stage'], r['n_messages']))
+        if b is None:
+            continue
+        ratio = r['seconds'] / b['seconds']
+        regression = ratio > REGRESSION_THRESHOLD
+        ok &= not regression
+        print(f"{r['stage']:>30} {r['n_messages']:>10}: {ratio:5.2f}x baseline"
+              f"{'  REGRESSION' if regression else ''}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass of every stage")
+    parser.add_argument('--output', help="write the results as json to this path")
+    parser.add_argument('--compare', help="baseline json to compare the results with")
+    parser.add_argument('--validation', choices=VALIDATION_MODES, help="validation mode, defaults to the configured")
+    args = parser.parse_args(argv)
+    if args.validation:
+        set_validation_mode(args.validation)
+
+    results = []
+    with tempfile.TemporaryDirectory() as path_html:
+        for n_messages in args.sizes:
+            results += bench_size(n_messages, not args.no_memory, path_html)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'pandas': pd.__version__, 'cpu_count': os.cpu_count(),
+                       'results': results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline: Dict[str, Any] = json.load(f)
+        if not compare(results, baseline['results']):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,4 +7,43 @@ PATH_WHATSAPP_MSG = "data/raw/whatsapp_messages/"
 
 # Export path for parsed and enriched pandas dataframes
 PATH_DIR_PROCESSED_PICKLES = "data/processed/"
+PATH_DIR_PROCESSED_STORE = "data/processed/store/"  # Parquet dataset, partitioned by chat and year
+PATH_METRICS_CUBE = "data/processed/metrics_cube.parquet"  # Message metrics per chat, sender, day and hour
+PATH_DIR_SEARCH_INDEX = "data/processed/search/"  # Inverted index of the message texts, one segment per chat
 PATH_DIR_CHAT_HTML_VISUALIZATIONS = "data/visualized/"
+
+# Per-chat cache of processed exports, reused while the export and the pipeline config are unchanged
+PATH_DIR_CACHE = "data/cache/"
+PATH_DIR_OFFSET_INDEX = "data/cache/offsets/"  # Byte offsets of the messages in every WhatsApp export
+
+# Signal and WhatsApp exports of a chat with the same name are merged into one chat
+MERGE_SIGNAL_CHATS = True
+# Timezone, in which the Signal times of json exports are given as local time, like WhatsApp does
+SIGNAL_TIMEZONE = "Europe/Zurich"
+
+# Consecutive messages of the same sender within this many seconds are merged into one block
+MERGE_WINDOW_S = 60
+
+# Worker processes used to ingest chat exports and render reports in parallel.
+# None uses all cores, 1 processes sequentially.
+N_INGESTION_WORKERS = None
+N_REPORT_WORKERS = None
+
+# Reports load plotly.js from a file shared by all reports in their folder, instead of a CDN
+OFFLINE_REPORTS = True
+
+# Local dashboard server, keeping the aggregates of this many chats cached
+DASHBOARD_PORT = 8050
+DASHBOARD_CACHE_SIZE = 256
+
+# Watch mode: exports are ingested once unchanged for WATCH_DEBOUNCE_S, at most WATCH_MAX_BATCH exports at a time
+WATCH_DEBOUNCE_S = 5
+WATCH_POLL_INTERVAL_S = 2
+WATCH_MAX_BATCH = 8
+
+# Store names as categoricals, weeks and counts as small integers and emojis as arrow list arrays
+COMPACT_CHAT_FEATURES = False
+
+# Validation of the pandera models after every stage: "full", "sampled" (head, tail and a sample of rows),
+# "schema" (columns and dtypes only) or "off". Tests always validate fully.
+VALIDATION_MODE = "sampled"
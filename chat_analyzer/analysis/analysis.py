@@ -1,7 +1,9 @@
+import numpy as np
 import pandas as pd
 from pandas.core.groupby import DataFrameGroupBy
 from pandera.typing import DataFrame
 
+from chat_analyzer.analysis.latency import latency_histograms, latency_quantiles
 from chat_analyzer.utils.data_definitions import ChatFeatures
 
 
@@ -12,10 +14,20 @@ def n_messages_per_day(df) -> pd.Series:
 
 
 def hourly_statistics(df: DataFrame[ChatFeatures]) -> pd.DataFrame:
-    grouping = df.groupby([df.hour, 'sender'])
+    grouping = df.groupby([df.hour, 'sender'], observed=True)
     return agg_chat_metrics(grouping).reset_index()
 
 
+def sender_pair_statistics(df: DataFrame[ChatFeatures]) -> pd.DataFrame:
+    """Chat metrics per sender and receiver. In group chats, these are the replies between two members."""
+    grouping = df.groupby(['sender', 'receiver'], observed=True)
+    return agg_chat_metrics(grouping).reset_index()
+
+
+# Columns aggregated by agg_chat_metrics
+METRIC_COLUMNS = ['message', 'n_symbols', 'duration_to_reply', 'duration_since_their_last']
+
+
 def agg_chat_metrics(dfgb: DataFrameGroupBy) -> pd.DataFrame:
     """derive statistics of grouped data"""
     df = dfgb.agg(
@@ -28,4 +40,16 @@ def agg_chat_metrics(dfgb: DataFrameGroupBy) -> pd.DataFrame:
     )
     df['n_follow_up_messages'] = df['total_messages'] - df['count_msg_with_answer']
     df = df.drop(columns='count_msg_with_answer')
-    return df
+    # Reply time quantiles estimated from a latency sketch per group, like those merged from the metrics cube.
+    # Sketches are built for the observed groups, and aligned with df by their keys.
+    indices = dfgb.indices
+    codes = np.full(len(dfgb.obj), -1, dtype=np.int64)
+    for code, positions in enumerate(indices.values()):
+        codes[positions] = code
+    counts = latency_histograms(codes, dfgb.obj['duration_to_reply'], len(indices))
+    if isinstance(df.index, pd.MultiIndex):
+        keys = pd.MultiIndex.from_tuples(list(indices), names=df.index.names)
+    else:
+        keys = pd.Index(list(indices), name=df.index.name)
+    sketches = pd.DataFrame(counts, index=keys).reindex(df.index, fill_value=0)
+    return df.join(latency_quantiles(sketches))
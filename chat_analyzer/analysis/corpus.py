@@ -0,0 +1,140 @@
+import os
+from dataclasses import dataclass, replace
+from typing import Optional, Sequence, Tuple, Union, List
+
+import pandas as pd
+
+from chat_analyzer import PATH_DIR_SEARCH_INDEX
+from chat_analyzer.analysis.analysis import agg_chat_metrics, n_messages_per_day, hourly_statistics, \
+    sender_pair_statistics, METRIC_COLUMNS
+from chat_analyzer.analysis.cube import read_metrics_cube, read_cube_sketches, cube_metrics, cube_messages_per_day, \
+    CUBE_SKETCH_KEYS
+from chat_analyzer.data_processing.search_index import SearchIndex
+from chat_analyzer.data_processing.store import read_parquet_store, list_store_chats
+
+Names = Union[str, Sequence[str]]
+
+
+@dataclass(frozen=True)
+class Corpus:
+    """
+    Lazy query on the parquet store of the processed chats.
+
+    filter and select only refine the query plan. Data is read once a result is requested, and then only the
+    chats, years and columns it needs, e.g.
+    `Corpus.open(path).filter(chat='Max', since='2022').metrics(by='weekday')`
+    With the path of the metrics cube written along with the store, metrics, messages per day and hourly
+    statistics are derived from the cube and its latency sketches instead, as long as no time range is filtered.
+    """
+    path_store: str
+    chats: Optional[Tuple[str, ...]] = None
+    senders: Optional[Tuple[str, ...]] = None
+    since: Optional[pd.Timestamp] = None
+    until: Optional[pd.Timestamp] = None
+    columns: Optional[Tuple[str, ...]] = None
+    path_metrics_cube: Optional[str] = None
+
+    @classmethod
+    def open(cls, path_store: str, path_metrics_cube: Optional[str] = None) -> 'Corpus':
+        return cls(path_store, path_metrics_cube=path_metrics_cube)
+
+    def filter(self, chat: Optional[Names] = None, sender: Optional[Names] = None,
+               since: Optional[Union[str, pd.Timestamp]] = None,
+               until: Optional[Union[str, pd.Timestamp]] = None) -> 'Corpus':
+        """Restrict the query to chats and senders, and to messages from since (inclusive) until (exclusive)"""
+        if since is not None:
+            since = pd.Timestamp(since) if self.since is None else max(self.since, pd.Timestamp(since))
+        if until is not None:
+            until = pd.Timestamp(until) if self.until is None else min(self.until, pd.Timestamp(until))
+        since = self.since if since is None else since
+        until = self.until if until is None else until
+        return replace(self, chats=_intersect(self.chats, chat), senders=_intersect(self.senders, sender),
+                       since=since, until=until)
+
+    def select(self, *columns: str) -> 'Corpus':
+        """Restrict the columns of to_pandas"""
+        return replace(self, columns=columns)
+
+    def list_chats(self) -> List[str]:
+        """Chats of the store matching the chat filter, from its partitions only"""
+        chats = list_store_chats(self.path_store)
+        return chats if self.chats is None else [c for c in chats if c in self.chats]
+
+    def to_pandas(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Read the filtered messages. Columns default to the selected ones, or all."""
+        if columns is None and self.columns is not None:
+            columns = list(self.columns)
+        return read_parquet_store(self.path_store, columns=columns, chats=self.chats, since=self.since,
+                                  until=self.until, senders=self.senders)
+
+    def metrics(self, by: Names = 'sender') -> pd.DataFrame:
+        """agg_chat_metrics of the filtered messages, grouped by one or several columns"""
+        by = [by] if isinstance(by, str) else list(by)
+        cube = self._cube() if set(by) <= set(CUBE_SKETCH_KEYS) else None
+        if cube is not None:
+            return cube_metrics(cube[0], by, cube[1])
+        df = self.to_pandas(columns=_unique(by + METRIC_COLUMNS))
+        return agg_chat_metrics(df.groupby(by, observed=True))
+
+    def messages_per_day(self) -> pd.Series:
+        cube = self._cube()
+        if cube is not None:
+            return cube_messages_per_day(cube[0])
+        return n_messages_per_day(self.to_pandas(columns=['datetime', 'message']))
+
+    def hourly_statistics(self) -> pd.DataFrame:
+        cube = self._cube()
+        if cube is not None:
+            return cube_metrics(cube[0], ['hour', 'sender'], cube[1]).reset_index()
+        return hourly_statistics(self.to_pandas(columns=_unique(['hour', 'sender'] + METRIC_COLUMNS)))
+
+    def sender_pair_statistics(self) -> pd.DataFrame:
+        return sender_pair_statistics(self.to_pandas(columns=_unique(['sender', 'receiver'] + METRIC_COLUMNS)))
+
+    def search(self, query: str, phrase: bool = False, path_index: str = PATH_DIR_SEARCH_INDEX) -> pd.DataFrame:
+        """
+        Filtered messages containing all terms of the query, or the query as phrase. They are looked up in the
+        search index and only the chats with matches read, their columns defaulting to the selected ones.
+        """
+        matches = SearchIndex(path_index).search(query, phrase, **self._search_filters())
+        columns = list(self.columns) if self.columns is not None else None
+        results = [read_parquet_store(self.path_store, columns=columns, chats=[chat]).take(df_chat['row'])
+                   for chat, df_chat in matches.groupby('chat', sort=True)]
+        return pd.concat(results, ignore_index=True) if results else read_parquet_store(self.path_store, columns, [])
+
+    def term_frequency(self, query: str, freq: str = 'M', phrase: bool = False,
+                       path_index: str = PATH_DIR_SEARCH_INDEX) -> pd.Series:
+        """Number of filtered messages containing the query per period of freq, counted from the search index"""
+        return SearchIndex(path_index).term_frequency(query, freq, phrase, **self._search_filters())
+
+    def _cube(self) -> Optional[Tuple[pd.DataFrame, pd.DataFrame]]:
+        """
+        Filtered metrics cube and latency sketches. None without a cube, or with a time range filtered, which the
+        sketches of weekday and hour cannot be restricted to.
+        """
+        if self.path_metrics_cube is None or self.since is not None or self.until is not None or \
+                not os.path.exists(self.path_metrics_cube):
+            return None
+        sketches = read_cube_sketches(self.path_metrics_cube)
+        if sketches is None:
+            return None
+        cube = read_metrics_cube(self.path_metrics_cube)
+        for column, names in [('chat', self.chats), ('sender', self.senders)]:
+            if names is not None:
+                cube = cube[cube[column].isin(names)]
+                sketches = sketches[sketches.index.get_level_values(column).isin(names)]
+        return cube, sketches
+
+    def _search_filters(self) -> dict:
+        return dict(chats=self.chats, senders=self.senders, since=self.since, until=self.until)
+
+
+def _intersect(current: Optional[Tuple[str, ...]], names: Optional[Names]) -> Optional[Tuple[str, ...]]:
+    if names is None:
+        return current
+    names = (names,) if isinstance(names, str) else tuple(names)
+    return names if current is None else tuple(n for n in current if n in names)
+
+
+def _unique(columns: Sequence[str]) -> List[str]:
+    return list(dict.fromkeys(columns))
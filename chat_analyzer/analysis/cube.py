@@ -0,0 +1,152 @@
+import os
+from typing import Iterable, Optional, Sequence, Dict
+
+import numpy as np
+import pandas as pd
+from pandera.typing import DataFrame
+
+from chat_analyzer.analysis.latency import combine_latency_sketches, latency_quantiles, build_latency_sketches, \
+    LATENCY_SKETCH_KEYS, N_LATENCY_BINS
+from chat_analyzer.utils.data_definitions import ChatFeatures, cat_weekdays, cat_months
+
+CUBE_KEYS = ['chat', 'sender', 'date', 'hour']
+CUBE_SUMS = ['n_messages', 'n_symbols', 'n_emojis', 'n_replies', 'sum_duration_to_reply',
+             'n_since_their_last', 'sum_duration_since_their_last']
+# Keys of the latency sketches, which are written next to the cube
+CUBE_SKETCH_KEYS = ['chat', *LATENCY_SKETCH_KEYS]
+
+
+def build_metrics_cube(df: DataFrame[ChatFeatures]) -> pd.DataFrame:
+    """
+    Pre-aggregated metrics per chat, sender, day and hour.
+
+    Only holds counts and sums, so cubes of different messages can be added up and the metrics of any coarser
+    grouping be derived from them. Durations are summed together with the number of messages they are set for.
+    """
+    keys = [df['chat'].astype(str), df['sender'].astype(str), df['datetime'].dt.normalize().rename('date'),
+            df['hour'].astype(np.uint8)]
+    cube = df.groupby(keys, sort=True).agg(
+        n_messages=('message', 'count'),
+        n_symbols=('n_symbols', 'sum'),
+        n_emojis=('n_emojis', 'sum'),
+        n_replies=('duration_to_reply', 'count'),
+        sum_duration_to_reply=('duration_to_reply', 'sum'),
+        n_since_their_last=('duration_since_their_last', 'count'),
+        sum_duration_since_their_last=('duration_since_their_last', 'sum'),
+    ).reset_index()
+    return _cube_dtypes(cube)
+
+
+def combine_metrics_cubes(cubes: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """Add up cubes, e.g. of different chats or of messages which arrived later"""
+    cube = pd.concat(list(cubes), ignore_index=True)
+    cube = cube.groupby(CUBE_KEYS, sort=True)[CUBE_SUMS].sum().reset_index()
+    return _cube_dtypes(cube[cube['n_messages'] != 0].reset_index(drop=True))
+
+
+def update_metrics_cube(cube: pd.DataFrame, df_added: DataFrame[ChatFeatures],
+                        df_removed: Optional[DataFrame[ChatFeatures]] = None) -> pd.DataFrame:
+    """Incrementally add new messages to the cube and take out the messages they replace"""
+    cubes = [cube, build_metrics_cube(df_added)]
+    if df_removed is not None:
+        removed = build_metrics_cube(df_removed)
+        removed[CUBE_SUMS] = -removed[CUBE_SUMS]
+        cubes.append(removed)
+    return combine_metrics_cubes(cubes)
+
+
+def build_cube_sketches(df: DataFrame[ChatFeatures]) -> pd.DataFrame:
+    """
+    Latency sketches per chat, sender, weekday and hour, from which cube_metrics estimates reply time quantiles.
+    Groups without reply times are left out.
+    """
+    sketches = build_latency_sketches(df.assign(chat=df['chat'].astype(str), sender=df['sender'].astype(str)),
+                                      CUBE_SKETCH_KEYS)
+    return _non_empty(sketches)
+
+
+def update_cube_sketches(sketches: pd.DataFrame, df_added: DataFrame[ChatFeatures],
+                         df_removed: Optional[DataFrame[ChatFeatures]] = None) -> pd.DataFrame:
+    """Equivalent of update_metrics_cube for the latency sketches"""
+    parts = [sketches, build_cube_sketches(df_added)]
+    if df_removed is not None:
+        parts.append(-build_cube_sketches(df_removed))
+    return _non_empty(combine_latency_sketches(parts, CUBE_SKETCH_KEYS))
+
+
+def cube_metrics(cube: pd.DataFrame, by: Sequence[str], sketches: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    Equivalent of agg_chat_metrics, grouped by any of the cube keys. Besides those, the calendar
+    groupings weekday, month and year are derived from the date.
+    The cube holds no reply time quantiles. They are estimated from the latency sketches, e.g. those of
+    build_latency_sketches per chat, sender, weekday and hour, if given and grouped by their keys only.
+    """
+    calendar: Dict[str, pd.Series] = {
+        'weekday': pd.Categorical.from_codes(cube['date'].dt.dayofweek, dtype=cat_weekdays),
+        'month': pd.Categorical.from_codes(cube['date'].dt.month - 1, dtype=cat_months),
+        'year': cube['date'].dt.year,
+    }
+    keys = [pd.Series(calendar[column], index=cube.index, name=column) if column in calendar else cube[column]
+            for column in by]
+    sums = cube.groupby(keys, observed=True)[CUBE_SUMS].sum()
+    metrics = pd.DataFrame({
+        'total_messages': sums['n_messages'],
+        'total_symbols': sums['n_symbols'],
+        'avg_symbols_per_message': sums['n_symbols'] / sums['n_messages'],
+        'avg_time_to_reply': sums['sum_duration_to_reply'] / sums['n_replies'],
+        'avg_time_since_their_last': sums['sum_duration_since_their_last'] / sums['n_since_their_last'],
+        'n_follow_up_messages': sums['n_messages'] - sums['n_replies'],
+    })
+    if sketches is not None and set(by) <= set(sketches.index.names):
+        quantiles = latency_quantiles(combine_latency_sketches([sketches], by))
+        metrics = metrics.join(quantiles.reindex(metrics.index))
+    return metrics
+
+
+def cube_messages_per_day(cube: pd.DataFrame) -> pd.Series:
+    """Equivalent of n_messages_per_day"""
+    return cube.groupby('date')['n_messages'].sum().rename('message').rename_axis('datetime')
+
+
+def write_metrics_cube(cube: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    cube.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def read_metrics_cube(path: str) -> pd.DataFrame:
+    return _cube_dtypes(pd.read_parquet(path))
+
+
+def cube_sketches_path(path_metrics_cube: str) -> str:
+    root, ext = os.path.splitext(path_metrics_cube)
+    return f"{root}_latency{ext}"
+
+
+def write_cube_sketches(sketches: pd.DataFrame, path_metrics_cube: str):
+    """Write the latency sketches next to the metrics cube at path_metrics_cube, one column per bin"""
+    path = cube_sketches_path(path_metrics_cube)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    sketches.rename(columns=str).reset_index().to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def read_cube_sketches(path_metrics_cube: str) -> Optional[pd.DataFrame]:
+    """Latency sketches written next to the metrics cube at path_metrics_cube, None if there are none"""
+    path = cube_sketches_path(path_metrics_cube)
+    if not os.path.exists(path):
+        return None
+    sketches = pd.read_parquet(path).set_index(CUBE_SKETCH_KEYS)
+    sketches.columns = pd.RangeIndex(N_LATENCY_BINS, name='bin')
+    return sketches
+
+
+def _non_empty(sketches: pd.DataFrame) -> pd.DataFrame:
+    return sketches[sketches.to_numpy().any(axis=1)]
+
+
+def _cube_dtypes(cube: pd.DataFrame) -> pd.DataFrame:
+    counts = [column for column in CUBE_SUMS if not column.startswith('sum_duration')]
+    return cube.astype({'hour': np.uint8, **{column: np.int64 for column in counts}})
@@ -0,0 +1,88 @@
+"""
+Reply latency sketches: counts of the reply times in fixed, log-spaced bins.
+
+All sketches share the same bins, so sketches of different messages are merged by adding their counts, and any
+quantile is estimated from the bin it falls into. Bins span one second up to about three years with
+BINS_PER_DECADE bins per factor of ten, so quantiles are off by less than 6%. Shorter reply times share the first
+bin, longer ones the last.
+"""
+from typing import Iterable, Sequence
+
+import numpy as np
+import pandas as pd
+from pandera.typing import DataFrame
+
+from chat_analyzer.utils.data_definitions import ChatFeatures
+
+BINS_PER_DECADE = 20
+# Upper edges of the bins in seconds. The first bin spans [0s, 1s).
+LATENCY_BIN_EDGES_S = np.logspace(0, 8, 8 * BINS_PER_DECADE + 1)
+N_LATENCY_BINS = len(LATENCY_BIN_EDGES_S)
+LATENCY_SKETCH_KEYS = ['sender', 'weekday', 'hour']
+REPLY_QUANTILES = {'p50_time_to_reply': 0.5, 'p90_time_to_reply': 0.9, 'p99_time_to_reply': 0.99}
+
+
+def latency_bins(durations: pd.Series) -> np.ndarray:
+    """Bin of every duration, -1 for NaT"""
+    seconds = durations.dt.total_seconds().to_numpy()
+    bins = np.searchsorted(LATENCY_BIN_EDGES_S, seconds, side='right')
+    bins = np.minimum(bins, N_LATENCY_BINS - 1)
+    bins[np.isnan(seconds)] = -1
+    return bins
+
+
+def latency_histograms(group_codes: np.ndarray, durations: pd.Series, n_groups: int) -> np.ndarray:
+    """Bin counts of the durations of every group as (n_groups, N_LATENCY_BINS) array. Negative codes are skipped."""
+    bins = latency_bins(durations)
+    is_counted = (bins >= 0) & (group_codes >= 0)
+    flat = group_codes[is_counted].astype(np.int64) * N_LATENCY_BINS + bins[is_counted]
+    return np.bincount(flat, minlength=n_groups * N_LATENCY_BINS).reshape(n_groups, N_LATENCY_BINS)
+
+
+def build_latency_sketches(df: DataFrame[ChatFeatures], by: Sequence[str] = tuple(LATENCY_SKETCH_KEYS)
+                           ) -> pd.DataFrame:
+    """Reply time sketches of the messages grouped by the columns by, one column of counts per bin"""
+    grouping = df.groupby(list(by), observed=True, sort=True)
+    codes = grouping.ngroup().to_numpy()
+    counts = latency_histograms(codes, df['duration_to_reply'], grouping.ngroups)
+    index = grouping.size().index
+    return pd.DataFrame(counts, index=index, columns=pd.RangeIndex(N_LATENCY_BINS, name='bin'))
+
+
+def combine_latency_sketches(sketches: Iterable[pd.DataFrame], by: Sequence[str]) -> pd.DataFrame:
+    """Merge sketches, e.g. of different chats, into those of the coarser grouping by"""
+    sketches = pd.concat(list(sketches))
+    return sketches.groupby(level=list(by), observed=True, sort=True).sum()
+
+
+def sketch_quantiles(counts: np.ndarray, q: float) -> np.ndarray:
+    """
+    Estimated quantile q of every row of bin counts, as timedelta64[ns]. NaT for rows without reply times.
+    The quantile is interpolated log-linearly within its bin, and linearly within the first bin.
+    """
+    counts = np.atleast_2d(counts)
+    cumulative = np.cumsum(counts, axis=1)
+    n = cumulative[:, -1]
+    rank = np.maximum(q * n, np.minimum(n, 1))  # q = 0 gives the lowest non-empty bin
+    bins = np.minimum((cumulative < rank[:, None]).sum(axis=1), N_LATENCY_BINS - 1)
+    rows = np.arange(len(counts))
+    n_before = cumulative[rows, bins] - counts[rows, bins]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.clip((rank - n_before) / counts[rows, bins], 0, 1)
+    lower = np.concatenate([[0], LATENCY_BIN_EDGES_S[:-1]])[bins]
+    upper = LATENCY_BIN_EDGES_S[bins]
+    seconds = np.where(bins == 0, upper * fraction, lower * (upper / np.where(lower > 0, lower, 1)) ** fraction)
+    seconds[n == 0] = np.nan
+    return pd.to_timedelta(seconds, unit='s').to_numpy()
+
+
+def latency_quantiles(sketches: pd.DataFrame, quantiles: dict = REPLY_QUANTILES) -> pd.DataFrame:
+    """Quantile estimates of every sketch, one column per entry of quantiles"""
+    counts = sketches.to_numpy()
+    return pd.DataFrame({name: sketch_quantiles(counts, q) for name, q in quantiles.items()}, index=sketches.index)
+
+
+def bin_centers_s() -> np.ndarray:
+    """Geometric center of every bin in seconds, half a second for the first bin"""
+    lower = np.concatenate([[0], LATENCY_BIN_EDGES_S[:-1]])
+    return np.where(lower > 0, np.sqrt(lower * LATENCY_BIN_EDGES_S), LATENCY_BIN_EDGES_S / 2)
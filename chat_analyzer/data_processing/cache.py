@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+from typing import Optional, Iterable, Dict, Tuple, Sequence
+
+import pandas as pd
+
+from chat_analyzer import MY_CHAT_NAMES, SIGNAL_TIMEZONE
+
+# Bump whenever parsing or feature engineering changes its output, so stale cache entries are not reused.
+PIPELINE_VERSION = 2
+
+CACHE_SUFFIX = ".pkl"
+CUBE_SUFFIX = ".cube.pkl"
+SKETCHES_SUFFIX = ".sketches.pkl"
+CACHE_INDEX = "index.json"
+
+
+def file_content_hashes(filepath: str, prefix_bytes: Optional[int] = None,
+                        chunk_size: int = 1 << 20) -> Tuple[str, int, Optional[str]]:
+    """
+    Hash the file content in a single read.
+
+    Returns the hash of the whole file, its size in bytes and the hash of its first prefix_bytes. The latter is
+    None, if no prefix_bytes are given or the file is shorter.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    prefix_hash = digest.hexdigest() if prefix_bytes == 0 else None
+    n_bytes = 0
+    with open(filepath, 'rb') as file:
+        while True:
+            if prefix_bytes is not None and n_bytes < prefix_bytes:
+                chunk = file.read(min(chunk_size, prefix_bytes - n_bytes))
+            else:
+                chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            n_bytes += len(chunk)
+            if n_bytes == prefix_bytes:
+                prefix_hash = digest.hexdigest()
+    return digest.hexdigest(), n_bytes, prefix_hash
+
+
+def combined_content_hash(content_hashes: Sequence[str]) -> str:
+    """Content hash of a chat, which is processed from several exports"""
+    return _hash_json(list(content_hashes))
+
+
+def pipeline_config_key(merge_window_s: float) -> str:
+    """Key of everything besides the export content, which influences the processed chat"""
+    config = {
+        'pipeline_version': PIPELINE_VERSION,
+        'merge_window_s': merge_window_s,
+        'my_chat_names': sorted(MY_CHAT_NAMES),
+        'signal_timezone': SIGNAL_TIMEZONE,
+    }
+    return _hash_json(config)
+
+
+def chat_cache_key(content_hash: str, config_key: str, sources: Sequence[str]) -> str:
+    """
+    Key of a processed chat. Changes with the export content, the pipeline version and its config, and with the
+    paths of the exports, as the chat carries them as source and group chats are named after them.
+    """
+    return _hash_json({'content': content_hash, 'config': config_key, 'sources': list(sources)})
+
+
+def _hash_json(obj) -> str:
+    return hashlib.blake2b(json.dumps(obj, sort_keys=True).encode(), digest_size=20).hexdigest()
+
+
+def read_cached_chat(path_cache: str, key: str) -> Optional[pd.DataFrame]:
+    return _read_cache_entry(os.path.join(path_cache, key + CACHE_SUFFIX))
+
+
+def write_cached_chat(path_cache: str, key: str, df: pd.DataFrame):
+    _write_cache_entry(os.path.join(path_cache, key + CACHE_SUFFIX), df)
+
+
+def read_cached_cube(path_cache: str, key: str) -> Optional[pd.DataFrame]:
+    """Metrics cube of the cached chat with the same key"""
+    return _read_cache_entry(os.path.join(path_cache, key + CUBE_SUFFIX))
+
+
+def write_cached_cube(path_cache: str, key: str, cube: pd.DataFrame):
+    _write_cache_entry(os.path.join(path_cache, key + CUBE_SUFFIX), cube)
+
+
+def read_cached_sketches(path_cache: str, key: str) -> Optional[pd.DataFrame]:
+    """Latency sketches of the cached chat with the same key"""
+    return _read_cache_entry(os.path.join(path_cache, key + SKETCHES_SUFFIX))
+
+
+def write_cached_sketches(path_cache: str, key: str, sketches: pd.DataFrame):
+    _write_cache_entry(os.path.join(path_cache, key + SKETCHES_SUFFIX), sketches)
+
+
+def _read_cache_entry(path: str) -> Optional[pd.DataFrame]:
+    if not os.path.exists(path):
+        return None
+    return pd.read_pickle(path)
+
+
+def _write_cache_entry(path: str, df: pd.DataFrame):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)  # readers never see partially written entries
+
+
+def read_cache_index(path_cache: str) -> Dict[str, dict]:
+    """
+    Per export filename: cache key, content hash, config key, processed bytes, the byte offset of the
+    last message block, from which an appended export can be resumed, and the paths of all exports of the chat.
+    """
+    path = os.path.join(path_cache, CACHE_INDEX)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_cache_index(path_cache: str, index: Dict[str, dict]):
+    os.makedirs(path_cache, exist_ok=True)
+    path = os.path.join(path_cache, CACHE_INDEX)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def cached_keys_by_source(path_cache: str) -> Dict[str, str]:
+    """Cache key of the chat, which every export path is part of"""
+    return {source: entry['key'] for entry in read_cache_index(path_cache).values()
+            for source in entry.get('sources', ())}
+
+
+def prune_chat_cache(path_cache: str, keep: Iterable[str]):
+    """Remove entries of chats which changed or disappeared since they were cached."""
+    if not os.path.isdir(path_cache):
+        return
+    keep_files = {key + suffix for key in keep for suffix in [CACHE_SUFFIX, CUBE_SUFFIX, SKETCHES_SUFFIX]}
+    for filename in os.listdir(path_cache):
+        if filename.endswith(CACHE_SUFFIX) and filename not in keep_files:
+            os.remove(os.path.join(path_cache, filename))
@@ -1,34 +1,262 @@
 import re
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Union, BinaryIO, Sequence
 
+import numpy as np
 import pandas as pd
 from pandera.typing import DataFrame
 
 from chat_analyzer.utils.data_definitions import RawChat, CombinedChat
+from chat_analyzer.utils.validation import validate
+
+WHATSAPP_TIMESTAMP = r'\d{1,2}[/.]\d{1,2}[/.]\d{2,4},? \d{1,2}:\d{2}(?:[ \u202f][APap][Mm])?'
+WHATSAPP_MESSAGE_LINE = re.compile(rf'^({WHATSAPP_TIMESTAMP}) - ([^:]+): (.+)$')
+WHATSAPP_EVENT_LINE = re.compile(rf'^{WHATSAPP_TIMESTAMP} - ')
+WHATSAPP_TIMESTAMP_FIELDS = re.compile(r'^(\d{1,2})([/.])(\d{1,2})[/.](\d{2,4})(,?) \d{1,2}:\d{2}([ \u202f][APap][Mm])?$')
+WHATSAPP_DATETIME_FORMAT = "%d/%m/%Y, %H:%M"
+N_FORMAT_SAMPLE = 1_000  # Timestamps at the start of an export, from which its datetime format is detected
+REFERENCE_COLUMNS = ['source', 'offset']  # Where a message is found in its export, kept for the first of a block
 
 
 def parse_whatsapp(chat_txt) -> DataFrame[RawChat]:
-    pattern = r'^(\d{1,2}/\d{1,2}/\d{2,4},? \d{1,2}:\d{2}(?: [APap][Mm])?) - ([^:]+): (.+)$'
-    matches = re.findall(pattern, chat_txt, re.MULTILINE)
-    data = []
-    for timestamp, sender, message in matches:
-        data.append({'timestamp': timestamp, 'sender': sender, 'message': message})
-    df = pd.DataFrame(data)
-    df['datetime'] = pd.to_datetime(df['timestamp'], format="%d/%m/%Y, %H:%M", errors='raise')
-    df = df.drop(columns='timestamp')
+    # Lines end at \n only, like those read from the export file. str.splitlines also splits at characters such
+    # as \u2028, which are part of messages.
+    batches = list(iter_parse_whatsapp(chat_txt.split('\n')))
+    if not batches:
+        return empty_raw_chat()
+    df = pd.concat(batches, ignore_index=True)
+    return validate(df, RawChat)
+
+
+def iter_parse_whatsapp(lines: Iterable[Union[str, bytes]], batch_size: int = 100_000,
+                        start_offset: Optional[int] = None,
+                        datetime_format: Optional[str] = None) -> Iterator[DataFrame[RawChat]]:
+    """
+    Parse a WhatsApp export line by line and yield RawChat batches of at most `batch_size` messages.
+
+    Lines without a leading timestamp continue the previous message. Trailing blank lines of a message are
+    dropped, as are the lines of WhatsApp events such as the encryption disclaimer.
+    With a start_offset, lines are expected as utf-8 encoded bytes, read from that byte offset of the export.
+    The batches then contain an additional `offset` column with the byte offset at which each message starts.
+    Without a datetime_format, it is detected from the first timestamps and used for the entire export.
+    """
+    timestamps: List[str] = []
+    senders: List[str] = []
+    messages: List[str] = []
+    offsets: Optional[List[int]] = None if start_offset is None else []
+    offset = start_offset
+    current: Optional[List[str]] = None
+    blank_lines: List[str] = []
+    for line in lines:
+        line_offset = offset
+        if offset is not None:
+            offset += len(line)
+            line = line.decode('utf-8')
+        line = line.rstrip('\r\n')
+        match = WHATSAPP_MESSAGE_LINE.match(line)
+        if match is None and WHATSAPP_EVENT_LINE.match(line) is None:
+            if current is None:
+                continue
+            if line.strip():
+                current.extend(blank_lines)
+                current.append(line)
+                blank_lines = []
+            else:
+                blank_lines.append(line)
+            continue
+
+        if current is not None:
+            messages.append('\n'.join(current))
+            if len(messages) >= batch_size:
+                datetime_format = datetime_format or detect_whatsapp_datetime_format(timestamps[:N_FORMAT_SAMPLE])
+                yield _raw_chat_frame(timestamps, senders, messages, offsets, datetime_format)
+                timestamps, senders, messages = [], [], []
+                offsets = None if offsets is None else []
+        current, blank_lines = None, []
+
+        if match is not None:
+            timestamp, sender, message = match.groups()
+            timestamps.append(timestamp)
+            senders.append(sender)
+            if offsets is not None:
+                offsets.append(line_offset)
+            current = [message]
+
+    if current is not None:
+        messages.append('\n'.join(current))
+    if messages:
+        datetime_format = datetime_format or detect_whatsapp_datetime_format(timestamps[:N_FORMAT_SAMPLE])
+        yield _raw_chat_frame(timestamps, senders, messages, offsets, datetime_format)
+
+
+def iter_parse_whatsapp_file(file: BinaryIO, batch_size: int = 100_000) -> Iterator[DataFrame[RawChat]]:
+    """
+    Parse an export opened in binary mode from its current position on, tracking message byte offsets.
+
+    The datetime format is detected from the start of the export, also when parsing resumes further down.
+    """
+    start_offset = file.tell()
+    file.seek(0)
+    datetime_format = detect_whatsapp_datetime_format(sample_whatsapp_timestamps(file))
+    file.seek(start_offset)
+    yield from iter_parse_whatsapp(file, batch_size=batch_size, start_offset=start_offset,
+                                   datetime_format=datetime_format)
+
+
+def sample_whatsapp_timestamps(lines: Iterable[Union[str, bytes]], n_sample: int = N_FORMAT_SAMPLE) -> List[str]:
+    """Timestamps of the first n_sample messages"""
+    matches = (WHATSAPP_MESSAGE_LINE.match(line.decode('utf-8') if isinstance(line, bytes) else line)
+               for line in lines)
+    return [match.group(1) for match in islice(filter(None, matches), n_sample)]
+
+
+def detect_whatsapp_datetime_format(timestamps: Sequence[str]) -> str:
+    """
+    Exact datetime format of an export, detected from a sample of its timestamps.
+
+    Separators, year digits and the clock are taken from the first timestamp. Day and month order follow from the
+    first two date fields: only one of them can exceed 12. If neither does, the order in which the sample is
+    chronological wins. If both are, day first is assumed, unless the export uses the 12h clock of US locales.
+    """
+    if not timestamps:
+        return WHATSAPP_DATETIME_FORMAT
+    match = WHATSAPP_TIMESTAMP_FIELDS.match(timestamps[0])
+    if match is None or len(match.group(4)) not in (2, 4):
+        raise ValueError(f"Unknown WhatsApp timestamp format: {timestamps[0]}")
+    _, separator, _, year, comma, meridiem = match.groups()
+    year_format = '%Y' if len(year) == 4 else '%y'
+    time_format = '%H:%M' if meridiem is None else f'%I:%M{meridiem[0]}%p'
+    day_first, month_first = [f'{first}{separator}{second}{separator}{year_format}{comma} {time_format}'
+                              for first, second in [('%d', '%m'), ('%m', '%d')]]
+
+    fields = [match.groups() for match in map(WHATSAPP_TIMESTAMP_FIELDS.match, timestamps) if match is not None]
+    if any(int(first) > 12 for first, *_ in fields):
+        return day_first
+    if any(int(second) > 12 for _, _, second, *_ in fields):
+        return month_first
+    formats = [day_first, month_first] if meridiem is None else [month_first, day_first]
+    for datetime_format in formats:
+        if pd.to_datetime(pd.Series(timestamps), format=datetime_format).is_monotonic_increasing:
+            return datetime_format
+    return formats[0]
+
+
+def empty_raw_chat(with_offsets: bool = False) -> DataFrame[RawChat]:
+    """RawChat without messages, e.g. of an empty export"""
+    return _raw_chat_frame([], [], [], [] if with_offsets else None)
+
+
+def _raw_chat_frame(timestamps: List[str], senders: List[str], messages: List[str],
+                    offsets: Optional[List[int]] = None,
+                    datetime_format: str = WHATSAPP_DATETIME_FORMAT) -> DataFrame[RawChat]:
+    df = pd.DataFrame({'sender': pd.Series(senders, dtype=object), 'message': pd.Series(messages, dtype=object)})
+    df['datetime'] = pd.to_datetime(pd.Series(timestamps, dtype=object), format=datetime_format, errors='raise')
+    if offsets is not None:
+        df['offset'] = pd.Series(offsets, dtype='int64')
     # df['sender'] = df['sender'].astype("category")
-    return DataFrame[RawChat](df)
+    return validate(df, RawChat)
+
+
+def merge_sorted_chats(*streams: Iterable[DataFrame[RawChat]]) -> Iterator[DataFrame[RawChat]]:
+    """
+    Merge streams of RawChat batches, each sorted by datetime, into one stream sorted by datetime.
+
+    Every step emits the messages up to the earliest last datetime among the current batches, so only one batch
+    per stream is held. Messages of the same time are emitted in the order of the streams.
+    """
+    iterators = [iter(stream) for stream in streams]
+    pending = [_next_batch(iterator) for iterator in iterators]
+    while any(batch is not None for batch in pending):
+        active = [i for i, batch in enumerate(pending) if batch is not None]
+        until = min(pending[i]['datetime'].iloc[-1] for i in active)
+        merged = None
+        for i in active:
+            n = pending[i]['datetime'].searchsorted(until, side='right')
+            head, pending[i] = pending[i].iloc[:n], pending[i].iloc[n:]
+            merged = head if merged is None else _merge_sorted(merged, head)
+            if pending[i].empty:
+                pending[i] = _next_batch(iterators[i])
+        yield validate(merged, RawChat)
+
+
+def _next_batch(iterator: Iterator[pd.DataFrame]) -> Optional[pd.DataFrame]:
+    return next((batch for batch in iterator if not batch.empty), None)
+
+
+def _merge_sorted(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    """Interleave two frames sorted by datetime, placing rows of b behind rows of a of the same time"""
+    positions_b = np.searchsorted(a['datetime'].to_numpy(), b['datetime'].to_numpy(), side='right') + np.arange(len(b))
+    is_b = np.zeros(len(a) + len(b), dtype=bool)
+    is_b[positions_b] = True
+    order = np.empty(len(is_b), dtype=np.int64)
+    order[~is_b] = np.arange(len(a))
+    order[is_b] = len(a) + np.arange(len(b))
+    return pd.concat([a, b], ignore_index=True).take(order).reset_index(drop=True)
+
+
+def consecutive_block_ids(df: DataFrame[RawChat], merge_window_s: float = 60) -> pd.Series:
+    """Number of the block each message is merged into by merge_consecutive_msg"""
+    return pd.Series(np.cumsum(_is_block_start(df, merge_window_s)), index=df.index)
 
 
 def merge_consecutive_msg(df: DataFrame[RawChat], merge_window_s: float = 60) -> DataFrame[CombinedChat]:
-    mask_time_delta = df['datetime'].diff() > pd.Timedelta(seconds=merge_window_s)
-    mask_same_sender = df["sender"].shift() != df["sender"]
-    mask_consecutive_messages = mask_time_delta | mask_same_sender
-    df_combined = df.groupby(mask_consecutive_messages.cumsum()).agg(
+    """
+    Merge consecutive messages of a sender, sent within merge_window_s of the previous one, into one block.
+
+    Equivalent of merge_consecutive_msg_groupby. The block boundaries are determined with NumPy and the first and
+    last datetime taken from them. Messages of multi message blocks are joined into one string at once, which is
+    then sliced per block. Single messages are kept as they are.
+    """
+    is_block_start = _is_block_start(df, merge_window_s)
+    starts = np.flatnonzero(is_block_start)
+    n_block = np.diff(np.append(starts, len(df)))
+    ends = starts + n_block - 1
+
+    messages = df['message'].to_numpy(dtype=object)
+    merged = messages[starts]
+    is_multi = n_block > 1
+    if is_multi.any():
+        in_multi = np.repeat(is_multi, n_block)
+        text = '\n'.join(messages[in_multi])
+        ends_of_multi = np.cumsum(df['message'].str.len().to_numpy()[in_multi] + 1)  # char after each message
+        block_ends = ends_of_multi[np.cumsum(n_block[is_multi]) - 1]
+        block_starts = np.append(0, block_ends[:-1])
+        merged[is_multi] = [text[a:b - 1] for a, b in zip(block_starts.tolist(), block_ends.tolist())]
+
+    datetime = df['datetime'].to_numpy('datetime64[ns]')
+    df_combined = pd.DataFrame({
+        'datetime': datetime[starts],
+        'sender': df['sender'].to_numpy(dtype=object)[starts],
+        'message': merged,
+        'n_block': n_block.astype(np.int64),
+        'datetime_last': datetime[ends],
+    })
+    df_combined['block_duration'] = df_combined['datetime_last'] - df_combined['datetime']
+    for column in REFERENCE_COLUMNS:
+        if column in df:
+            df_combined[column] = df[column].to_numpy()[starts]
+    return validate(df_combined, CombinedChat)
+
+
+def merge_consecutive_msg_groupby(df: DataFrame[RawChat], merge_window_s: float = 60) -> DataFrame[CombinedChat]:
+    """Reference implementation of merge_consecutive_msg, joining the messages of every block in a groupby"""
+    df_combined = df.groupby(consecutive_block_ids(df, merge_window_s)).agg(
         datetime=('datetime', 'first'),
         sender=('sender', 'first'),
         message=('message', '\n'.join),
         n_block=('message', 'count'),
         datetime_last=('datetime', 'last'),
+        **{column: (column, 'first') for column in REFERENCE_COLUMNS if column in df},
     ).reset_index(drop=True)
-    df_combined['block_duration'] = df_combined['datetime_last'] - df_combined['datetime']
-    return DataFrame[CombinedChat](df_combined)
+    df_combined.insert(5, 'block_duration', df_combined['datetime_last'] - df_combined['datetime'])
+    return validate(df_combined, CombinedChat)
+
+
+def _is_block_start(df: DataFrame[RawChat], merge_window_s: float) -> np.ndarray:
+    """Messages by another sender than the previous one, or sent more than merge_window_s after it"""
+    datetime = df['datetime'].to_numpy('datetime64[ns]')
+    sender = df['sender'].to_numpy(dtype=object)
+    is_block_start = np.ones(len(df), dtype=bool)
+    np.greater(np.diff(datetime), pd.Timedelta(seconds=merge_window_s).to_timedelta64(), out=is_block_start[1:])
+    is_block_start[1:] |= sender[1:] != sender[:-1]
+    return is_block_start
@@ -1,31 +1,57 @@
-from typing import Dict, List
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import emoji
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from pandera.typing import DataFrame
 
 from chat_analyzer import MY_CHAT_NAMES
-from chat_analyzer.utils.data_definitions import CombinedChat, ChatFeatures, SingleChat, cat_weekdays, cat_months
-
-
-def extract_single_chat_features(df) -> DataFrame[SingleChat]:
-    """Features which need to be determined in the context of a single chat"""
-    chat_participants = df.sender.unique()
-    df['chat'] = ', '.join(p for p in chat_participants if p not in MY_CHAT_NAMES)
-    if len(chat_participants) != 2:
-        raise NotImplementedError(f"Group Chats and Monologues are not supported. "
-                                  f"Your chat participants: {chat_participants}")
-    a, b = chat_participants
-    sender_to_receiver: dict = {a: b, b: a}
-    df['receiver'] = df['sender'].map(sender_to_receiver)
-    df['duration_since_their_last'] = determine_duration_since_their_last_message(df)
-    df['duration_to_reply'] = determine_duration_to_reply(df)
-    return DataFrame[SingleChat](df)
+from chat_analyzer.utils.data_definitions import CombinedChat, ChatFeatures, SingleChat, cat_weekdays, cat_months, \
+    CompactChatFeatures
+from chat_analyzer.utils.validation import validate
+
+
+def extract_single_chat_features(df, chat_participants: Optional[Sequence[str]] = None,
+                                 group_name: Optional[str] = None) -> DataFrame[SingleChat]:
+    """
+    Features which need to be determined in the context of a single chat.
+
+    chat_participants defaults to the senders of df, in order of appearance. Pass them explicitly, if df is
+    only an excerpt of the chat. In group chats, the receiver of a message is the sender of the preceding run of
+    messages, so the reply features describe the sender pair. Group chats are named group_name, which defaults
+    to the names of their participants. df itself is left unchanged.
+    """
+    df = df.copy(deep=False)  # new columns only, the existing ones are shared
+    if chat_participants is None:
+        chat_participants = df.sender.unique()
+    if len(chat_participants) < 2:
+        raise NotImplementedError(f"Monologues are not supported. Your chat participants: {chat_participants}")
+    is_group_chat = len(chat_participants) > 2
+    if is_group_chat and group_name is not None:
+        df['chat'] = group_name
+    else:
+        df['chat'] = ', '.join(p for p in chat_participants if p not in MY_CHAT_NAMES)
+    sender_codes = pd.Categorical(df['sender'], categories=chat_participants).codes
+    if is_group_chat:
+        receiver_codes = preceding_sender_codes(sender_codes)
+    else:
+        receiver_codes = np.where(sender_codes < 0, -1, 1 - sender_codes)
+    receivers = np.append(np.asarray(chat_participants, dtype=object), None)  # code -1 resolves to None
+    df['receiver'] = receivers[receiver_codes]
+    since_their_last, to_reply = reply_time_kernel(sender_codes,
+                                                   df['datetime'].to_numpy('datetime64[ns]').view(np.int64),
+                                                   df['datetime_last'].to_numpy('datetime64[ns]').view(np.int64))
+    df['duration_since_their_last'] = pd.Series(since_their_last.view('timedelta64[ns]'), index=df.index)
+    df['duration_to_reply'] = pd.Series(to_reply.view('timedelta64[ns]'), index=df.index)
+    return validate(df, SingleChat)
 
 
 def add_features(df: DataFrame[CombinedChat]) -> DataFrame[ChatFeatures]:
-    """Features which can be determined without the context of the chat"""
+    """Features which can be determined without the context of the chat. df itself is left unchanged."""
+    df = df.copy(deep=False)
     id_to_month: Dict[int, str] = dict(enumerate(cat_months.categories))
     df['month'] = df.datetime.dt.month.map(id_to_month).astype(cat_months)
 
@@ -38,8 +64,43 @@ def add_features(df: DataFrame[CombinedChat]) -> DataFrame[ChatFeatures]:
 
     df['n_symbols'] = df.message.str.len()
     df['emojis'] = extract_emojis(df.message)
-    df['n_emojis'] = df.emojis.apply(len)
-    return DataFrame[ChatFeatures](df)
+    df['n_emojis'] = df.emojis.str.len()
+    return validate(df, ChatFeatures)
+
+
+def compact_chat_features(df: DataFrame[ChatFeatures]) -> DataFrame[CompactChatFeatures]:
+    """
+    Memory efficient representation of the chat features.
+
+    Names become categoricals, the week an integer year * 100 + week, counts the smallest fitting unsigned
+    integers. Emoji lists are stored as one arrow list array, i.e. offsets into dictionary encoded emojis.
+    """
+    df = df.copy()
+    for column in ['sender', 'receiver', 'chat', 'source']:
+        if column in df:
+            df[column] = df[column].astype('category')
+    df['week'] = week_index(df.datetime)
+    for column in ['n_block', 'n_symbols', 'n_emojis']:
+        df[column] = pd.to_numeric(df[column], downcast='unsigned')
+    df['emojis'] = emoji_list_array(df.emojis)
+    return validate(df, CompactChatFeatures)
+
+
+def week_index(s: pd.Series) -> pd.Series:
+    """Integer equivalent of strftime('%Y%U'), the week of the year with weeks starting on Sunday"""
+    day_of_year = s.dt.dayofyear - 1
+    weekday_from_sunday = (s.dt.dayofweek + 1) % 7
+    week = (day_of_year + 7 - weekday_from_sunday) // 7
+    return (s.dt.year * 100 + week).astype(np.uint32)
+
+
+def emoji_list_array(emojis: pd.Series) -> pd.Series:
+    lengths = emojis.str.len().to_numpy()
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    values = pa.array([e for row in emojis for e in row], type=pa.string()).dictionary_encode()
+    array = pa.ListArray.from_arrays(pa.array(offsets), values)
+    return pd.Series(pd.arrays.ArrowExtensionArray(array), index=emojis.index)
 
 
 def determine_duration_since_their_last_message(df) -> pd.Series:
@@ -58,11 +119,132 @@ def determine_duration_to_reply(df) -> pd.Series:
     return time_to_respond
 
 
-def extract_emojis(s: pd.Series):
-    return s.apply(extract_string_emojis)
+_NAT = np.iinfo(np.int64).min
+
+
+def reply_time_kernel(sender_codes: np.ndarray, datetime: np.ndarray,
+                      datetime_last: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fused equivalent of determine_duration_since_their_last_message and determine_duration_to_reply.
+
+    Takes integer sender codes and the datetimes as int64 nanoseconds, NaT being the int64 minimum. The run
+    boundaries are determined once and the per run extrema of datetime_last reduced with ufunc.reduceat, so no
+    groupby is needed. Returns both durations in int64 nanoseconds.
+    Both durations only depend on where the sender changes and refer to the preceding run of messages. In group
+    chats, they are therefore those of the sender and the receiver given by preceding_sender_codes.
+    """
+    n = len(sender_codes)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    is_run_start = _is_run_start(sender_codes)
+
+    # Time to reply: first message of a run minus the latest message of the previous run. NaT sorts first,
+    # so the maximum skips it unless the whole run is NaT.
+    run_starts = np.flatnonzero(is_run_start)
+    run_max = np.maximum.reduceat(datetime_last, run_starts)
+    to_reply = np.full(n, _NAT, dtype=np.int64)
+    to_reply[run_starts[1:]] = _subtract_datetimes(datetime[run_starts[1:]], run_max[:-1])
+    to_reply[0] = 0
+
+    # Time since their last message: the earliest message of the group of the previous row. Groups start at
+    # the last message of every run, so they span the last message of their run up to the end of ours.
+    is_group_start = np.ones(n, dtype=bool)
+    is_group_start[1:-1] = is_run_start[2:]
+    group_starts = np.flatnonzero(is_group_start)
+    max_int = np.iinfo(np.int64).max
+    group_min = np.minimum.reduceat(np.where(datetime_last == _NAT, max_int, datetime_last), group_starts)
+    group_min[group_min == max_int] = _NAT
+    group_of_row = np.cumsum(is_group_start) - 1
+    since_their_last = np.zeros(n, dtype=np.int64)
+    since_their_last[1:] = _subtract_datetimes(datetime[1:], group_min[group_of_row[:-1]])
+    since_their_last[since_their_last == _NAT] = 0
+    return since_their_last, to_reply
+
+
+def preceding_sender_codes(sender_codes: np.ndarray) -> np.ndarray:
+    """Sender code of the preceding run of messages for every message, -1 within the first run"""
+    if len(sender_codes) == 0:
+        return sender_codes.copy()
+    run_starts = np.flatnonzero(_is_run_start(sender_codes))
+    preceding = np.concatenate([[-1], sender_codes[run_starts[:-1]]]).astype(sender_codes.dtype)
+    return np.repeat(preceding, np.diff(np.append(run_starts, len(sender_codes))))
+
+
+def _is_run_start(sender_codes: np.ndarray) -> np.ndarray:
+    is_run_start = np.empty(len(sender_codes), dtype=bool)
+    is_run_start[0] = True
+    np.not_equal(sender_codes[1:], sender_codes[:-1], out=is_run_start[1:])
+    return is_run_start
+
+
+def _subtract_datetimes(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    difference = a - b
+    difference[(a == _NAT) | (b == _NAT)] = _NAT
+    return difference
+
+
+def extract_emojis(s: pd.Series) -> pd.Series:
+    """Emojis of every message as list. Matches extract_string_emojis, but runs as one regex scan per message."""
+    return s.str.findall(emoji_pattern())
+
+
+def extract_emojis_long(s: pd.Series) -> pd.Series:
+    """Emojis as long series, indexed by the label of the message and the number of the emoji within it"""
+    return s.str.extractall(f'({emoji_pattern().pattern})')[0].rename('emoji')
+
+
+def count_emojis(s: pd.Series) -> pd.Series:
+    """Number of occurrences of every emoji across all messages"""
+    return extract_emojis_long(s).value_counts()
 
 
 def extract_string_emojis(text: str) -> List[str]:
     return [e.chars for e in emoji.analyze(text)]
 
 
+@lru_cache(maxsize=None)
+def emoji_pattern() -> re.Pattern:
+    """
+    Regex matching the emojis of the emoji package, including non-RGI sequences of emojis joined by ZWJ.
+
+    The emojis are compiled into a trie, so alternatives sharing a prefix are only tried once and the longest
+    emoji wins. A lookahead on the possible first characters lets most positions of a text fail immediately.
+    """
+    trie: dict = {}
+    for e in emoji.EMOJI_DATA:
+        node = trie
+        for char in e:
+            node = node.setdefault(char, {})
+        node[_TRIE_END] = {}
+
+    first_chars = sorted(ord(char) for char in trie)
+    ranges = [[first_chars[0], first_chars[0]]]
+    for code in first_chars[1:]:
+        if code == ranges[-1][1] + 1:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    first_char_class = ''.join(re.escape(chr(a)) if a == b else f'{re.escape(chr(a))}-{re.escape(chr(b))}'
+                               for a, b in ranges)
+
+    single_emoji = _trie_to_regex(trie)
+    return re.compile(f'(?=[{first_char_class}]){single_emoji}(?:{_ZWJ}{single_emoji})*')
+
+
+_TRIE_END = ''
+_ZWJ = '\u200d'
+
+
+def _trie_to_regex(node: dict) -> str:
+    leaves = [char for char, child in sorted(node.items()) if char != _TRIE_END and list(child) == [_TRIE_END]]
+    alternatives = [re.escape(char) + _trie_to_regex(child) for char, child in sorted(node.items())
+                    if char != _TRIE_END and list(child) != [_TRIE_END]]
+    if len(leaves) == 1:
+        alternatives.append(re.escape(leaves[0]))
+    elif leaves:
+        alternatives.append(f"[{''.join(re.escape(char) for char in leaves)}]")
+
+    if not alternatives:
+        return ''
+    body = alternatives[0] if len(alternatives) == 1 else f"(?:{'|'.join(alternatives)})"
+    return f'(?:{body})?' if _TRIE_END in node else body
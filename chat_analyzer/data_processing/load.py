@@ -1,44 +1,424 @@
 import os
 import datetime
-from typing import Optional
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional, List, Dict, Tuple, NamedTuple, Callable, Collection
 
+import numpy as np
 import pandas as pd
 from pandera.typing import DataFrame
 
-from chat_analyzer.data_processing.feature_engineering import add_features, extract_single_chat_features
-from chat_analyzer.data_processing.extract import parse_whatsapp, merge_consecutive_msg
-from chat_analyzer.utils.data_definitions import SingleChat
+from chat_analyzer import N_INGESTION_WORKERS, MERGE_WINDOW_S, COMPACT_CHAT_FEATURES, MERGE_SIGNAL_CHATS
+from chat_analyzer.analysis.cube import build_metrics_cube, combine_metrics_cubes, update_metrics_cube, \
+    write_metrics_cube, build_cube_sketches, update_cube_sketches, write_cube_sketches, CUBE_SKETCH_KEYS
+from chat_analyzer.analysis.latency import combine_latency_sketches
+from chat_analyzer.data_processing.cache import chat_cache_key, read_cached_chat, write_cached_chat, \
+    prune_chat_cache, pipeline_config_key, file_content_hashes, read_cache_index, write_cache_index, \
+    read_cached_cube, write_cached_cube, combined_content_hash, read_cached_sketches, write_cached_sketches, \
+    cached_keys_by_source
+from chat_analyzer.data_processing.feature_engineering import add_features, extract_single_chat_features, \
+    compact_chat_features
+from chat_analyzer.data_processing.extract import parse_whatsapp, merge_consecutive_msg, iter_parse_whatsapp_file, \
+    consecutive_block_ids, merge_sorted_chats, empty_raw_chat
+from chat_analyzer.data_processing.signal_export import iter_parse_signal_file, list_signal_exports, signal_chat_name
+from chat_analyzer.data_processing.search_index import list_index_chats
+from chat_analyzer.data_processing.store import write_parquet_store, replace_store_chats, list_store_chats, \
+    store_chats_by_export, read_store_sources, write_store_sources
+from chat_analyzer.utils import instrumentation
+from chat_analyzer.utils.data_definitions import SingleChat, RawChat, ChatFeatures
+from chat_analyzer.utils.validation import validate
 
+WHATSAPP_EXPORT_PREFIX = "WhatsApp Chat with "
 
-def load_whatsapp_chat(chat_txt: str) -> DataFrame[SingleChat]:
+
+class ChatIngestionError(Exception):
+    """Raised after ingestion, if one or more chat exports could not be processed"""
+
+    def __init__(self, errors: Dict[str, BaseException], failed_exports: Optional[List[str]] = None):
+        """failed_exports are all export files of the failed chats, by default the filepaths of errors"""
+        self.errors = errors
+        self.failed_exports = list(errors) if failed_exports is None else failed_exports
+        details = "\n".join(f"  {filepath}: {type(e).__name__}: {e}" for filepath, e in errors.items())
+        super().__init__(f"{len(errors)} chat export(s) failed to process:\n{details}")
+
+
+class ProcessedChat(NamedTuple):
+    df: DataFrame[ChatFeatures]
+    n_bytes: int  # Bytes of the export that were processed
+    resume_offset: Optional[int]  # Byte offset of the first message of the last block, from which appends are
+    # processed. None, if the chat cannot be resumed.
+    n_unchanged: int = 0  # Leading rows, which equal those of the previously processed chat
+
+
+def load_whatsapp_chat(chat_txt: str, merge_window_s: float = MERGE_WINDOW_S) -> DataFrame[SingleChat]:
     df = parse_whatsapp(chat_txt)
-    df = merge_consecutive_msg(df, merge_window_s=60)
-    df = extract_single_chat_features(df)
-    return DataFrame[SingleChat](df)
-
-
-def aggregate_whatsapp_conversations(path_whatsapp_chats: str) -> Optional[pd.DataFrame]:
-    dfs = []
-    for file in os.listdir(path_whatsapp_chats):
-        filename = os.fsdecode(file)
-        print(filename)
-        if filename.endswith(".txt"):
-            filepath = os.path.join(path_whatsapp_chats, filename)
-            with open(filepath, 'r', encoding='utf-8') as file:
-                chat_export = file.read()
-
-            df_single = load_whatsapp_chat(chat_export)
-            df_chat = add_features(df_single)
-            dfs.append(df_chat)
-    df = pd.concat(dfs)
-    df = add_features(df)
+    return _process_raw_chat(df, merge_window_s)
+
+
+def whatsapp_chat_name(filepath: str) -> str:
+    """Name of the chat, as given by the filename WhatsApp exports it under"""
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    return name[len(WHATSAPP_EXPORT_PREFIX):] if name.startswith(WHATSAPP_EXPORT_PREFIX) else name
+
+
+def read_whatsapp_file(filepath: str, start_offset: int = 0,
+                       batch_size: int = 100_000) -> Tuple[DataFrame[RawChat], int]:
+    """
+    Parse the export from the byte offset start_offset on. Returns the messages and the bytes read up to.
+    The messages are empty, if there are none, e.g. in an empty export.
+    """
+    with instrumentation.stage('parse', chat=os.path.basename(filepath)) as stage, open(filepath, 'rb') as file:
+        file.seek(start_offset)
+        batches = list(iter_parse_whatsapp_file(file, batch_size=batch_size))  # validated batch by batch
+        df = pd.concat(batches, ignore_index=True) if batches else empty_raw_chat(with_offsets=True)
+        n_bytes = file.tell()
+        stage.rows_out = len(df)
+    return df.assign(source=filepath), n_bytes
+
+
+def _process_raw_chat(df: DataFrame[RawChat], merge_window_s: float, chat: Optional[str] = None,
+                      group_name: Optional[str] = None) -> DataFrame[SingleChat]:
+    if df.empty:
+        raise ValueError(f"No messages found in {chat or 'the export'}")
+    with instrumentation.stage('merge', chat=chat, rows_in=len(df)) as stage:
+        df = merge_consecutive_msg(df, merge_window_s=merge_window_s)
+        stage.rows_out = len(df)
+    with instrumentation.stage('single_chat_features', chat=chat, rows_in=len(df)) as stage:
+        df = extract_single_chat_features(df, group_name=group_name)
+        stage.rows_out = len(df)
+    return validate(df, SingleChat)
+
+
+def _add_features(df: DataFrame[SingleChat], chat: Optional[str] = None) -> DataFrame[ChatFeatures]:
+    with instrumentation.stage('add_features', chat=chat, rows_in=len(df)) as stage:
+        df = add_features(df)
+        stage.rows_out = len(df)
     return df
 
 
-def agg_to_pkl(path_whatsapp, path_signal, path_processed_pkl) -> str:
-    df = aggregate_whatsapp_conversations(path_whatsapp)
+def process_whatsapp_file(filepath: str, merge_window_s: float = MERGE_WINDOW_S) -> ProcessedChat:
+    """Entire per-chat pipeline of one export. Runs standalone, so it can be sent to a worker process."""
+    chat = os.path.basename(filepath)
+    df_raw, n_bytes = read_whatsapp_file(filepath)
+    df_single = _process_raw_chat(df_raw, merge_window_s, chat=chat, group_name=whatsapp_chat_name(filepath))
+    return ProcessedChat(_add_features(df_single, chat=chat), n_bytes, _last_block_offset(df_raw, merge_window_s))
+
+
+def process_signal_file(filepath: str, merge_window_s: float = MERGE_WINDOW_S,
+                        path_whatsapp_file: Optional[str] = None) -> ProcessedChat:
+    """
+    Entire per-chat pipeline of a Signal export. The messages of path_whatsapp_file are merged into the chat
+    in time order. Such chats are always processed entirely.
+    """
+    chat = os.path.basename(filepath)
+    filepaths = [filepath] if path_whatsapp_file is None else [path_whatsapp_file, filepath]
+    with instrumentation.stage('parse', chat=chat) as stage, ExitStack() as files:
+        streams = [(batch.assign(offset=-1, source=filepath) for batch in iter_parse_signal_file(filepath))]
+        if path_whatsapp_file is not None:
+            file = files.enter_context(open(path_whatsapp_file, 'rb'))
+            streams.insert(0, (batch.assign(source=path_whatsapp_file) for batch in iter_parse_whatsapp_file(file)))
+        df_raw = pd.concat(merge_sorted_chats(*streams), ignore_index=True)
+        stage.rows_out = len(df_raw)
+    df_single = _process_raw_chat(df_raw, merge_window_s, chat=chat, group_name=signal_chat_name(filepath))
+    n_bytes = sum(os.path.getsize(path) for path in filepaths)
+    return ProcessedChat(_add_features(df_single, chat=chat), n_bytes, resume_offset=None)
+
+
+def extend_whatsapp_file(filepath: str, df_previous: DataFrame[ChatFeatures], resume_offset: int,
+                         merge_window_s: float = MERGE_WINDOW_S) -> ProcessedChat:
+    """
+    Process an export, which got appended to since df_previous was processed from it.
+
+    Only the messages from resume_offset on are parsed. They replace the last block of df_previous, which
+    the appended messages could extend. Reply features of the new blocks are determined with the preceding two
+    sender runs of df_previous as context. The result equals processing the entire export again. Chats which
+    turn from a conversation of two into a group chat are processed entirely, as all their receivers change.
+    """
+    chat = os.path.basename(filepath)
+    df_raw, n_bytes = read_whatsapp_file(filepath, start_offset=resume_offset)
+    with instrumentation.stage('merge', chat=chat, rows_in=len(df_raw)) as stage:
+        df_tail = merge_consecutive_msg(df_raw, merge_window_s=merge_window_s)
+        stage.rows_out = len(df_tail)
+    df_kept = df_previous.iloc[:-1]
+
+    run_starts = np.flatnonzero(df_kept.sender.ne(df_kept.sender.shift()).to_numpy())
+    context_start = run_starts[-2] if len(run_starts) >= 2 else 0
+    df_context = df_kept.iloc[context_start:][df_tail.columns]
+    n_context = len(df_context)
+
+    chat_participants = pd.unique(pd.concat([df_previous.sender, df_tail.sender]))
+    if len(chat_participants) > 2 and df_previous.sender.nunique() <= 2:
+        return process_whatsapp_file(filepath, merge_window_s)
+    df_window = pd.concat([df_context, df_tail], ignore_index=True)
+    with instrumentation.stage('single_chat_features', chat=chat, rows_in=len(df_window)) as stage:
+        df_window = extract_single_chat_features(df_window, chat_participants=chat_participants,
+                                                 group_name=whatsapp_chat_name(filepath))
+        stage.rows_out = len(df_window)
+    df_new = _add_features(df_window.iloc[n_context:].reset_index(drop=True), chat=chat)
+
+    df = pd.concat([df_kept, df_new], ignore_index=True)
+    return ProcessedChat(validate(df, ChatFeatures), n_bytes, _last_block_offset(df_raw, merge_window_s),
+                         n_unchanged=len(df_kept))
+
+
+def _last_block_offset(df_raw: DataFrame[RawChat], merge_window_s: float) -> int:
+    block_ids = consecutive_block_ids(df_raw, merge_window_s)
+    return int(df_raw['offset'][block_ids == block_ids.iloc[-1]].iloc[0])
+
+
+def list_whatsapp_exports(path_whatsapp_chats: str) -> List[str]:
+    filenames = sorted(os.fsdecode(f) for f in os.listdir(path_whatsapp_chats))
+    return [os.path.join(path_whatsapp_chats, f) for f in filenames if f.endswith(".txt")]
+
+
+def aggregate_whatsapp_conversations(path_whatsapp_chats: str,
+                                     n_workers: Optional[int] = N_INGESTION_WORKERS,
+                                     path_cache: Optional[str] = None,
+                                     merge_window_s: float = MERGE_WINDOW_S,
+                                     compact: bool = COMPACT_CHAT_FEATURES,
+                                     path_metrics_cube: Optional[str] = None,
+                                     path_signal_chats: Optional[str] = None,
+                                     merge_signal_chats: bool = MERGE_SIGNAL_CHATS,
+                                     exports: Optional[Collection[str]] = None) -> Optional[pd.DataFrame]:
+    """
+    Process every chat export in the folder and concat them in filename order.
+
+    With n_workers other than 1, every chat is processed in its own worker process. None uses all cores.
+    Failing chats do not abort the others. They are collected and raised together as ChatIngestionError.
+    With a path_cache, chats whose export and pipeline config are unchanged since the last run are read from
+    the cache instead of being processed again. Exports which were only appended to are processed from their
+    last cached message block on.
+    With compact, the result is converted to CompactChatFeatures.
+    With a path_metrics_cube, the metrics cube of all chats is written there, and their latency sketches next to
+    it. Along with a path_cache, the cube and sketches of every chat are cached, so only those of changed chats
+    are built, and those of appended chats updated.
+    The sigtop exports in path_signal_chats are processed after the WhatsApp chats. With merge_signal_chats, a
+    Signal export named like a WhatsApp chat is merged into it.
+    With exports, only the chats of these export paths are processed and returned, None if there are none. The
+    cache entries of all other chats are kept, and their cached cubes are part of the metrics cube.
+    """
+    if exports is not None and path_metrics_cube is not None and path_cache is None:
+        raise ValueError("The metrics cube of all chats needs the cached cubes of the chats not in exports")
+    filepaths = list_whatsapp_exports(path_whatsapp_chats)
+    results: Dict[str, pd.DataFrame] = {}
+    jobs: Dict[str, Tuple[Callable[..., ProcessedChat], tuple]] = {
+        filepath: (process_whatsapp_file, (filepath, merge_window_s)) for filepath in filepaths}
+    sources: Dict[str, List[str]] = {filepath: [filepath] for filepath in filepaths}  # exports of every chat
+    index_names: Dict[str, str] = {filepath: os.path.basename(filepath) for filepath in filepaths}
+    if path_signal_chats is not None and os.path.isdir(path_signal_chats):
+        whatsapp_chats = {whatsapp_chat_name(filepath): filepath for filepath in filepaths} \
+            if merge_signal_chats else {}
+        for signal_filepath in list_signal_exports(path_signal_chats):
+            filepath = whatsapp_chats.get(signal_chat_name(signal_filepath))
+            if filepath is None:
+                filepaths.append(signal_filepath)
+                sources[signal_filepath] = [signal_filepath]
+                index_names[signal_filepath] = os.path.join('signal', os.path.basename(signal_filepath))
+                jobs[signal_filepath] = (process_signal_file, (signal_filepath, merge_window_s))
+            else:
+                sources[filepath].append(signal_filepath)
+                jobs[filepath] = (process_signal_file, (signal_filepath, merge_window_s, filepath))
+    other_filepaths: List[str] = []  # exports of the chats, which are not processed with exports given
+    if exports is not None:
+        other_filepaths = [filepath for filepath in filepaths if not set(sources[filepath]) & set(exports)]
+        filepaths = [filepath for filepath in filepaths if filepath not in other_filepaths]
+        jobs = {filepath: job for filepath, job in jobs.items() if filepath in filepaths}
+
+    index: Dict[str, dict] = {}
+    extended: Dict[str, Tuple[str, pd.DataFrame]] = {}  # cache key and chat of appended exports
+    if path_cache is not None:
+        config_key = pipeline_config_key(merge_window_s)
+        previous_index = read_cache_index(path_cache)
+        for filepath in filepaths:
+            previous = previous_index.get(index_names[filepath])
+            if previous is not None and previous['config_key'] != config_key:
+                previous = None
+            if sources[filepath] == [filepath]:
+                content_hash, n_bytes, prefix_hash = file_content_hashes(
+                    filepath, prefix_bytes=None if previous is None else previous['n_bytes'])
+            else:
+                content_hashes = [file_content_hashes(source) for source in sources[filepath]]
+                content_hash = combined_content_hash([h for h, _, _ in content_hashes])
+                n_bytes, prefix_hash = sum(n for _, n, _ in content_hashes), None
+            key = chat_cache_key(content_hash, config_key, sources[filepath])
+            index[filepath] = {'key': key, 'content_hash': content_hash, 'config_key': config_key,
+                               'n_bytes': n_bytes, 'resume_offset': None, 'sources': sources[filepath]}
+
+            df_cached = read_cached_chat(path_cache, key)
+            if df_cached is not None:
+                results[filepath] = df_cached
+                del jobs[filepath]
+                if previous is not None and previous['key'] == key:
+                    index[filepath] = previous
+                continue
+
+            appended = previous is not None and previous['resume_offset'] is not None and \
+                prefix_hash is not None and prefix_hash == previous['content_hash']
+            df_previous = read_cached_chat(path_cache, previous['key']) if appended else None
+            if df_previous is not None:
+                jobs[filepath] = (extend_whatsapp_file,
+                                  (filepath, df_previous, previous['resume_offset'], merge_window_s))
+                extended[filepath] = (previous['key'], df_previous)
+
+    processed, errors = run_chat_jobs(jobs, n_workers)
+    results.update({filepath: chat.df for filepath, chat in processed.items()})
+    cubes: Dict[str, Tuple[pd.DataFrame, pd.DataFrame]] = {}  # metrics cube and latency sketches of every chat
+    if path_cache is not None:
+        for filepath, chat in processed.items():
+            entry = index[filepath]
+            write_cached_chat(path_cache, entry['key'], chat.df)
+            if chat.n_bytes == entry['n_bytes']:  # export was not written to while it got processed
+                entry['resume_offset'] = chat.resume_offset
+        index = {filepath: entry for filepath, entry in index.items() if filepath not in errors}
+        index.update({filepath: previous_index[index_names[filepath]] for filepath in other_filepaths
+                      if index_names[filepath] in previous_index})
+        if path_metrics_cube is not None:
+            with instrumentation.stage('chat_metrics_cubes') as stage:
+                for filepath, df_chat in results.items():
+                    n_unchanged = processed[filepath].n_unchanged if filepath in processed else 0
+                    cubes[filepath] = _cached_chat_cube(path_cache, index[filepath]['key'], df_chat,
+                                                        extended.get(filepath), n_unchanged)
+                for filepath in (filepath for filepath in other_filepaths if filepath in index):
+                    key = index[filepath]['key']
+                    cube, sketches = read_cached_cube(path_cache, key), read_cached_sketches(path_cache, key)
+                    if cube is not None and sketches is not None:
+                        cubes[filepath] = cube, sketches
+                        continue
+                    df_chat = read_cached_chat(path_cache, key)  # only when its cube or sketches are missing
+                    if df_chat is not None:
+                        cubes[filepath] = _cached_chat_cube(path_cache, key, df_chat, None, 0)
+                stage.rows_out = sum(len(cube) for cube, _ in cubes.values())
+        write_cache_index(path_cache, {index_names[filepath]: entry for filepath, entry in index.items()})
+        prune_chat_cache(path_cache, keep=[entry['key'] for entry in index.values()])
+    if errors:
+        raise ChatIngestionError(errors, sorted(set().union(*(sources[filepath] for filepath in errors))))
+
+    df = validate(concat_chats([results[filepath] for filepath in filepaths]), ChatFeatures) if filepaths else None
+    if path_metrics_cube is not None and (cubes or df is not None):
+        with instrumentation.stage('metrics_cube', rows_in=None if df is None else len(df)) as stage:
+            if cubes:
+                chat_cubes, chat_sketches = zip(*cubes.values())
+                cube = combine_metrics_cubes(chat_cubes)
+                sketches = combine_latency_sketches(chat_sketches, CUBE_SKETCH_KEYS)
+            else:
+                cube, sketches = build_metrics_cube(df), build_cube_sketches(df)
+            write_metrics_cube(cube, path_metrics_cube)
+            write_cube_sketches(sketches, path_metrics_cube)
+            stage.rows_out = len(cube)
+    if df is None:
+        return None
+    if compact:
+        with instrumentation.stage('compact', rows_in=len(df)) as stage:
+            df = compact_chat_features(df)
+            stage.rows_out = len(df)
+    return df
+
+
+def concat_chats(chats: List[DataFrame[ChatFeatures]]) -> DataFrame[ChatFeatures]:
+    """
+    Concat chats, which already carry all their features. A single chat is returned as is, without a copy.
+    Chats of differing dtypes, e.g. categoricals of other categories, are cast to common dtypes by pd.concat.
+    """
+    if len(chats) == 1:
+        return chats[0]
+    return pd.concat(chats)
+
+
+def _cached_chat_cube(path_cache: str, key: str, df: DataFrame[ChatFeatures],
+                      previous: Optional[Tuple[str, pd.DataFrame]], n_unchanged: int
+                      ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Metrics cube and latency sketches of a chat from the cache. Those of appended chats are updated with the
+    changed rows only.
+    """
+    cube, sketches = read_cached_cube(path_cache, key), read_cached_sketches(path_cache, key)
+    if cube is not None and sketches is not None:
+        return cube, sketches
+    previous_cube, previous_sketches = None, None
+    if previous is not None and n_unchanged > 0:
+        previous_cube = read_cached_cube(path_cache, previous[0])
+        previous_sketches = read_cached_sketches(path_cache, previous[0])
+    if previous_cube is not None and previous_sketches is not None:
+        df_added, df_removed = df.iloc[n_unchanged:], previous[1].iloc[n_unchanged:]
+        cube = update_metrics_cube(previous_cube, df_added, df_removed=df_removed)
+        sketches = update_cube_sketches(previous_sketches, df_added, df_removed=df_removed)
+    else:
+        cube, sketches = build_metrics_cube(df), build_cube_sketches(df)
+    write_cached_cube(path_cache, key, cube)
+    write_cached_sketches(path_cache, key, sketches)
+    return cube, sketches
+
+
+def run_chat_jobs(jobs: Dict[str, Tuple[Callable[..., ProcessedChat], tuple]], n_workers: Optional[int]
+                  ) -> Tuple[Dict[str, ProcessedChat], Dict[str, BaseException]]:
+    """Run the per-chat job of each export file, in worker processes unless n_workers is 1."""
+    results: Dict[str, ProcessedChat] = {}
+    errors: Dict[str, BaseException] = {}
+    if n_workers == 1 or len(jobs) <= 1:
+        for filepath, (func, args) in jobs.items():
+            print(os.path.basename(filepath))
+            try:
+                results[filepath] = func(*args)
+            except Exception as e:
+                errors[filepath] = e
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # Stage records of the workers are sent back along with the results
+            futures = {executor.submit(instrumentation.call_collecting, instrumentation.settings(), func, *args):
+                       filepath for filepath, (func, args) in jobs.items()}
+            for future in as_completed(futures):
+                filepath = futures[future]
+                print(os.path.basename(filepath))
+                try:
+                    results[filepath], records = future.result()
+                    instrumentation.extend_records(records)
+                except Exception as e:
+                    errors[filepath] = e
+    return results, errors
+
+
+def agg_to_pkl(path_whatsapp, path_signal, path_processed_pkl, path_cache: Optional[str] = None) -> str:
+    df = aggregate_whatsapp_conversations(path_whatsapp, path_cache=path_cache, path_signal_chats=path_signal)
     dtnow = datetime.datetime.now().strftime("%d%m%Y-%H%M")
     file_name = f"df_whatsapp_{dtnow}.pkl"
     path_pkl = os.path.join(path_processed_pkl, file_name)
-    df.to_pickle(path_pkl)
+    with instrumentation.stage('pickle_write', rows_in=len(df)):
+        df.to_pickle(path_pkl)
     return path_pkl
+
+
+def agg_to_parquet(path_whatsapp, path_signal, path_store, path_cache: Optional[str] = None,
+                   path_metrics_cube: Optional[str] = None, path_search_index: Optional[str] = None) -> str:
+    """
+    Aggregate the chats into the parquet store, and into the search index if a path_search_index is given.
+
+    With a path_cache, only the partitions and index segments of the chats are replaced, whose exports were
+    cached under other keys than those the store was written from. Nothing is written, if no chat changed.
+    Without a cache, or a store and search index to update, both are written entirely.
+    """
+    df = aggregate_whatsapp_conversations(path_whatsapp, path_cache=path_cache, path_metrics_cube=path_metrics_cube,
+                                          path_signal_chats=path_signal)
+    store_chats = list_store_chats(path_store) if os.path.isdir(path_store) else []
+    if path_cache is None or not store_chats or \
+            (path_search_index is not None and list_index_chats(path_search_index) != store_chats):
+        with instrumentation.stage('store_write', rows_in=len(df)):
+            write_parquet_store(df, path_store, path_search_index)
+        if path_cache is not None:
+            write_store_sources(path_store, cached_keys_by_source(path_cache))
+        return path_store
+
+    keys, stored_keys = cached_keys_by_source(path_cache), read_store_sources(path_store)
+    previous_chats = store_chats_by_export(path_store)
+    chats_by_source = {source: set(chats) for source, chats in
+                       df.groupby('source', observed=True)['chat'].unique().items()}
+    changed = [source for source in set(previous_chats) | set(chats_by_source) | set(stored_keys) | set(keys)
+               if source not in keys or stored_keys.get(source) != keys[source]]
+    chats = sorted(set().union(*(previous_chats.get(source, set()) | chats_by_source.get(source, set())
+                                 for source in changed)))
+    if chats:
+        df_changed = df[df['chat'].isin(chats)]
+        with instrumentation.stage('store_update', rows_in=len(df_changed)):
+            replace_store_chats(df_changed, path_store, chats=chats, path_search_index=path_search_index)
+    if keys != stored_keys:
+        write_store_sources(path_store, keys)
+    return path_store
@@ -0,0 +1,87 @@
+"""
+Original text of the messages in their WhatsApp exports.
+
+Processed messages refer to their export by the columns source and offset: the path of the export and the byte
+offset, at which the (first) message of the block starts. Exports are memory-mapped and the byte offsets of all
+their messages kept on disk as .npy index, so the text around any message is read without loading the export.
+"""
+import hashlib
+import mmap
+import os
+import re
+from typing import Optional
+
+import numpy as np
+
+from chat_analyzer import PATH_DIR_OFFSET_INDEX
+from chat_analyzer.data_processing.extract import WHATSAPP_TIMESTAMP
+
+OFFSET_INDEX_SUFFIX = ".offsets.npy"
+# WHATSAPP_MESSAGE_LINE on the utf-8 encoded export, matching the lines iter_parse_whatsapp starts a message at
+WHATSAPP_MESSAGE_START = re.compile(
+    b'^' + WHATSAPP_TIMESTAMP.replace(r'[ \u202f]', '(?: |\u202f)').encode('utf-8') + rb' - [^:\r\n]+: [^\r\n]',
+    re.MULTILINE)
+
+
+def build_offset_index(filepath: str) -> np.ndarray:
+    """Byte offsets of all messages of the export, followed by its size in bytes"""
+    with open(filepath, 'rb') as file:
+        n_bytes = os.fstat(file.fileno()).st_size
+        if n_bytes == 0:
+            return np.zeros(1, dtype=np.int64)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as text:
+            offsets = np.fromiter((match.start() for match in WHATSAPP_MESSAGE_START.finditer(text)),
+                                  dtype=np.int64)
+    return np.append(offsets, n_bytes)
+
+
+def offset_index_filename(filepath: str) -> str:
+    """Named after the export and a hash of its absolute path, as exports of the same name may be in other folders"""
+    path_hash = hashlib.blake2b(os.path.abspath(filepath).encode('utf-8'), digest_size=8).hexdigest()
+    return f"{os.path.basename(filepath)}.{path_hash}{OFFSET_INDEX_SUFFIX}"
+
+
+def read_offset_index(filepath: str, path_index: str = PATH_DIR_OFFSET_INDEX) -> np.ndarray:
+    """
+    Offset index of the export, memory-mapped from path_index. It is built and written there first, if it is
+    missing or the export changed since.
+    """
+    path = os.path.join(path_index, offset_index_filename(filepath))
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(filepath):
+        index = np.load(path, mmap_mode='r')
+        if index[-1] == os.path.getsize(filepath):
+            return index
+    index = build_offset_index(filepath)
+    os.makedirs(path_index, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, index)
+    os.replace(tmp_path, path)  # readers never see partially written indices
+    return index
+
+
+def read_raw_messages(filepath: str, offset: int, n_messages: int = 1, n_context: int = 0,
+                      path_index: str = PATH_DIR_OFFSET_INDEX) -> str:
+    """
+    Original text of the n_messages messages from the one at byte offset on, e.g. the n_block messages of a
+    processed row, along with n_context messages before and after. WhatsApp event lines between the messages,
+    such as members joining a group, are included. Looking up the offset is a binary search on the index.
+    """
+    if offset < 0:
+        raise ValueError(f"No WhatsApp message offset: {offset}")
+    index = read_offset_index(filepath, path_index)
+    n_indexed = len(index) - 1
+    i = int(np.searchsorted(index[:n_indexed], offset))
+    if i == n_indexed or index[i] != offset:
+        raise ValueError(f"No message starts at byte {offset} of {filepath}")
+    start = index[max(i - n_context, 0)]
+    end = index[min(i + n_messages + n_context, n_indexed)]
+    return read_raw_text(filepath, int(start), int(end))
+
+
+def read_raw_text(filepath: str, start: int, end: Optional[int] = None) -> str:
+    """Text of the export from byte start up to byte end, or its end"""
+    with open(filepath, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as text:
+            return text[start:end].decode('utf-8')
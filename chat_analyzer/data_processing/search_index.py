@@ -0,0 +1,260 @@
+"""
+Inverted index of the message texts, for full-text search without scanning the store.
+
+The index holds one segment per chat, next to the store, and is updated along with the chat partitions of the
+store. Row ids are the positions of the messages of a chat in the store, i.e. in order of their datetime.
+A segment is a directory of .npy arrays, which are memory-mapped on query:
+- terms and term_offsets: the sorted, utf-8 encoded terms, concatenated
+- posting_offsets: the postings of each term, in rows and positions sorted by term, row and position
+- datetime and sender: of every row, to filter rows and count them over time, without reading the store
+Terms are the words of the messages, case folded and stripped of accents, and their emojis.
+"""
+import json
+import os
+import re
+import shutil
+import unicodedata
+from functools import lru_cache
+from itertools import chain
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+from pandera.typing import DataFrame
+
+from chat_analyzer import PATH_DIR_SEARCH_INDEX
+from chat_analyzer.data_processing.feature_engineering import emoji_pattern
+from chat_analyzer.utils.data_definitions import ChatFeatures
+
+# Bump whenever the segment layout or the tokenization changes, so segments are rebuilt.
+INDEX_VERSION = 2
+SEGMENT_META = "segment.json"
+MESSAGE_SEPARATOR = '\uffff'  # a noncharacter, which does not occur in messages
+# Runs of word characters and runs of other symbols, of which only the emojis are terms
+TOKEN_RUN = re.compile(r'\w+|[^\w\s]+')
+
+
+@lru_cache(maxsize=1 << 16)
+def chunk_terms(chunk: str) -> Tuple[str, ...]:
+    """Terms of a whitespace delimited chunk: its words case folded and stripped of accents, and its emojis"""
+    terms = []
+    for run in TOKEN_RUN.findall(chunk):
+        if re.match(r'\w', run):
+            terms.append(''.join(c for c in unicodedata.normalize('NFKD', run.casefold())
+                                 if not unicodedata.combining(c)))
+        else:
+            terms += emoji_pattern().findall(run)
+    return tuple(terms)
+
+
+def tokenize(text: str) -> List[str]:
+    return [term for chunk in text.split() for term in chunk_terms(chunk)]
+
+
+def build_segment(df_chat: pd.DataFrame) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    """
+    Arrays of the segment of one chat, whose rows are in store order, and the senders their codes refer to.
+    The messages are split at whitespace in one go, and only the distinct chunks tokenized, which is much faster
+    than matching words and emojis in every message.
+    """
+    chunks = np.array(f' {MESSAGE_SEPARATOR} '.join(df_chat['message'].fillna('')).split(), dtype=object)
+    row_of_chunk = np.cumsum(chunks == MESSAGE_SEPARATOR)
+    chunk_codes, vocabulary = pd.factorize(chunks)
+
+    # Terms of every distinct chunk, then of every chunk in the messages
+    vocabulary_terms = [chunk_terms(chunk) for chunk in vocabulary]
+    n_terms = np.array([len(terms) for terms in vocabulary_terms], dtype=np.int64)
+    term_of_vocabulary, terms = pd.factorize(np.array(list(chain.from_iterable(vocabulary_terms)), dtype=object),
+                                             sort=True)
+    counts = n_terms[chunk_codes]
+    occurrences = np.repeat(np.arange(len(chunks)), counts)
+    within_chunk = np.arange(len(occurrences)) - np.repeat(np.cumsum(counts) - counts, counts)
+    term_codes = term_of_vocabulary[(np.cumsum(n_terms) - n_terms)[chunk_codes[occurrences]] + within_chunk]
+
+    rows = row_of_chunk[occurrences].astype(np.uint32)
+    n_terms_per_row = np.bincount(rows, minlength=len(df_chat))
+    positions = np.arange(len(rows)) - (np.cumsum(n_terms_per_row) - n_terms_per_row)[rows]
+    order = np.argsort(term_codes, kind='stable')  # rows and positions are ascending already
+    encoded = [term.encode('utf-8') for term in terms]
+    sender_codes, senders = pd.factorize(df_chat['sender'].astype(str))
+    arrays = {
+        'terms': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        'term_offsets': _offsets([len(term) for term in encoded]),
+        'posting_offsets': _offsets(np.bincount(term_codes, minlength=len(terms))),
+        'rows': rows[order],
+        'positions': positions.astype(np.uint32)[order],
+        'datetime': df_chat['datetime'].to_numpy('datetime64[ns]'),
+        'sender': sender_codes.astype(np.uint16),
+    }
+    return arrays, list(senders)
+
+
+def write_search_index(df: DataFrame[ChatFeatures], path_index: str = PATH_DIR_SEARCH_INDEX):
+    """Rebuild the index of all chats in df, and remove the segments of other chats"""
+    update_search_index(df, path_index, chats=list_index_chats(path_index))
+
+
+def update_search_index(df: Optional[DataFrame[ChatFeatures]], path_index: str = PATH_DIR_SEARCH_INDEX,
+                        chats: Sequence[str] = ()):
+    """
+    Replace the segments of the chats in df, and remove those of the other chats. Like the store partitions, each
+    segment is written next to its final place and swapped in by renaming its directory.
+    """
+    os.makedirs(path_index, exist_ok=True)
+    updated = set()
+    if df is not None and len(df):
+        for chat, rows in df.groupby('chat', observed=True, sort=False).indices.items():
+            df_chat = df.take(rows).sort_values('datetime', kind='stable')  # the order of the store
+            _write_segment(os.path.join(path_index, quote(chat, safe='')), *build_segment(df_chat))
+            updated.add(chat)
+    for chat in set(chats) - updated:
+        shutil.rmtree(os.path.join(path_index, quote(chat, safe='')), ignore_errors=True)
+
+
+def list_index_chats(path_index: str) -> List[str]:
+    if not os.path.isdir(path_index):
+        return []
+    return sorted(unquote(d) for d in os.listdir(path_index)
+                  if os.path.exists(os.path.join(path_index, d, SEGMENT_META)))
+
+
+def _write_segment(path: str, arrays: Dict[str, np.ndarray], senders: List[str]):
+    path_tmp, path_old = f"{path}.{os.getpid()}.tmp", f"{path}.{os.getpid()}.old"
+    shutil.rmtree(path_tmp, ignore_errors=True)
+    os.makedirs(path_tmp)
+    for name, array in arrays.items():
+        np.save(os.path.join(path_tmp, f"{name}.npy"), array)
+    with open(os.path.join(path_tmp, SEGMENT_META), 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'senders': senders}, f)
+    if os.path.exists(path):
+        os.replace(path, path_old)
+    os.replace(path_tmp, path)
+    shutil.rmtree(path_old, ignore_errors=True)
+
+
+def _offsets(lengths) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+class Segment:
+    """Memory-mapped segment of one chat"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, SEGMENT_META), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION:
+            raise ValueError(f"Search index segment {path} is of version {meta['version']}, rebuild the index")
+        self.senders: List[str] = meta['senders']
+        self.arrays = {name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode='r')
+                       for name in os.listdir(path) if name.endswith('.npy')}
+
+    def postings(self, term: str) -> slice:
+        """Range of the postings of term, found by binary search on the sorted terms"""
+        terms, term_offsets, posting_offsets = self.arrays['terms'], self.arrays['term_offsets'], \
+            self.arrays['posting_offsets']
+        key = term.encode('utf-8')
+        low, high = 0, len(term_offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if terms[term_offsets[middle]:term_offsets[middle + 1]].tobytes() < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(term_offsets) - 1 or terms[term_offsets[low]:term_offsets[low + 1]].tobytes() != key:
+            return slice(0, 0)
+        return slice(int(posting_offsets[low]), int(posting_offsets[low + 1]))
+
+    def match(self, terms: Sequence[str], phrase: bool = False) -> np.ndarray:
+        """Sorted rows containing all terms, or the terms as consecutive phrase"""
+        rows = None
+        for i, term in enumerate(terms):
+            postings = self.postings(term)
+            term_rows = self.arrays['rows'][postings]
+            if phrase:  # occurrences as row and position of the first term of the phrase
+                positions = self.arrays['positions'][postings]
+                term_rows = (term_rows[positions >= i].astype(np.int64) << 32) + positions[positions >= i] - i
+            else:
+                term_rows = _unique_sorted(term_rows)
+            rows = term_rows if rows is None else np.intersect1d(rows, term_rows, assume_unique=not phrase)
+            if len(rows) == 0:
+                break
+        if rows is None:
+            return np.empty(0, dtype=np.int64)
+        return _unique_sorted(rows >> 32) if phrase else rows.astype(np.int64)
+
+    def filter(self, rows: np.ndarray, senders: Optional[Sequence[str]] = None,
+               since: Optional[pd.Timestamp] = None, until: Optional[pd.Timestamp] = None) -> np.ndarray:
+        """Rows of the senders from since (inclusive) until (exclusive). Rows are in order of their datetime."""
+        datetime = self.arrays['datetime']
+        if since is not None:
+            rows = rows[rows >= np.searchsorted(datetime, np.datetime64(since, 'ns'))]
+        if until is not None:
+            rows = rows[rows < np.searchsorted(datetime, np.datetime64(until, 'ns'))]
+        if senders is not None:
+            codes = [code for code, sender in enumerate(self.senders) if sender in senders]
+            rows = rows[np.isin(self.arrays['sender'][rows], codes)]
+        return rows
+
+
+def _unique_sorted(array: np.ndarray) -> np.ndarray:
+    if len(array) == 0:
+        return np.asarray(array)
+    is_first = np.empty(len(array), dtype=bool)
+    is_first[0] = True
+    np.not_equal(array[1:], array[:-1], out=is_first[1:])
+    return np.asarray(array[is_first])
+
+
+class SearchIndex:
+    """
+    Full-text search over the segments of all chats, e.g.
+    `SearchIndex(path).search('good morning', phrase=True, sender='Max', since='2022')`
+    """
+
+    def __init__(self, path_index: str = PATH_DIR_SEARCH_INDEX):
+        self.path_index = path_index
+        self._segments: Dict[str, Tuple[Tuple[int, int], Segment]] = {}  # by chat, with the stat it was opened at
+
+    @property
+    def chats(self) -> List[str]:
+        return list_index_chats(self.path_index)
+
+    def segment(self, chat: str) -> Segment:
+        """Segment of the chat, opened again if it was replaced since"""
+        path = os.path.join(self.path_index, quote(chat, safe=''))
+        stat = os.stat(path)
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if chat not in self._segments or self._segments[chat][0] != version:
+            self._segments[chat] = (version, Segment(path))
+        return self._segments[chat][1]
+
+    def search(self, query: str, phrase: bool = False, chats: Optional[Sequence[str]] = None,
+               senders: Optional[Sequence[str]] = None, since=None, until=None) -> pd.DataFrame:
+        """
+        Messages containing all terms of the query, or the query as phrase, of the given chats and senders from
+        since (inclusive) until (exclusive). Returns their chat, row id, datetime and sender.
+        """
+        terms = tokenize(query)
+        since = None if since is None else pd.Timestamp(since)
+        until = None if until is None else pd.Timestamp(until)
+        results = []
+        for chat in self.chats if chats is None else [c for c in self.chats if c in chats]:
+            segment = self.segment(chat)
+            rows = segment.filter(segment.match(terms, phrase), senders, since, until) if terms else []
+            if len(rows):
+                results.append(pd.DataFrame({
+                    'chat': chat, 'row': rows,
+                    'datetime': segment.arrays['datetime'][rows],
+                    'sender': np.asarray(segment.senders, dtype=object)[segment.arrays['sender'][rows]]}))
+        if not results:
+            return pd.DataFrame({'chat': pd.Series(dtype=object), 'row': pd.Series(dtype=np.int64),
+                                 'datetime': pd.Series(dtype='datetime64[ns]'), 'sender': pd.Series(dtype=object)})
+        return pd.concat(results, ignore_index=True)
+
+    def term_frequency(self, query: str, freq: str = 'M', phrase: bool = False, **filters) -> pd.Series:
+        """Number of messages containing the query per period of freq, from the index alone"""
+        matches = self.search(query, phrase, **filters)
+        return matches.set_index('datetime').resample(freq).size().rename('n_messages')
@@ -0,0 +1,233 @@
+"""
+Parse the Signal Desktop exports of sigtop (https://github.com/tbvdm/sigtop), created by
+`sigtop export-messages -f text` or `-f json`. sigtop writes one file per conversation, named after it.
+
+Text exports consist of a message header of `Key: value` lines, starting with `From:` and followed by the
+message body after a blank line. JSON exports hold the message objects of the Signal Desktop database, either
+as array or one object per line.
+"""
+import itertools
+import json
+import os
+import re
+import tempfile
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import pandas as pd
+import pyarrow.parquet as pq
+from pandera.typing import DataFrame
+
+from chat_analyzer import MY_CHAT_NAMES, SIGNAL_TIMEZONE
+from chat_analyzer.data_processing.extract import merge_sorted_chats
+from chat_analyzer.utils.data_definitions import RawChat
+from chat_analyzer.utils.validation import validate
+
+SIGNAL_EXPORT_EXTENSIONS = ('.txt', '.json', '.jsonl')
+SIGNAL_MESSAGE_TYPES = ('incoming', 'outgoing')
+SIGNAL_TEXT_DATETIME_FORMAT = "%a, %d %b %Y %H:%M:%S"  # Followed by the UTC offset, e.g. +0100
+SIGNAL_TEXT_HEADER_LINE = re.compile(r'^([A-Z][a-z]+): (.*)$')
+SIGNAL_SENDER_DETAILS = re.compile(r' \([^()]*\)$')  # Phone number or other details after the name
+MEDIA_OMITTED = '<Media omitted>'  # As WhatsApp exports messages, which only consist of attachments
+
+
+def list_signal_exports(path_signal_chats: str) -> List[str]:
+    filenames = sorted(os.fsdecode(f) for f in os.listdir(path_signal_chats))
+    return [os.path.join(path_signal_chats, f) for f in filenames if f.endswith(SIGNAL_EXPORT_EXTENSIONS)]
+
+
+def signal_chat_name(filepath: str) -> str:
+    """Name of the conversation, as sigtop names its export after it"""
+    return os.path.splitext(os.path.basename(filepath))[0]
+
+
+def read_signal_file(filepath: str, batch_size: int = 100_000) -> DataFrame[RawChat]:
+    batches = list(iter_parse_signal_file(filepath, batch_size=batch_size))
+    if not batches:
+        return _raw_chat_frame(pd.Series([], dtype='datetime64[ns]'), [], [])
+    return validate(pd.concat(batches, ignore_index=True), RawChat)
+
+
+def iter_parse_signal_file(filepath: str, batch_size: int = 100_000) -> Iterator[DataFrame[RawChat]]:
+    """
+    Parse a sigtop export from disk into RawChat batches of at most batch_size messages, in time order.
+
+    Messages are exported in the order they were received, so a message can be sent before those of earlier
+    batches. Every batch is therefore sorted and spilled to a temporary parquet file, from which the sorted runs
+    are read back in chunks and merged by merge_sorted_chats. Only about one batch is held in memory at a time.
+    """
+    conversation = signal_chat_name(filepath)
+    parse = iter_parse_signal_text if filepath.endswith('.txt') else iter_parse_signal_json
+    with open(filepath, 'r', encoding='utf-8') as file:
+        batches = (_sort_by_datetime(batch) for batch in parse(file, conversation, batch_size=batch_size))
+        first = next(batches, None)
+        second = next(batches, None)
+        if second is None:
+            if first is not None:
+                yield first
+            return
+        with tempfile.TemporaryDirectory(prefix='signal_runs_') as path_runs:
+            runs = []
+            for i, batch in enumerate(itertools.chain([first, second], batches)):
+                runs.append(os.path.join(path_runs, f"{i}.parquet"))
+                batch.to_parquet(runs[-1], index=False)
+            chunk_size = max(1, batch_size // len(runs))
+            yield from _rebatch(merge_sorted_chats(*(_iter_run(run, chunk_size) for run in runs)), batch_size)
+
+
+def _sort_by_datetime(df: DataFrame[RawChat]) -> DataFrame[RawChat]:
+    return df.sort_values('datetime', kind='stable', ignore_index=True)
+
+
+def _iter_run(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    for record_batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield record_batch.to_pandas()
+
+
+def _rebatch(batches: Iterable[pd.DataFrame], batch_size: int) -> Iterator[pd.DataFrame]:
+    """Cut a stream of batches of any size into batches of batch_size rows, the last one possibly shorter"""
+    pending: List[pd.DataFrame] = []
+    n_pending = 0
+    for batch in batches:
+        pending.append(batch)
+        n_pending += len(batch)
+        if n_pending < batch_size:
+            continue
+        df = pd.concat(pending, ignore_index=True)
+        n_full = len(df) // batch_size * batch_size
+        for start in range(0, n_full, batch_size):
+            yield df.iloc[start:start + batch_size].reset_index(drop=True)
+        pending = [df.iloc[n_full:].reset_index(drop=True)]
+        n_pending = len(df) - n_full
+    if n_pending:
+        yield pd.concat(pending, ignore_index=True)
+
+
+def iter_parse_signal_text(lines: Iterable[str], conversation: str,
+                           batch_size: int = 100_000) -> Iterator[DataFrame[RawChat]]:
+    """
+    Parse a sigtop text export line by line.
+
+    Outgoing messages are sent by the first of MY_CHAT_NAMES. Times are kept as the wall time of the export.
+    Messages of other types than incoming and outgoing are dropped, like WhatsApp events. Messages are kept in the
+    order of the export, which iter_parse_signal_file sorts by time.
+    """
+    timestamps: List[str] = []
+    senders: List[str] = []
+    messages: List[str] = []
+    header: Optional[dict] = None
+    body: Optional[List[str]] = None
+    previous_blank = True
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = SIGNAL_TEXT_HEADER_LINE.match(line)
+        if match is not None and match.group(1) == 'From' and previous_blank:
+            if _append_text_message(header, body, timestamps, senders, messages) and len(messages) >= batch_size:
+                yield _text_chat_frame(timestamps, senders, messages)
+                timestamps, senders, messages = [], [], []
+            header, body = {}, None
+        previous_blank = not line.strip()
+
+        if header is None:
+            continue  # conversation header
+        if body is None:
+            if match is not None:
+                header.setdefault(match.group(1), match.group(2))
+            elif previous_blank:
+                body = []
+        else:
+            body.append(line)
+
+    _append_text_message(header, body, timestamps, senders, messages)
+    if messages:
+        yield _text_chat_frame(timestamps, senders, messages)
+
+
+def _append_text_message(header: Optional[dict], body: Optional[List[str]], timestamps: List[str],
+                         senders: List[str], messages: List[str]) -> bool:
+    if not header or 'Sent' not in header or header.get('Type', 'incoming') not in SIGNAL_MESSAGE_TYPES:
+        return False
+    body = list(body or [])
+    while body and not body[-1].strip():  # blank line closing the message
+        body.pop()
+    message = '\n'.join(body) or (MEDIA_OMITTED if 'Attachment' in header else '')
+    if not message:
+        return False
+    sender = header['From']
+    is_outgoing = header.get('Type') == 'outgoing' or sender == 'You'
+    timestamps.append(header['Sent'].rsplit(' ', 1)[0])  # drop the UTC offset, keeping the wall time
+    senders.append(MY_CHAT_NAMES[0] if is_outgoing else SIGNAL_SENDER_DETAILS.sub('', sender))
+    messages.append(message)
+    return True
+
+
+def iter_parse_signal_json(file: TextIO, conversation: str,
+                           batch_size: int = 100_000) -> Iterator[DataFrame[RawChat]]:
+    """
+    Parse a sigtop json export, decoding one message object at a time.
+
+    The Signal database only knows phone numbers of senders, so incoming messages are attributed to the
+    conversation. Sent times are converted to the wall time of SIGNAL_TIMEZONE. Messages are kept in the order
+    of the export.
+    """
+    sent_at: List[int] = []
+    senders: List[str] = []
+    messages: List[str] = []
+    for message in iter_json_values(file):
+        if not isinstance(message, dict) or message.get('type') not in SIGNAL_MESSAGE_TYPES:
+            continue
+        text = message.get('body') or (MEDIA_OMITTED if message.get('attachments') else '')
+        if not text:
+            continue
+        sent_at.append(message.get('sent_at') or message['timestamp'])
+        senders.append(MY_CHAT_NAMES[0] if message['type'] == 'outgoing' else conversation)
+        messages.append(text)
+        if len(messages) >= batch_size:
+            yield _json_chat_frame(sent_at, senders, messages)
+            sent_at, senders, messages = [], [], []
+    if messages:
+        yield _json_chat_frame(sent_at, senders, messages)
+
+
+def iter_json_values(file: TextIO, chunk_size: int = 1 << 16) -> Iterator:
+    """Values of a JSON array or of JSON lines, read in chunks and decoded one by one"""
+    decoder = json.JSONDecoder()
+    buffer, position, is_eof = '', 0, False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n[],':
+            position += 1
+        if position == len(buffer):
+            if is_eof:
+                return
+            buffer, position, is_eof = _read_more(file, '', chunk_size)
+            continue
+        try:
+            value, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if is_eof:
+                raise
+            buffer, position, is_eof = _read_more(file, buffer[position:], chunk_size)
+            continue
+        yield value
+
+
+def _read_more(file: TextIO, rest: str, chunk_size: int) -> Tuple[str, int, bool]:
+    chunk = file.read(chunk_size)
+    return rest + chunk, 0, not chunk
+
+
+def _text_chat_frame(timestamps: List[str], senders: List[str], messages: List[str]) -> DataFrame[RawChat]:
+    datetime = pd.to_datetime(pd.Series(timestamps, dtype=object), format=SIGNAL_TEXT_DATETIME_FORMAT,
+                              errors='raise')
+    return _raw_chat_frame(datetime, senders, messages)
+
+
+def _json_chat_frame(sent_at: List[int], senders: List[str], messages: List[str]) -> DataFrame[RawChat]:
+    datetime = pd.to_datetime(pd.Series(sent_at, dtype='int64'), unit='ms', utc=True)
+    datetime = datetime.dt.tz_convert(SIGNAL_TIMEZONE).dt.tz_localize(None)
+    return _raw_chat_frame(datetime, senders, messages)
+
+
+def _raw_chat_frame(datetime: pd.Series, senders: List[str], messages: List[str]) -> DataFrame[RawChat]:
+    df = pd.DataFrame({'sender': pd.Series(senders, dtype=object), 'message': pd.Series(messages, dtype=object)})
+    df['datetime'] = datetime.astype('datetime64[ns]')
+    return validate(df, RawChat)
@@ -0,0 +1,179 @@
+import json
+import os
+import shutil
+from typing import Optional, List, Sequence, Dict, Set
+from urllib.parse import unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pandera.typing import DataFrame
+
+from chat_analyzer.data_processing.search_index import write_search_index, update_search_index
+from chat_analyzer.utils.data_definitions import ChatFeatures, cat_weekdays, cat_months
+
+PARTITION_COLUMNS = ['chat', 'year']
+ROWS_PER_GROUP = 64 * 1024
+# Cache key of the chat of every export, as of when the store was written. Ignored by pyarrow due to its prefix.
+STORE_SOURCES = '_sources.json'
+
+# Parquet keeps categories only as dictionary values. Their order and unused categories are restored on read.
+CATEGORICAL_DTYPES = {'weekday': cat_weekdays, 'month': cat_months}
+
+
+def write_parquet_store(df: DataFrame[ChatFeatures], path_store: str, path_search_index: Optional[str] = None):
+    """
+    Write the processed chats as parquet dataset, partitioned by chat and year.
+
+    Rows are sorted by datetime within each partition, so row group statistics allow to skip date ranges.
+    The store is written next to path_store and swapped in once complete. The previous store is renamed aside
+    before and only deleted after, so a crash never loses both. The search index of the messages is rebuilt along
+    with it, if a path_search_index is given.
+    """
+    path_tmp = path_store.rstrip('/\\') + '.tmp'
+    path_old = path_store.rstrip('/\\') + '.old'
+    _write_dataset(df, path_tmp)
+    if not os.path.exists(path_store) and os.path.exists(path_old):  # a previous swap crashed in between
+        os.replace(path_old, path_store)
+    shutil.rmtree(path_old, ignore_errors=True)
+    if os.path.exists(path_store):
+        os.replace(path_store, path_old)
+    os.replace(path_tmp, path_store)
+    shutil.rmtree(path_old, ignore_errors=True)
+    if path_search_index is not None:
+        write_search_index(df, path_search_index)
+
+
+def replace_store_chats(df: Optional[DataFrame[ChatFeatures]], path_store: str, chats: Sequence[str] = (),
+                        path_search_index: Optional[str] = None):
+    """
+    Replace the partitions of the chats in df, and remove those of the other chats, in the store.
+
+    The new partitions are written next to path_store and swapped in one chat at a time by renaming directories,
+    so the store stays readable while the chats are updated. Their segments of the search index follow.
+    """
+    path_tmp = path_store.rstrip('/\\') + '.update'
+    path_trash = path_store.rstrip('/\\') + '.trash'
+    os.makedirs(path_store, exist_ok=True)
+    directories = {}
+    if df is not None and len(df):
+        _write_dataset(df, path_tmp)
+        directories = {_partition_chat(d): d for d in os.listdir(path_tmp)}
+    removed = set(chats) - set(directories)
+    stale = [d for d in os.listdir(path_store) if _partition_chat(d) in removed]
+
+    shutil.rmtree(path_trash, ignore_errors=True)
+    os.makedirs(path_trash)
+    for directory in directories.values():
+        path = os.path.join(path_store, directory)
+        if os.path.exists(path):
+            os.replace(path, os.path.join(path_trash, directory))
+        os.replace(os.path.join(path_tmp, directory), path)
+    for directory in stale:
+        os.replace(os.path.join(path_store, directory), os.path.join(path_trash, directory))
+    shutil.rmtree(path_trash, ignore_errors=True)
+    shutil.rmtree(path_tmp, ignore_errors=True)
+    if path_search_index is not None:
+        update_search_index(df, path_search_index, chats)
+
+
+def _write_dataset(df: DataFrame[ChatFeatures], path: str):
+    df = df.sort_values(['chat', 'datetime'], kind='stable').reset_index(drop=True)
+    df['year'] = df.datetime.dt.year.astype('int16')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    shutil.rmtree(path, ignore_errors=True)
+    ds.write_dataset(table, path, format='parquet',
+                     partitioning=PARTITION_COLUMNS, partitioning_flavor='hive',
+                     max_rows_per_group=ROWS_PER_GROUP, min_rows_per_group=ROWS_PER_GROUP // 4,
+                     existing_data_behavior='error')
+
+
+def read_parquet_store(path_store: str, columns: Optional[Sequence[str]] = None,
+                       chats: Optional[Sequence[str]] = None,
+                       since: Optional[pd.Timestamp] = None, until: Optional[pd.Timestamp] = None,
+                       senders: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Read processed chats from the parquet store.
+
+    Only the requested columns are read. Chat and date filters prune partitions and row groups, before any data
+    is loaded. since is inclusive, until exclusive. The sender filter is applied while scanning.
+    """
+    dataset = _open_dataset(path_store)
+    expression = None
+    if chats is not None:
+        expression = _and(expression, ds.field('chat').isin(pa.array(list(chats), pa.string())))
+    if senders is not None:
+        expression = _and(expression, ds.field('sender').isin(pa.array(list(senders), pa.string())))
+    if since is not None:
+        since = pd.Timestamp(since)
+        expression = _and(expression, (ds.field('year') >= since.year) & (ds.field('datetime') >= since))
+    if until is not None:
+        until = pd.Timestamp(until)
+        expression = _and(expression, (ds.field('year') <= until.year) & (ds.field('datetime') < until))
+
+    stored_columns = [c['name'] for c in dataset.schema.pandas_metadata['columns'] if c['name'] != 'year']
+    read_columns = stored_columns if columns is None else list(columns)
+    table = dataset.to_table(columns=read_columns, filter=expression)
+    return _restore_dtypes(table.to_pandas(ignore_metadata=True, types_mapper=_compact_emojis_dtype))
+
+
+def list_store_chats(path_store: str) -> List[str]:
+    """Chat names in the store, from its partition directories only"""
+    return sorted(filter(None, map(_partition_chat, os.listdir(path_store))))
+
+
+def store_chats_by_export(path_store: str) -> Dict[str, Set[str]]:
+    """Chats every export is part of, according to the store"""
+    if not os.path.isdir(path_store) or not list_store_chats(path_store):
+        return {}
+    df = read_parquet_store(path_store, columns=['chat', 'source'])
+    return {source: set(chats) for source, chats in df.groupby('source', observed=True)['chat'].unique().items()}
+
+
+def read_store_sources(path_store: str) -> Dict[str, str]:
+    """Cache key of the chat every export path is part of, as of when its rows were written to the store"""
+    path = os.path.join(path_store, STORE_SOURCES)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_store_sources(path_store: str, keys: Dict[str, str]):
+    path = os.path.join(path_store, STORE_SOURCES)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(keys, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _partition_chat(directory: str) -> Optional[str]:
+    """Chat of a partition directory, None for other files"""
+    prefix = f'{PARTITION_COLUMNS[0]}='
+    return unquote(directory[len(prefix):]) if directory.startswith(prefix) else None
+
+
+def _open_dataset(path_store: str) -> ds.Dataset:
+    partitioning = ds.partitioning(pa.schema([('chat', pa.string()), ('year', pa.int16())]), flavor='hive')
+    return ds.dataset(path_store, format='parquet', partitioning=partitioning)
+
+
+def _and(expression: Optional[ds.Expression], other: ds.Expression) -> ds.Expression:
+    return other if expression is None else expression & other
+
+
+def _compact_emojis_dtype(arrow_type: pa.DataType) -> Optional[pd.ArrowDtype]:
+    """Keep emoji lists of CompactChatFeatures as arrow list array"""
+    if pa.types.is_list(arrow_type) and pa.types.is_dictionary(arrow_type.value_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+def _restore_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    for column, dtype in CATEGORICAL_DTYPES.items():
+        if column in df:
+            df[column] = df[column].astype(dtype)
+    if 'emojis' in df and df['emojis'].dtype == object:
+        df['emojis'] = df['emojis'].map(list)
+    return df
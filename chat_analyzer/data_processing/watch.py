@@ -0,0 +1,179 @@
+"""
+Continuous ingestion of the exports dropped into the chat folders.
+
+    python -m chat_analyzer.data_processing.watch
+
+The folders are polled for new, changed and removed exports. An export is only ingested once its size and
+modification time did not change for debounce_s, so exports which are still being written are left alone.
+The chats of at most max_batch exports are run through the pipeline at a time, on the worker pool of
+aggregate_whatsapp_conversations. Further exports wait for the next cycle, as do exports changing meanwhile.
+Their partitions of the parquet store are swapped in chat by chat, so the store stays queryable, and only their
+reports are rendered again.
+"""
+import argparse
+import os
+import time
+from typing import Dict, List, Optional, Tuple, Set
+
+from chat_analyzer import PATH_WHATSAPP_MSG, PATH_SIGNAL_MSG, PATH_DIR_PROCESSED_STORE, PATH_DIR_CACHE, \
+    PATH_METRICS_CUBE, PATH_DIR_CHAT_HTML_VISUALIZATIONS, PATH_DIR_SEARCH_INDEX, N_INGESTION_WORKERS, \
+    WATCH_DEBOUNCE_S, WATCH_POLL_INTERVAL_S, WATCH_MAX_BATCH
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations, list_whatsapp_exports, \
+    ChatIngestionError
+from chat_analyzer.data_processing.signal_export import list_signal_exports
+from chat_analyzer.data_processing.cache import cached_keys_by_source
+from chat_analyzer.data_processing.store import replace_store_chats, store_chats_by_export, read_store_sources, \
+    write_store_sources
+from chat_analyzer.visualization.reports import build_chat_reports
+from chat_analyzer.visualization.visualize import chat_html_path
+
+FileStat = Tuple[int, int]  # Size in bytes and modification time in ns
+
+
+def scan_exports(path_whatsapp_chats: str, path_signal_chats: Optional[str] = None) -> Dict[str, FileStat]:
+    filepaths = list_whatsapp_exports(path_whatsapp_chats)
+    if path_signal_chats is not None and os.path.isdir(path_signal_chats):
+        filepaths += list_signal_exports(path_signal_chats)
+    stats = {}
+    for filepath in filepaths:
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:  # removed since listed
+            continue
+        stats[filepath] = (stat.st_size, stat.st_mtime_ns)
+    return stats
+
+
+class ExportWatcher:
+    """Changes of the exports since they were last ingested, once they settled for debounce_s"""
+
+    def __init__(self, debounce_s: float = WATCH_DEBOUNCE_S,
+                 ingested: Optional[Dict[str, Optional[FileStat]]] = None):
+        """ingested holds the stats of the exports ingested before, None if unknown"""
+        self.debounce_s = debounce_s
+        self.ingested: Dict[str, Optional[FileStat]] = dict(ingested or {})
+        self._changing: Dict[str, Tuple[FileStat, float]] = {}  # stat and since when it is unchanged
+
+    def poll(self, stats: Dict[str, FileStat], now: float) -> Tuple[List[str], List[str]]:
+        """Settled new or changed exports, and removed exports"""
+        settled = []
+        for filepath, stat in stats.items():
+            if self.ingested.get(filepath) == stat:
+                self._changing.pop(filepath, None)
+                continue
+            previous = self._changing.get(filepath)
+            if previous is None or previous[0] != stat:
+                self._changing[filepath] = (stat, now)
+            elif now - previous[1] >= self.debounce_s:
+                settled.append(filepath)
+        for filepath in set(self._changing) - set(stats):
+            del self._changing[filepath]
+        return settled, [filepath for filepath in self.ingested if filepath not in stats]
+
+    def mark_ingested(self, filepaths: List[str], removed: List[str], stats: Dict[str, FileStat]):
+        """Record the stats, at which the exports got ingested. Exports written meanwhile are picked up again."""
+        for filepath in filepaths:
+            self.ingested[filepath] = stats[filepath]
+            if self._changing.get(filepath, (None,))[0] == stats[filepath]:
+                del self._changing[filepath]
+        for filepath in removed:
+            self.ingested.pop(filepath, None)
+
+
+def ingest_exports(exports: List[str], chats_by_export: Dict[str, Set[str]],
+                   path_whatsapp_chats: str = PATH_WHATSAPP_MSG, path_signal_chats: Optional[str] = PATH_SIGNAL_MSG,
+                   path_store: str = PATH_DIR_PROCESSED_STORE, path_cache: str = PATH_DIR_CACHE,
+                   path_metrics_cube: Optional[str] = PATH_METRICS_CUBE,
+                   path_html_output: Optional[str] = PATH_DIR_CHAT_HTML_VISUALIZATIONS,
+                   n_workers: Optional[int] = N_INGESTION_WORKERS,
+                   path_search_index: Optional[str] = PATH_DIR_SEARCH_INDEX
+                   ) -> Tuple[List[str], Optional[ChatIngestionError]]:
+    """
+    Run the chats of the new, changed or removed exports through the pipeline, up to the store, its search index
+    and their reports.
+    chats_by_export holds the chats every export was part of so far, and is updated. Returns the updated chats,
+    and the error of the chats which failed. Those keep what the store held of them so far. The other chats are
+    taken from the cache, which the failed run already wrote them to.
+    """
+    kwargs = dict(n_workers=n_workers, path_cache=path_cache, path_metrics_cube=path_metrics_cube,
+                  path_signal_chats=path_signal_chats)
+    error = None
+    try:
+        df = aggregate_whatsapp_conversations(path_whatsapp_chats, exports=exports, **kwargs)
+    except ChatIngestionError as e:
+        error = e
+        exports = [filepath for filepath in exports if filepath not in e.failed_exports]
+        df = aggregate_whatsapp_conversations(path_whatsapp_chats, exports=exports, **kwargs)
+    previous_chats = set().union(*(chats_by_export.pop(filepath, set()) for filepath in exports))
+    if df is not None:
+        for source, chats in df.groupby('source', observed=True)['chat'].unique().items():
+            chats_by_export[source] = set(chats)
+    chats = sorted(set() if df is None else set(df['chat'].unique()))
+    replace_store_chats(df, path_store, chats=sorted(previous_chats | set(chats)), path_search_index=path_search_index)
+    # Record the cache keys of the ingested exports, so batch runs know the store holds their chats
+    keys, stored_keys = cached_keys_by_source(path_cache), read_store_sources(path_store)
+    for source in set(exports) | (set() if df is None else set(df['source'].unique())):
+        if source in keys:
+            stored_keys[source] = keys[source]
+        else:
+            stored_keys.pop(source, None)
+    write_store_sources(path_store, stored_keys)
+
+    if path_html_output is not None:
+        for chat in previous_chats - set(chats):
+            if os.path.exists(chat_html_path(chat, path_html_output)):
+                os.remove(chat_html_path(chat, path_html_output))
+        if chats:
+            build_chat_reports(path_store, path_html_output, chats=chats, n_workers=n_workers)
+    return chats, error
+
+
+def watch(path_whatsapp_chats: str = PATH_WHATSAPP_MSG, path_signal_chats: Optional[str] = PATH_SIGNAL_MSG,
+          path_store: str = PATH_DIR_PROCESSED_STORE, path_cache: str = PATH_DIR_CACHE,
+          path_metrics_cube: Optional[str] = PATH_METRICS_CUBE,
+          path_html_output: Optional[str] = PATH_DIR_CHAT_HTML_VISUALIZATIONS,
+          path_search_index: Optional[str] = PATH_DIR_SEARCH_INDEX,
+          n_workers: Optional[int] = N_INGESTION_WORKERS, debounce_s: float = WATCH_DEBOUNCE_S,
+          poll_interval_s: float = WATCH_POLL_INTERVAL_S, max_batch: int = WATCH_MAX_BATCH,
+          max_cycles: Optional[int] = None):
+    """
+    Ingest the settled changes of the export folders every poll_interval_s, until interrupted or max_cycles polls.
+    A started watch first catches up: the chats of exports no longer there are removed from the store, and all
+    other exports ingested, which is cheap for those unchanged in the cache.
+    Exports which fail to be ingested are reported, and only tried again once they change.
+    """
+    chats_by_export = store_chats_by_export(path_store)
+    watcher = ExportWatcher(debounce_s, ingested=dict.fromkeys(chats_by_export))
+    cycle = 0
+    while max_cycles is None or cycle < max_cycles:
+        cycle += 1
+        stats = scan_exports(path_whatsapp_chats, path_signal_chats)
+        settled, removed = watcher.poll(stats, time.monotonic())
+        batch = settled[:max_batch]
+        if batch or removed:
+            chats, error = ingest_exports(batch + removed, chats_by_export, path_whatsapp_chats, path_signal_chats,
+                                          path_store, path_cache, path_metrics_cube, path_html_output, n_workers,
+                                          path_search_index)
+            watcher.mark_ingested(batch, removed, stats)
+            print(f"Ingested {len(batch)} export(s), removed {len(removed)}: {', '.join(chats) or 'no chats'}")
+            if error is not None:
+                print(error)
+        if max_cycles is None or cycle < max_cycles:
+            time.sleep(poll_interval_s)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--debounce', type=float, default=WATCH_DEBOUNCE_S,
+                        help="seconds an export has to stay unchanged, before it is ingested")
+    parser.add_argument('--interval', type=float, default=WATCH_POLL_INTERVAL_S, help="seconds between polls")
+    parser.add_argument('--max-batch', type=int, default=WATCH_MAX_BATCH, help="exports ingested at a time")
+    args = parser.parse_args(argv)
+    try:
+        watch(debounce_s=args.debounce, poll_interval_s=args.interval, max_batch=args.max_batch)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
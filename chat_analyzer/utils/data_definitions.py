@@ -1,8 +1,10 @@
 from datetime import datetime
+from typing import Any, Optional
 
 import pandera as pa
-from numpy import timedelta64
-from pandas import CategoricalDtype
+from numpy import timedelta64, uint32
+from pandas import CategoricalDtype, Series
+from pandas.api.types import is_unsigned_integer_dtype
 
 
 class RawChat(pa.DataFrameModel):
@@ -10,6 +12,9 @@ class RawChat(pa.DataFrameModel):
     datetime: datetime
     sender: str
     message: str
+    source: Optional[str] = pa.Field(description='Path of the export the (first) message was read from')
+    offset: Optional[int] = pa.Field(ge=-1, description='Byte offset of the (first) message in its source. '
+                                                        '-1, if the source is no WhatsApp export.')
 
 
 class CombinedChat(RawChat):
@@ -49,3 +54,17 @@ class ChatFeatures(CombinedChat):
     duration_to_reply: timedelta64 = pa.Field(
         description='The duration it took to reply, iff the message is the first reply.',
         nullable=True)
+
+
+class CompactChatFeatures(ChatFeatures):
+    """ChatFeatures with dictionary encoded strings and the smallest fitting integer dtypes"""
+    sender: CategoricalDtype
+    receiver: CategoricalDtype = pa.Field(nullable=True)
+    chat: CategoricalDtype
+    week: uint32 = pa.Field(description='Year * 100 + week of the year, with weeks starting on Sunday')
+    n_block: Any
+    n_symbols: Any
+
+    @pa.check('n_block', 'n_symbols')
+    def is_unsigned_integer(cls, s: Series) -> bool:
+        return is_unsigned_integer_dtype(s)
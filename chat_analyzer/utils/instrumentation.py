@@ -0,0 +1,168 @@
+"""
+Per-stage wall time, row counts and peak memory of the pipeline.
+
+Enabled by setting the environment variable CHAT_ANALYZER_INSTRUMENT to the path of a .json or .csv report, or by
+calling enable(). While disabled, stage() returns a shared no-op context, so instrumented code costs one call.
+
+Every stage records the peak resident set size of its process so far, which costs nothing. The peak of the memory
+allocated within a stage is traced by tracemalloc, only if CHAT_ANALYZER_TRACE_MEMORY is set or enable() is called
+with trace_memory. Tracing slows allocation heavy stages down severalfold, so their timings are not comparable.
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Optional, List, Callable, Tuple, Any
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ENV_VAR = "CHAT_ANALYZER_INSTRUMENT"
+ENV_VAR_TRACE_MEMORY = "CHAT_ANALYZER_TRACE_MEMORY"
+COLUMNS = ['stage', 'chat', 'rows_in', 'rows_out', 'seconds', 'peak_rss_mib', 'peak_mib', 'failed']
+
+_enabled = bool(os.environ.get(ENV_VAR))
+_trace_memory = bool(os.environ.get(ENV_VAR_TRACE_MEMORY))
+_records: List[dict] = []
+_active: List['_Stage'] = []
+
+
+class _Stage:
+    __slots__ = ('name', 'chat', 'rows_in', 'rows_out', '_start', '_traced', '_start_memory', '_peak')
+
+    def __init__(self, name: str, chat: Optional[str], rows_in: Optional[int]):
+        self.name = name
+        self.chat = chat
+        self.rows_in = rows_in
+        self.rows_out: Optional[int] = None
+
+    def __enter__(self):
+        self._traced = _trace_memory
+        if self._traced:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            _flush_peak()
+            self._start_memory, _ = tracemalloc.get_traced_memory()
+            self._peak = self._start_memory
+        _active.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        seconds = time.perf_counter() - self._start
+        peak_mib = None
+        if self._traced:
+            _flush_peak()
+            peak_mib = (self._peak - self._start_memory) / 2 ** 20
+        _active.remove(self)
+        _records.append({
+            'stage': self.name, 'chat': self.chat, 'rows_in': self.rows_in, 'rows_out': self.rows_out,
+            'seconds': seconds, 'peak_rss_mib': _peak_rss_mib(), 'peak_mib': peak_mib, 'failed': exc_type is not None,
+        })
+        if self._traced and not any(s._traced for s in _active):
+            tracemalloc.stop()
+
+
+class _NoStage:
+    __slots__ = ()
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __setattr__(self, key, value):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def _flush_peak():
+    """Attribute the peak since the last reset to all traced running stages, as nested stages reset it"""
+    traced = [s for s in _active if s._traced]
+    if not traced:
+        return
+    _, peak = tracemalloc.get_traced_memory()
+    for s in traced:
+        s._peak = max(s._peak, peak)
+    tracemalloc.reset_peak()
+
+
+def _peak_rss_mib() -> Optional[float]:
+    """Peak resident set size of the process so far"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10  # bytes on macOS, KiB elsewhere
+
+
+def stage(name: str, chat: Optional[str] = None, rows_in: Optional[int] = None):
+    """Context measuring one pipeline stage. Set rows_out on the returned object."""
+    if not _enabled:
+        return _NO_STAGE
+    return _Stage(name, chat, rows_in)
+
+
+def current_chat() -> Optional[str]:
+    """Chat of the innermost running stage, which has one"""
+    return next((s.chat for s in reversed(_active) if s.chat is not None), None)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def settings() -> Tuple[bool, bool]:
+    """Whether stages are recorded, and whether their memory is traced, e.g. to pass on to worker processes"""
+    return _enabled, _trace_memory
+
+
+def enable(enabled: bool = True, trace_memory: Optional[bool] = None):
+    """Record stages, with trace_memory also the peak memory they allocate. None keeps the current setting."""
+    global _enabled, _trace_memory
+    _enabled = enabled
+    if trace_memory is not None:
+        _trace_memory = trace_memory
+
+
+def records() -> List[dict]:
+    return list(_records)
+
+
+def extend_records(new_records: List[dict]):
+    _records.extend(new_records)
+
+
+def clear_records():
+    _records.clear()
+
+
+def call_collecting(instrumentation_settings: Tuple[bool, bool], func: Callable, *args) -> Tuple[Any, List[dict]]:
+    """Run func, e.g. in a worker process, and return its result with the records it produced."""
+    enable(*instrumentation_settings)
+    n_before = len(_records)
+    result = func(*args)
+    new_records = _records[n_before:]
+    del _records[n_before:]
+    return result, new_records
+
+
+def write_report(path: Optional[str] = None) -> Optional[str]:
+    """Write the records to path, or the path of the environment variable. csv by extension, json otherwise."""
+    path = path or os.environ.get(ENV_VAR)
+    if not path or path in ('1', 'true'):
+        path = 'instrumentation.json'
+    if path.endswith('.csv'):
+        pd.DataFrame(_records, columns=COLUMNS).to_csv(path, index=False)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(_records, f, indent=1)
+    return path
@@ -0,0 +1,66 @@
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from chat_analyzer import MY_CHAT_NAMES
+from chat_analyzer.data_processing.extract import WHATSAPP_DATETIME_FORMAT
+
+WORDS = ("hello there how are you doing today I am fine thanks for asking ok see you later what time "
+         "tomorrow sounds good let us meet at the station yes no maybe haha sorry great").split()
+EMOJIS = ['😂', '❤️', '👍', '😁', '😊', '🙏', '😍', '🥰', '😭', '🤣', '👨‍👩‍👧', '🫠', '👍🏽']
+
+
+def generate_whatsapp_export(n_messages: int, n_senders: int = 2, multi_line_ratio: float = 0.05,
+                             emoji_density: float = 0.1, date_format: str = WHATSAPP_DATETIME_FORMAT,
+                             start: str = '2015-01-01', seed: Optional[int] = 0,
+                             batch_size: int = 100_000) -> Iterator[str]:
+    """
+    Yield a synthetic WhatsApp export as text chunks of up to batch_size messages each.
+
+    The first sender is the first of MY_CHAT_NAMES. emoji_density is the probability of every word to be an
+    emoji instead, multi_line_ratio the share of messages with a second line.
+    """
+    rng = np.random.default_rng(seed)
+    senders = np.array(MY_CHAT_NAMES[:1] + [f"Contact {i}" for i in range(1, n_senders)], dtype=object)
+    words = np.array(WORDS, dtype=object)
+    emojis = np.array(EMOJIS, dtype=object)
+    current_time = pd.Timestamp(start)
+    current_sender = 0
+
+    yield f"{current_time.strftime(date_format)} - Messages and calls are end-to-end encrypted.\n"
+    for batch_start in range(0, n_messages, batch_size):
+        n = min(batch_size, n_messages - batch_start)
+
+        # Mostly short gaps within conversations, sometimes hours or days in between
+        gaps = np.where(rng.random(n) < 0.9, rng.exponential(3, n), rng.exponential(600, n)).astype(np.int64)
+        minutes = np.cumsum(gaps)
+        times = current_time + pd.to_timedelta(minutes, unit='min')
+        current_time = times[-1]
+        timestamps = pd.Series(times).dt.strftime(date_format).to_numpy()
+
+        sender_steps = np.where(rng.random(n) < 0.5, rng.integers(1, max(n_senders, 2), n), 0)
+        sender_ids = (current_sender + np.cumsum(sender_steps)) % n_senders
+        current_sender = sender_ids[-1]
+
+        n_words = rng.integers(1, 15, n)
+        tokens = np.where(rng.random(n_words.sum()) < emoji_density,
+                          rng.choice(emojis, n_words.sum()), rng.choice(words, n_words.sum()))
+        second_lines = rng.random(n) < multi_line_ratio
+
+        lines = []
+        offset = 0
+        for i in range(n):
+            message = ' '.join(tokens[offset:offset + n_words[i]])
+            offset += n_words[i]
+            if second_lines[i]:
+                message += '\nand another line'
+            lines.append(f"{timestamps[i]} - {senders[sender_ids[i]]}: {message}\n")
+        yield ''.join(lines)
+
+
+def write_whatsapp_export(path: str, n_messages: int, **kwargs) -> str:
+    with open(path, 'w', encoding='utf-8') as f:
+        for chunk in generate_whatsapp_export(n_messages, **kwargs):
+            f.write(chunk)
+    return path
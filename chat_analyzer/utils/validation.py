@@ -0,0 +1,49 @@
+"""
+Validation policy of the pandera models in data_definitions.
+
+full validates every row, sampled only the head, tail and a random sample of the rows, schema only the columns and
+their dtypes, off nothing. The mode is set by VALIDATION_MODE, or the environment variable CHAT_ANALYZER_VALIDATION,
+which worker processes inherit.
+"""
+import os
+from typing import Type
+
+import pandas as pd
+import pandera as pa
+
+from chat_analyzer import VALIDATION_MODE
+from chat_analyzer.utils import instrumentation
+
+ENV_VAR = "CHAT_ANALYZER_VALIDATION"
+VALIDATION_MODES = ('full', 'sampled', 'schema', 'off')
+N_SAMPLED_ROWS = 1_000  # Rows validated at the head, the tail and randomly in between, each
+
+
+def validation_mode() -> str:
+    mode = os.environ.get(ENV_VAR, VALIDATION_MODE)
+    if mode not in VALIDATION_MODES:
+        raise ValueError(f"Unknown validation mode {mode!r}, expected one of {VALIDATION_MODES}")
+    return mode
+
+
+def set_validation_mode(mode: str):
+    if mode not in VALIDATION_MODES:
+        raise ValueError(f"Unknown validation mode {mode!r}, expected one of {VALIDATION_MODES}")
+    os.environ[ENV_VAR] = mode
+
+
+def validate(df: pd.DataFrame, model: Type[pa.DataFrameModel]) -> pd.DataFrame:
+    """Validate df against the model as far as the validation mode asks for. Returns df itself, never a copy."""
+    mode = validation_mode()
+    if mode == 'off':
+        return df
+    with instrumentation.stage(f'validate_{model.__name__}', chat=instrumentation.current_chat(), rows_in=len(df)):
+        schema = model.to_schema()
+        if mode == 'schema':
+            schema.validate(df.iloc[:0], inplace=True)
+        elif mode == 'sampled' and len(df) > 3 * N_SAMPLED_ROWS:
+            schema.validate(df, head=N_SAMPLED_ROWS, tail=N_SAMPLED_ROWS, sample=N_SAMPLED_ROWS, random_state=0,
+                            inplace=True)
+        else:
+            schema.validate(df, inplace=True)
+    return df
@@ -0,0 +1,214 @@
+"""
+Local dashboard of the processed chats, served by the threaded http server of the standard library.
+
+    python -m chat_analyzer.visualization.dashboard --port 8050
+
+The metrics cube and its latency sketches are read and grouped by chat once, at startup. A request therefore only
+adds up the cube rows of its chat. The replies between the members of group chats are not part of the cube, so the
+messages of those chats are read from the parquet store as well. Without a cube, all messages of the store are read
+and aggregated per chat instead. The aggregates of the most recently requested chats are kept in an LRU cache, as
+are their pages. Pages load plotly.js from the server, like offline reports do.
+"""
+import argparse
+import os
+import html
+import json
+from functools import lru_cache
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional, Tuple, Dict
+from urllib.parse import quote, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+from plotly.offline import get_plotlyjs
+
+from chat_analyzer import PATH_DIR_PROCESSED_STORE, PATH_METRICS_CUBE, DASHBOARD_PORT, DASHBOARD_CACHE_SIZE
+from chat_analyzer.analysis.analysis import agg_chat_metrics, hourly_statistics, sender_pair_statistics, \
+    METRIC_COLUMNS
+from chat_analyzer.analysis.cube import read_metrics_cube, read_cube_sketches, cube_metrics
+from chat_analyzer.analysis.latency import build_latency_sketches, combine_latency_sketches, LATENCY_SKETCH_KEYS
+from chat_analyzer.data_processing.store import read_parquet_store
+from chat_analyzer.visualization.offline import PLOTLY_JS, REPORT_JS, REPORT_JS_SOURCE, report_asset_tags, \
+    figure_to_html
+from chat_analyzer.visualization.visualize import pretty_html, create_fig_hourly_barpolar, \
+    fig_time_to_reply_per_weekday, fig_time_to_reply_violin
+
+DASHBOARD_COLUMNS = ['chat', 'sender', 'receiver', 'message', 'n_symbols', 'hour', 'weekday',
+                     'duration_to_reply', 'duration_since_their_last']
+# Columns of the group chats read along with the metrics cube, for their sender_pair_statistics
+PAIR_COLUMNS = ['chat', 'sender', 'receiver', *METRIC_COLUMNS]
+HTML = 'text/html; charset=utf-8'
+JSON = 'application/json'
+JAVASCRIPT = 'text/javascript; charset=utf-8'
+
+Response = Tuple[int, str, bytes]  # Status, content type and body
+
+
+class ChatAggregates(NamedTuple):
+    metrics: pd.DataFrame  # agg_chat_metrics per sender
+    pair_metrics: Optional[pd.DataFrame]  # sender_pair_statistics, for group chats only
+    hourly: pd.DataFrame  # hourly_statistics
+    latency: pd.DataFrame  # build_latency_sketches, for the reply time box and violin plots
+
+
+class Dashboard:
+    """
+    Aggregates and pages of the chats in the metrics cube, with the latency sketches written next to it, or of the
+    chats in df without a cube. The cube, sketches and df are grouped by chat once.
+    """
+
+    def __init__(self, df: pd.DataFrame, cache_size: int = DASHBOARD_CACHE_SIZE, cube: Optional[pd.DataFrame] = None,
+                 sketches: Optional[pd.DataFrame] = None):
+        self.df = df
+        self.cube = cube
+        self.sketches = sketches
+        self.rows: Dict[str, np.ndarray] = df.groupby('chat', observed=True, sort=True).indices
+        self.chat_rows: Dict[str, np.ndarray] = self.rows if cube is None else \
+            cube.groupby('chat', sort=True).indices
+        if sketches is not None:
+            self.sketch_rows: Dict[str, np.ndarray] = sketches.groupby(level='chat', sort=True).indices
+        self.aggregates = lru_cache(maxsize=cache_size)(self._aggregates)
+        self.chat_page = lru_cache(maxsize=cache_size)(self._chat_page)
+
+    @classmethod
+    def open(cls, path_store: str = PATH_DIR_PROCESSED_STORE, cache_size: int = DASHBOARD_CACHE_SIZE,
+             path_metrics_cube: Optional[str] = None) -> 'Dashboard':
+        """
+        Dashboard of the metrics cube at path_metrics_cube and of the group chats of the store, or of all messages
+        of the store, if there is no cube with latency sketches
+        """
+        sketches = None
+        if path_metrics_cube is not None and os.path.exists(path_metrics_cube):
+            sketches = read_cube_sketches(path_metrics_cube)
+        if sketches is None:
+            return cls(read_parquet_store(path_store, columns=DASHBOARD_COLUMNS), cache_size)
+        cube = read_metrics_cube(path_metrics_cube)
+        n_senders = cube.groupby('chat')['sender'].nunique()
+        group_chats = list(n_senders.index[n_senders > 2])
+        return cls(read_parquet_store(path_store, columns=PAIR_COLUMNS, chats=group_chats), cache_size, cube, sketches)
+
+    @property
+    def chats(self):
+        return list(self.chat_rows)
+
+    def _aggregates(self, chat: str) -> ChatAggregates:
+        if self.cube is not None:
+            return self._cube_aggregates(chat)
+        df_chat = self.df.take(self.rows[chat])
+        is_group_chat = df_chat['sender'].nunique() > 2
+        return ChatAggregates(
+            metrics=agg_chat_metrics(df_chat.groupby('sender', observed=True)),
+            pair_metrics=sender_pair_statistics(df_chat).set_index(['sender', 'receiver']) if is_group_chat else None,
+            hourly=hourly_statistics(df_chat),
+            latency=build_latency_sketches(df_chat))
+
+    def _cube_aggregates(self, chat: str) -> ChatAggregates:
+        cube_chat = self.cube.take(self.chat_rows[chat])
+        sketches_chat = self.sketches.take(self.sketch_rows.get(chat, []))
+        is_group_chat = cube_chat['sender'].nunique() > 2
+        pair_metrics = None
+        if is_group_chat:
+            pair_metrics = sender_pair_statistics(self.df.take(self.rows[chat])).set_index(['sender', 'receiver'])
+        return ChatAggregates(
+            metrics=cube_metrics(cube_chat, ['sender'], sketches_chat),
+            pair_metrics=pair_metrics,
+            hourly=cube_metrics(cube_chat, ['hour', 'sender'], sketches_chat).reset_index(),
+            latency=combine_latency_sketches([sketches_chat], LATENCY_SKETCH_KEYS))
+
+    def _chat_page(self, chat: str) -> bytes:
+        aggregates = self.aggregates(chat)
+        # pretty_html formats timedeltas in place, so it gets copies of the cached aggregates
+        tables = pretty_html(aggregates.metrics.copy(), caption=f"Chat Metrics for {chat}")
+        if aggregates.pair_metrics is not None:
+            tables += pretty_html(aggregates.pair_metrics.copy(), caption=f"Replies between the Members of {chat}")
+        return _page(chat, tables +
+                     figure_to_html(create_fig_hourly_barpolar(aggregates.hourly), 'hourly_barpolar') +
+                     figure_to_html(fig_time_to_reply_per_weekday(aggregates.latency), 'time_to_reply') +
+                     figure_to_html(fig_time_to_reply_violin(aggregates.latency), 'reply_distribution'))
+
+    def index_page(self) -> bytes:
+        links = ''.join(f'<li><a href="/chat/{quote(chat, safe="")}">{html.escape(chat)}</a></li>'
+                        for chat in self.chats)
+        return _page("Chats", f'<ul style="text-align: left; display: inline-block">{links}</ul>')
+
+    def response(self, path: str) -> Response:
+        """
+        Response to a GET request of path: the index of all chats at /, the page of a chat at /chat/<chat>, and
+        its aggregates as json at /api/chats/<chat>/metrics, /pairs and /hourly.
+        """
+        parts = [unquote(part) for part in urlsplit(path).path.strip('/').split('/')]
+        if parts == ['']:
+            return HTTPStatus.OK, HTML, self.index_page()
+        if parts in ([PLOTLY_JS], [REPORT_JS]):
+            return HTTPStatus.OK, JAVASCRIPT, _asset(parts[0])
+        if parts == ['api', 'chats']:
+            return HTTPStatus.OK, JSON, json.dumps(self.chats).encode()
+        if len(parts) == 2 and parts[0] == 'chat' and parts[1] in self.chat_rows:
+            return HTTPStatus.OK, HTML, self.chat_page(parts[1])
+        if len(parts) == 4 and parts[:2] == ['api', 'chats'] and parts[2] in self.chat_rows and \
+                parts[3] in ('metrics', 'pairs', 'hourly'):
+            return HTTPStatus.OK, JSON, self._aggregate_json(parts[2], parts[3])
+        return HTTPStatus.NOT_FOUND, HTML, _page("Not found", f"No page at {html.escape(path)}")
+
+    def _aggregate_json(self, chat: str, name: str) -> bytes:
+        aggregates = self.aggregates(chat)
+        df = {'metrics': aggregates.metrics, 'pairs': aggregates.pair_metrics, 'hourly': aggregates.hourly}[name]
+        if df is None:
+            return b'[]'
+        df = df.reset_index() if name != 'hourly' else df
+        return df.to_json(orient='records').encode()
+
+
+def _page(title: str, body: str) -> bytes:
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(title)}</title>\n'
+            f'{report_asset_tags()}</head><body><center><p><a href="/">All Chats</a></p>\n{body}</center>'
+            f'</body></html>').encode()
+
+
+@lru_cache(maxsize=None)
+def _asset(filename: str) -> bytes:
+    return (get_plotlyjs() if filename == PLOTLY_JS else REPORT_JS_SOURCE).encode()
+
+
+class _DashboardHandler(BaseHTTPRequestHandler):
+    dashboard: Dashboard
+
+    def do_GET(self):
+        try:
+            status, content_type, body = self.dashboard.response(self.path)
+        except Exception as e:
+            status, content_type, body = HTTPStatus.INTERNAL_SERVER_ERROR, HTML, _page("Error", html.escape(repr(e)))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(dashboard: Dashboard, port: int = DASHBOARD_PORT, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Threaded server of the dashboard, one thread per connection. Port 0 picks a free port."""
+    handler = type('DashboardHandler', (_DashboardHandler,), {'dashboard': dashboard})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--store', default=PATH_DIR_PROCESSED_STORE, help="parquet store of the processed chats")
+    parser.add_argument('--cube', default=PATH_METRICS_CUBE,
+                        help="metrics cube of the processed chats, with its latency sketches")
+    parser.add_argument('--port', type=int, default=DASHBOARD_PORT)
+    parser.add_argument('--cache-size', type=int, default=DASHBOARD_CACHE_SIZE, help="chats kept aggregated")
+    args = parser.parse_args(argv)
+
+    dashboard = Dashboard.open(args.store, args.cache_size, args.cube)
+    server = make_server(dashboard, args.port)
+    print(f"Dashboard of {len(dashboard.chats)} chats at http://{server.server_name}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Reports, which load plotly.js from a file next to them instead of a CDN.
+
+The assets are written once per report folder and shared by all reports. Their filenames carry the plotly.js
+version and a hash of chat_report.js, so changed assets are written under a new name instead of being skipped
+as present. Figures are embedded as json, in which
+numeric arrays are base64 encoded typed arrays. chat_report.js decodes them before plotting, as the bundled
+plotly.js predates its own support for binary arrays.
+"""
+import base64
+import hashlib
+import os
+from typing import Any
+
+import numpy as np
+import plotly.graph_objs as go
+from plotly.io.json import to_json_plotly
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+
+PLOTLY_JS = f"plotly-{get_plotlyjs_version()}.min.js"
+REPORT_JS_SOURCE = """\
+(function () {
+  var TYPES = {i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array, i4: Int32Array, u4: Uint32Array,
+               f4: Float32Array, f8: Float64Array};
+  function decode(value) {
+    if (Array.isArray(value)) return value.map(decode);
+    if (value === null || typeof value !== 'object') return value;
+    if (typeof value.bdata === 'string' && TYPES[value.dtype]) {
+      var bytes = Uint8Array.from(atob(value.bdata), function (c) { return c.charCodeAt(0); });
+      return new TYPES[value.dtype](bytes.buffer);
+    }
+    var decoded = {};
+    for (var key in value) decoded[key] = decode(value[key]);
+    return decoded;
+  }
+  window.renderChatFigure = function (id, figure) {
+    Plotly.newPlot(id, decode(figure.data), decode(figure.layout || {}), {responsive: true});
+  };
+})();
+"""
+REPORT_JS = f"chat_report-{hashlib.blake2b(REPORT_JS_SOURCE.encode(), digest_size=8).hexdigest()}.js"
+TYPED_ARRAY_DTYPES = {'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2', 'int32': 'i4', 'uint32': 'u4',
+                      'float32': 'f4', 'float64': 'f8'}
+
+
+def write_report_assets(path_html_output: str):
+    """Write plotly.js and chat_report.js to the report folder, unless they are there already"""
+    for filename, source in [(PLOTLY_JS, get_plotlyjs), (REPORT_JS, lambda: REPORT_JS_SOURCE)]:
+        path = os.path.join(path_html_output, filename)
+        if os.path.exists(path):
+            continue
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(source())
+        os.replace(tmp_path, path)  # reports rendered in parallel never see a partial asset
+
+
+def report_asset_tags() -> str:
+    return f'<script src="{PLOTLY_JS}"></script>\n<script src="{REPORT_JS}"></script>\n'
+
+
+def figure_to_html(fig: go.Figure, div_id: str) -> str:
+    """Div and script plotting the figure with the shared assets"""
+    figure_json = to_json_plotly(encode_arrays(fig.to_plotly_json())).replace('</', '<\\/')
+    return f'<div id="{div_id}"></div>\n<script>renderChatFigure("{div_id}", {figure_json});</script>\n'
+
+
+def encode_arrays(obj: Any) -> Any:
+    """Replace the numeric numpy arrays in the figure dict by base64 encoded typed arrays"""
+    if isinstance(obj, np.ndarray) and obj.ndim == 1 and obj.dtype.kind in 'iuf':
+        array = _typed_array(obj)
+        data = array.astype(array.dtype.newbyteorder('<'), copy=False).tobytes()
+        return {'dtype': TYPED_ARRAY_DTYPES[array.dtype.name], 'bdata': base64.b64encode(data).decode('ascii')}
+    if isinstance(obj, dict):
+        return {key: encode_arrays(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [encode_arrays(value) for value in obj]
+    return obj
+
+
+def _typed_array(array: np.ndarray) -> np.ndarray:
+    """
+    Array of the smallest typed array dtype, which holds its values. Floats are sent as float32, which is
+    plenty for plotting. Integers beyond int32 become float64.
+    """
+    if array.dtype.kind == 'f':
+        return array.astype(np.float32, copy=False)
+    if len(array) == 0:
+        return array.astype(np.uint8)
+    low, high = array.min(), array.max()
+    for dtype in [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32]:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return array.astype(dtype, copy=False)
+    return array.astype(np.float64)
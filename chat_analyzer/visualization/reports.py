@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional, Dict, List, Sequence, Tuple
+
+import pandas as pd
+
+from chat_analyzer import N_REPORT_WORKERS, OFFLINE_REPORTS
+from chat_analyzer.data_processing.store import read_parquet_store, list_store_chats
+from chat_analyzer.utils import instrumentation
+from chat_analyzer.visualization.offline import write_report_assets, PLOTLY_JS, REPORT_JS
+from chat_analyzer.visualization.visualize import create_chat_html, chat_html_path
+
+# Bump whenever the content of the reports changes, so every report is rendered again.
+REPORT_VERSION = 4
+
+REPORT_COLUMNS = ['datetime', 'sender', 'receiver', 'message', 'n_symbols', 'hour', 'weekday',
+                  'duration_to_reply', 'duration_since_their_last']
+REPORT_HASHES = ".report_hashes.json"
+
+
+class ChatReportError(Exception):
+    """Raised after rendering, if one or more chat reports could not be created"""
+
+    def __init__(self, errors: Dict[str, BaseException]):
+        self.errors = errors
+        details = "\n".join(f"  {chat}: {type(e).__name__}: {e}" for chat, e in errors.items())
+        super().__init__(f"{len(errors)} chat report(s) failed to render:\n{details}")
+
+
+def build_chat_reports(path_store: str, path_html_output: str, chats: Optional[Sequence[str]] = None,
+                       n_workers: Optional[int] = N_REPORT_WORKERS, offline: bool = OFFLINE_REPORTS) -> List[str]:
+    """
+    Render the html report of every chat in the store, skipping chats whose report input did not change.
+
+    Each chat is read, hashed and rendered in a worker process, unless n_workers is 1. Returns the chats,
+    whose reports were rendered. Offline reports share the plotly.js written once to path_html_output.
+    """
+    os.makedirs(path_html_output, exist_ok=True)
+    if offline:
+        write_report_assets(path_html_output)
+    all_chats = chats is None
+    chats = list_store_chats(path_store) if all_chats else list(chats)
+    hashes = _read_report_hashes(path_html_output)
+    jobs = {chat: (path_store, chat, path_html_output,
+                   hashes.get(chat) if os.path.exists(chat_html_path(chat, path_html_output)) else None, offline)
+            for chat in chats}
+
+    rendered: List[str] = []
+    errors: Dict[str, BaseException] = {}
+    if n_workers == 1 or len(jobs) <= 1:
+        for chat, args in jobs.items():
+            try:
+                hashes[chat], is_rendered = render_chat_report(*args)
+                rendered += [chat] if is_rendered else []
+            except Exception as e:
+                errors[chat] = e
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(instrumentation.call_collecting, instrumentation.settings(),
+                                       render_chat_report, *args): chat for chat, args in jobs.items()}
+            for future in as_completed(futures):
+                chat = futures[future]
+                try:
+                    (hashes[chat], is_rendered), records = future.result()
+                    instrumentation.extend_records(records)
+                    rendered += [chat] if is_rendered else []
+                except Exception as e:
+                    errors[chat] = e
+
+    if all_chats:  # hashes of chats no longer in the store are dropped
+        hashes = {chat: hashes[chat] for chat in chats if chat in hashes}
+    _write_report_hashes(path_html_output, hashes)
+    if errors:
+        raise ChatReportError(errors)
+    return sorted(rendered)
+
+
+def render_chat_report(path_store: str, chat: str, path_html_output: str, previous_hash: Optional[str] = None,
+                       offline: bool = OFFLINE_REPORTS) -> Tuple[str, bool]:
+    """Render the report of one chat, unless its input hashes to previous_hash. Returns hash and if rendered."""
+    df_chat = read_parquet_store(path_store, columns=REPORT_COLUMNS, chats=[chat])
+    input_hash = report_input_hash(df_chat, offline)
+    if input_hash == previous_hash:
+        return input_hash, False
+
+    print(f"Creating chat visualization for {chat}")
+    with instrumentation.stage('html_render', chat=chat, rows_in=len(df_chat)):
+        create_chat_html(df_chat=df_chat, chat=chat, path_html_output=path_html_output, offline=offline)
+    return input_hash, True
+
+
+def report_input_hash(df_chat: pd.DataFrame, offline: bool = OFFLINE_REPORTS) -> str:
+    row_hashes = pd.util.hash_pandas_object(df_chat[REPORT_COLUMNS], index=False).to_numpy()
+    digest = hashlib.blake2b(row_hashes.tobytes(), digest_size=20)
+    digest.update(f'{REPORT_VERSION}-{offline}'.encode())
+    if offline:  # reports link the shared assets by filenames, which change with their content
+        digest.update(f'{PLOTLY_JS}-{REPORT_JS}'.encode())
+    return digest.hexdigest()
+
+
+def _read_report_hashes(path_html_output: str) -> Dict[str, str]:
+    path = os.path.join(path_html_output, REPORT_HASHES)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_report_hashes(path_html_output: str, hashes: Dict[str, str]):
+    path = os.path.join(path_html_output, REPORT_HASHES)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
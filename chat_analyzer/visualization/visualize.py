@@ -4,45 +4,81 @@ import os
 from io import BytesIO
 from typing import Optional
 
+import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objs as go
 from calplot import calplot
+from plotly.subplots import make_subplots
 
-from chat_analyzer.analysis.analysis import agg_chat_metrics, n_messages_per_day, hourly_statistics
-from chat_analyzer.utils.data_definitions import ChatFeatures
+from chat_analyzer import OFFLINE_REPORTS
+from chat_analyzer.analysis.latency import build_latency_sketches, combine_latency_sketches, latency_quantiles, \
+    bin_centers_s
+from chat_analyzer.analysis.analysis import agg_chat_metrics, n_messages_per_day, hourly_statistics, \
+    sender_pair_statistics
+from chat_analyzer.utils.data_definitions import ChatFeatures, cat_weekdays
+from chat_analyzer.visualization.offline import write_report_assets, report_asset_tags, figure_to_html
 
 PRIMARY_COLOR = "#aaaaaa"
 SECONDARY_COLOR = "#dddddd"
 
 
-def create_chat_html(df_chat: ChatFeatures, chat: str, path_html_output: str):
+def create_chat_html(df_chat: ChatFeatures, chat: str, path_html_output: str, offline: bool = OFFLINE_REPORTS) -> str:
+    """
+    Write the html report of the chat. Offline reports load plotly.js from the report folder and draw the calendar
+    heatmap with plotly, instead of embedding a matplotlib image of calplot.
+    """
     # Chat Overview Metrics
-    chat_metrics = agg_chat_metrics(df_chat.groupby('sender'))
+    chat_metrics = agg_chat_metrics(df_chat.groupby('sender', observed=True))
     html_chat_metrics = pretty_html(chat_metrics, caption=f"Chat Metrics for {chat}")
+    if df_chat['sender'].nunique() > 2:
+        pair_metrics = sender_pair_statistics(df_chat).set_index(['sender', 'receiver'])
+        html_chat_metrics += pretty_html(pair_metrics, caption=f"Replies between the Members of {chat}")
 
     # Calplot of messages
-    mplfig, _ = calplot(n_messages_per_day(df_chat), cmap='YlGn')
-    html_calplot = matplotlib_fig_to_html(mplfig)
+    if offline:
+        html_calplot = figure_to_html(create_fig_calendar_heatmap(n_messages_per_day(df_chat)), 'calendar')
+    else:
+        mplfig, _ = calplot(n_messages_per_day(df_chat), cmap='YlGn')
+        html_calplot = matplotlib_fig_to_html(mplfig)
+        plt.close(mplfig)
 
     # Spider Charts Activity per Day
     hour_stats = hourly_statistics(df_chat)
     fig_hourly_barpolar = create_fig_hourly_barpolar(hour_stats)
-    html_hourly_barpolar = fig_hourly_barpolar.to_html(full_html=False, include_plotlyjs='cdn')
-
-    # Barplot time to reply by weekday
-    fig_time_to_reply = fig_time_to_reply_per_weekday(df_chat)
-    html_time_to_reply = fig_time_to_reply.to_html(full_html=False, include_plotlyjs='cdn')
 
-    filename = f'Chat_Analysis_{chat.replace(" ", "_")}.html'
-    filepath = os.path.join(path_html_output, filename)
+    # Box and violin plots of the time to reply, from its latency sketches
+    latency_sketches = build_latency_sketches(df_chat)
+    fig_time_to_reply = fig_time_to_reply_per_weekday(latency_sketches)
+    fig_reply_distribution = fig_time_to_reply_violin(latency_sketches)
+
+    if offline:
+        write_report_assets(path_html_output)
+        html_hourly_barpolar = figure_to_html(fig_hourly_barpolar, 'hourly_barpolar')
+        html_time_to_reply = figure_to_html(fig_time_to_reply, 'time_to_reply')
+        html_reply_distribution = figure_to_html(fig_reply_distribution, 'reply_distribution')
+    else:
+        html_hourly_barpolar = fig_hourly_barpolar.to_html(full_html=False, include_plotlyjs='cdn')
+        html_time_to_reply = fig_time_to_reply.to_html(full_html=False, include_plotlyjs='cdn')
+        html_reply_distribution = fig_reply_distribution.to_html(full_html=False, include_plotlyjs='cdn')
+
+    filepath = chat_html_path(chat, path_html_output)
     with open(filepath, 'w+') as f:
+        if offline:
+            f.write(report_asset_tags())
         f.write("<center>")
         f.write(html_chat_metrics)
         f.write(html_calplot)
         f.write(html_hourly_barpolar)
         f.write(html_time_to_reply)
+        f.write(html_reply_distribution)
         f.write("</center>")
+    return filepath
+
+
+def chat_html_path(chat: str, path_html_output: str) -> str:
+    filename = f'Chat_Analysis_{chat.replace(" ", "_")}.html'
+    return os.path.join(path_html_output, filename)
 
 
 def hover(hover_color=SECONDARY_COLOR):
@@ -134,9 +170,33 @@ def matplotlib_fig_to_html(fig):
     return html
 
 
+def create_fig_calendar_heatmap(n_msg_per_day: pd.Series) -> go.Figure:
+    """Messages per day as heatmap of the weeks and weekdays of every year, as calplot draws it"""
+    days = n_msg_per_day.index
+    years = sorted(days.year.unique())
+    fig = make_subplots(rows=max(len(years), 1), cols=1, subplot_titles=[str(year) for year in years],
+                        vertical_spacing=0.4 / max(len(years), 1))
+    for row, year in enumerate(years, start=1):
+        n_msg = n_msg_per_day[days.year == year]
+        weekday_of_new_year = pd.Timestamp(year=year, month=1, day=1).dayofweek
+        fig.add_trace(go.Heatmap(
+            x=((n_msg.index.dayofyear - 1 + weekday_of_new_year) // 7).to_numpy(),
+            y=n_msg.index.dayofweek.to_numpy(),
+            z=n_msg.to_numpy(),
+            text=n_msg.index.strftime('%d.%m.%Y'),
+            hovertemplate="%{text}: %{z} Messages<extra></extra>",
+            zmin=0, zmax=n_msg_per_day.max(), colorscale='YlGn', showscale=row == 1, xgap=2, ygap=2),
+            row=row, col=1)
+        fig.update_yaxes(tickvals=list(range(7)), ticktext=['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+                         autorange='reversed', row=row, col=1)
+        fig.update_xaxes(range=[-0.5, 53.5], showticklabels=False, showgrid=False, row=row, col=1)
+    fig.update_layout(height=200 * max(len(years), 1), plot_bgcolor='white')
+    return fig
+
+
 def create_fig_hourly_barpolar(df) -> go.Figure:
     fig = go.Figure()
-    for sender, dfp in df.groupby('sender'):
+    for sender, dfp in df.groupby('sender', observed=True):
         customdata = pd.concat([
             dfp.hour,
             dfp.hour + 1 % 24,
@@ -183,12 +243,42 @@ def create_fig_hourly_barpolar(df) -> go.Figure:
     return fig
 
 
-def fig_time_to_reply_per_weekday(df) -> go.Figure:
-    return px.box(df,
-                  x='weekday',
-                  y=df['duration_to_reply'].dt.total_seconds() / 60,
-                  color='sender',
-                  labels={'y': "Time to Reply [min]"},
-                  log_y=True,
-                  height=700,
-                  category_orders={'weekday': df.weekday.cat.categories})
+def fig_time_to_reply_per_weekday(sketches: pd.DataFrame) -> go.Figure:
+    """
+    Box plot of the reply times per weekday and sender, drawn from their latency sketches rather than every
+    message. Whiskers span the 1st to the 99th percentile.
+    """
+    sketches = combine_latency_sketches([sketches], ['sender', 'weekday'])
+    quantiles = latency_quantiles(sketches, {'lowerfence': 0.01, 'q1': 0.25, 'median': 0.5, 'q3': 0.75,
+                                             'upperfence': 0.99})
+    quantiles = quantiles[sketches.sum(axis=1) > 0] / pd.Timedelta(minutes=1)
+    fig = go.Figure()
+    for sender, df_sender in quantiles.groupby(level='sender', observed=True):
+        fig.add_trace(go.Box(x=df_sender.index.get_level_values('weekday').astype(str), name=str(sender),
+                             **{column: df_sender[column].to_numpy() for column in df_sender}))
+    fig.update_layout(boxmode='group', height=700, yaxis={'type': 'log', 'title': "Time to Reply [min]"},
+                      xaxis={'title': 'weekday', 'categoryorder': 'array',
+                             'categoryarray': list(cat_weekdays.categories)})
+    return fig
+
+
+def fig_time_to_reply_violin(sketches: pd.DataFrame) -> go.Figure:
+    """Distribution of the reply times per sender as violins, whose widths are the counts of the sketch bins"""
+    sketches = combine_latency_sketches([sketches], ['sender'])
+    minutes = bin_centers_s() / 60
+    medians = latency_quantiles(sketches, {'median': 0.5})['median']
+    fig = go.Figure()
+    for position, (sender, counts) in enumerate(sketches.iterrows()):
+        counts = counts.to_numpy()
+        if not counts.any():
+            continue
+        used = slice(np.flatnonzero(counts)[0], np.flatnonzero(counts)[-1] + 1)
+        width = 0.45 * counts[used] / counts.max()
+        fig.add_trace(go.Scatter(
+            x=np.concatenate([position - width, (position + width)[::-1]]),
+            y=np.concatenate([minutes[used], minutes[used][::-1]]),
+            fill='toself', mode='lines', name=str(sender),
+            hovertemplate=f"Median: {timedelta_to_str(medians[sender])}<extra>{sender}</extra>"))
+    fig.update_layout(height=700, yaxis={'type': 'log', 'title': "Time to Reply [min]"},
+                      xaxis={'tickvals': list(range(len(sketches))), 'ticktext': [str(s) for s in sketches.index]})
+    return fig
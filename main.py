@@ -1,15 +1,16 @@
-import pandas as pd
-
-from chat_analyzer import PATH_WHATSAPP_MSG, PATH_SIGNAL_MSG, PATH_DIR_PROCESSED_PICKLES, \
-    PATH_DIR_CHAT_HTML_VISUALIZATIONS
-from chat_analyzer.data_processing.load import agg_to_pkl
-from chat_analyzer.visualization.visualize import create_chat_html
+from chat_analyzer import PATH_WHATSAPP_MSG, PATH_SIGNAL_MSG, PATH_DIR_PROCESSED_STORE, \
+    PATH_DIR_CHAT_HTML_VISUALIZATIONS, PATH_DIR_CACHE, PATH_METRICS_CUBE, PATH_DIR_SEARCH_INDEX
+from chat_analyzer.data_processing.load import agg_to_parquet
+from chat_analyzer.utils import instrumentation
+from chat_analyzer.visualization.reports import build_chat_reports
 
 if __name__ == '__main__':
-    pkl_path = agg_to_pkl(PATH_WHATSAPP_MSG, PATH_SIGNAL_MSG, PATH_DIR_PROCESSED_PICKLES)
-    print(f"Chats aggregated in pickle file at {pkl_path}")
+    path_store = agg_to_parquet(PATH_WHATSAPP_MSG, PATH_SIGNAL_MSG, PATH_DIR_PROCESSED_STORE, PATH_DIR_CACHE,
+                                PATH_METRICS_CUBE, PATH_DIR_SEARCH_INDEX)
+    print(f"Chats aggregated in parquet store at {path_store}")
+
+    rendered = build_chat_reports(path_store, PATH_DIR_CHAT_HTML_VISUALIZATIONS)
+    print(f"Chat visualizations updated for {len(rendered)} chat(s)")
 
-    df = pd.read_pickle(pkl_path)
-    for chat, df_chat in df.groupby("chat"):
-        print(f"Creating chat visualization for {chat}")
-        create_chat_html(df_chat=df_chat, chat=chat, path_html_output=PATH_DIR_CHAT_HTML_VISUALIZATIONS)
+    if instrumentation.is_enabled():
+        print(f"Stage timings written to {instrumentation.write_report()}")
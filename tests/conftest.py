@@ -0,0 +1,25 @@
+import pytest
+
+from chat_analyzer.utils.validation import set_validation_mode
+
+# Short chat of Fabio Meier with {name}, around the turn of the year
+CHAT_TEMPLATE = '''31/12/2019, 23:39 - Fabio Meier: Hello there
+01/01/2020, 07:00 - {name}: Who are you? 😡
+01/01/2020, 11:43 - Fabio Meier: Leave me alone.
+02/01/2020, 13:01 - {name}: Sorry 👍👍.
+'''
+
+
+@pytest.fixture(autouse=True, scope='session')
+def full_validation():
+    """Tests validate every row, whatever the configured validation mode"""
+    set_validation_mode('full')
+
+
+@pytest.fixture
+def write_chats():
+    """Writes a WhatsApp export of CHAT_TEMPLATE per name into a folder"""
+    def write(path, names):
+        for name in names:
+            (path / f"WhatsApp Chat with {name}.txt").write_text(CHAT_TEMPLATE.format(name=name), encoding='utf-8')
+    return write
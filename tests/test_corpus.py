@@ -0,0 +1,70 @@
+import pandas as pd
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+from chat_analyzer.analysis.analysis import agg_chat_metrics, hourly_statistics
+from chat_analyzer.analysis.corpus import Corpus
+from chat_analyzer.data_processing import store
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations, agg_to_parquet
+from chat_analyzer.data_processing.store import write_parquet_store
+from chat_analyzer.utils.synthetic import write_whatsapp_export
+
+
+def corpus_store(tmp_path) -> str:
+    path_chats = tmp_path / "chats"
+    path_chats.mkdir()
+    for i, n in enumerate([300, 500]):
+        write_whatsapp_export(str(path_chats / f"WhatsApp Chat with Contact {i}.txt"), n, seed=i)
+    df = aggregate_whatsapp_conversations(str(path_chats), n_workers=1)
+    write_parquet_store(df, str(tmp_path / "store"))
+    return str(tmp_path / "store")
+
+
+def test_corpus_metrics_match_analysis_of_the_filtered_messages(tmp_path):
+    path_store = corpus_store(tmp_path)
+    df = store.read_parquet_store(path_store)
+    df = df[(df.chat == 'Contact 1') & (df.datetime >= pd.Timestamp('2015-01-03'))]
+
+    corpus = Corpus.open(path_store).filter(chat=['Contact 0', 'Contact 1'], since='2015-01-02')
+    corpus = corpus.filter(chat='Contact 1', since='2015-01-03')
+
+    assert corpus.list_chats() == ['Contact 1']
+    assert_frame_equal(corpus.metrics(by='weekday'), agg_chat_metrics(df.groupby('weekday', observed=True)))
+    assert_frame_equal(corpus.hourly_statistics(), hourly_statistics(df))
+
+
+def test_corpus_reads_only_on_results_and_pushes_filters_down(tmp_path, monkeypatch):
+    path_store = corpus_store(tmp_path)
+    reads = []
+    read_parquet_store = store.read_parquet_store
+    monkeypatch.setattr('chat_analyzer.analysis.corpus.read_parquet_store',
+                        lambda *args, **kwargs: reads.append(kwargs) or read_parquet_store(*args, **kwargs))
+
+    corpus = Corpus.open(path_store).filter(sender='Fabio Meier', until='2015-02-01').select('datetime', 'message')
+    assert reads == []
+
+    df = corpus.to_pandas()
+    assert list(df.columns) == ['datetime', 'message']
+    assert reads[0]['senders'] == ('Fabio Meier',) and reads[0]['until'] == pd.Timestamp('2015-02-01')
+    corpus.metrics(by=['chat', 'sender'])
+    assert set(reads[1]['columns']) == {'chat', 'sender', 'message', 'n_symbols', 'duration_to_reply',
+                                        'duration_since_their_last'}
+
+
+def test_corpus_answers_aggregate_queries_from_the_metrics_cube(tmp_path, monkeypatch):
+    path_chats, path_store, path_cube = tmp_path / "chats", str(tmp_path / "store"), str(tmp_path / "cube.parquet")
+    path_chats.mkdir()
+    for i, n in enumerate([300, 500]):
+        write_whatsapp_export(str(path_chats / f"WhatsApp Chat with Contact {i}.txt"), n, seed=i, n_senders=2 + i)
+    agg_to_parquet(str(path_chats), None, path_store, str(tmp_path / "cache"), path_cube)
+    rows = Corpus.open(path_store).filter(chat='Contact 1', sender=['Fabio Meier', 'Contact 2'])
+    expected = [rows.metrics(by=['weekday', 'sender']), rows.metrics(by='chat'), rows.hourly_statistics()]
+    expected_per_day = rows.messages_per_day()
+
+    monkeypatch.setattr('chat_analyzer.analysis.corpus.read_parquet_store', None)
+    corpus = Corpus.open(path_store, path_metrics_cube=path_cube).filter(chat='Contact 1')
+    corpus = corpus.filter(sender=['Fabio Meier', 'Contact 2'])
+
+    results = [corpus.metrics(by=['weekday', 'sender']), corpus.metrics(by='chat'), corpus.hourly_statistics()]
+    for result, expected_result in zip(results, expected):
+        assert_frame_equal(result, expected_result)
+    assert_series_equal(corpus.messages_per_day(), expected_per_day)
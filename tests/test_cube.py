@@ -0,0 +1,58 @@
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+from chat_analyzer.analysis.analysis import hourly_statistics, agg_chat_metrics, n_messages_per_day
+from chat_analyzer.analysis.cube import build_metrics_cube, cube_metrics, cube_messages_per_day, \
+    update_metrics_cube, read_metrics_cube, build_cube_sketches, read_cube_sketches
+from chat_analyzer.analysis.latency import REPLY_QUANTILES
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations
+from chat_analyzer.utils.synthetic import write_whatsapp_export
+
+
+def write_exports(path, n_messages=(300, 500)):
+    for i, n in enumerate(n_messages):
+        write_whatsapp_export(str(path / f"WhatsApp Chat with Contact {i}.txt"), n, n_senders=2, seed=i)
+
+
+def test_cube_metrics_match_analysis_of_the_messages(tmp_path):
+    write_exports(tmp_path)
+    df = aggregate_whatsapp_conversations(str(tmp_path), n_workers=1)
+
+    cube = build_metrics_cube(df)
+    sketches = build_cube_sketches(df)
+
+    assert len(cube) < len(df)
+    assert_frame_equal(hourly_statistics(df), cube_metrics(cube, ['hour', 'sender'], sketches).reset_index())
+    assert_frame_equal(agg_chat_metrics(df.groupby(['weekday', 'sender'], observed=True)),
+                       cube_metrics(cube, ['weekday', 'sender'], sketches))
+    assert_frame_equal(agg_chat_metrics(df.groupby('chat')), cube_metrics(cube, ['chat'], sketches))
+    assert not set(REPLY_QUANTILES) & set(cube_metrics(cube, ['year'], sketches))
+    assert_series_equal(n_messages_per_day(df), cube_messages_per_day(cube))
+
+
+def test_update_metrics_cube_matches_rebuild(tmp_path):
+    write_exports(tmp_path, n_messages=[400])
+    df = aggregate_whatsapp_conversations(str(tmp_path), n_workers=1)
+    df_changed = df.copy()
+    df_changed.loc[df.index[-10:], 'n_symbols'] += 1
+
+    cube = update_metrics_cube(build_metrics_cube(df.iloc[:-10]), df_changed.iloc[-20:], df.iloc[-20:-10])
+
+    assert_frame_equal(build_metrics_cube(df_changed), cube)
+
+
+def test_aggregate_whatsapp_conversations_updates_metrics_cube_of_appended_exports(tmp_path):
+    path_chats, path_cache, path_cube = tmp_path / "chats", tmp_path / "cache", str(tmp_path / "cube.parquet")
+    path_chats.mkdir()
+    write_exports(path_chats)
+    aggregate_whatsapp_conversations(str(path_chats), n_workers=1, path_cache=str(path_cache),
+                                     path_metrics_cube=path_cube)
+
+    path_export = path_chats / "WhatsApp Chat with Contact 1.txt"
+    with open(path_export, 'a', encoding='utf-8') as f:
+        f.write('31/12/2030, 23:59 - Contact 1: Happy new year 🎉\n')
+    df = aggregate_whatsapp_conversations(str(path_chats), n_workers=1, path_cache=str(path_cache),
+                                          path_metrics_cube=path_cube)
+
+    assert_frame_equal(build_metrics_cube(df), read_metrics_cube(path_cube))
+    assert_frame_equal(build_cube_sketches(df), read_cube_sketches(path_cube))
+    assert len(list(path_cache.glob('*.cube.pkl'))) == 2
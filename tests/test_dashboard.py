@@ -0,0 +1,82 @@
+import json
+import threading
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+import pytest
+from pandas.testing import assert_frame_equal
+
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations, agg_to_parquet
+from chat_analyzer.data_processing.store import write_parquet_store
+from chat_analyzer.utils.synthetic import write_whatsapp_export
+from chat_analyzer.visualization.dashboard import Dashboard, make_server
+from chat_analyzer.visualization.offline import PLOTLY_JS
+
+
+@pytest.fixture(scope='module')
+def dashboard(tmp_path_factory):
+    path = tmp_path_factory.mktemp('dashboard')
+    path_chats, path_store = path / "chats", str(path / "store")
+    path_chats.mkdir()
+    write_whatsapp_export(str(path_chats / "WhatsApp Chat with Max.txt"), 300, seed=1)
+    write_whatsapp_export(str(path_chats / "WhatsApp Chat with Club.txt"), 300, seed=2, n_senders=4)
+    write_parquet_store(aggregate_whatsapp_conversations(str(path_chats), n_workers=1), path_store)
+    return Dashboard.open(path_store, cache_size=1)
+
+
+def test_dashboard_aggregates_requested_chats_once(dashboard):
+    assert dashboard.chats == ['Club', 'Contact 1']
+
+    status, _, body = dashboard.response('/chat/Contact%201')
+    assert status == 200 and b'renderChatFigure("hourly_barpolar"' in body
+    assert dashboard.response('/chat/Contact%201')[2] is body
+    assert dashboard.aggregates.cache_info().misses == 1
+
+    assert dashboard.response('/chat/Club')[0] == 200
+    pairs = json.loads(dashboard.response('/api/chats/Club/pairs')[2])
+    assert {(p['sender'], p['receiver']) for p in pairs} >= {('Contact 1', 'Contact 2')}
+    hourly = json.loads(dashboard.response('/api/chats/Club/hourly')[2])
+    assert sum(h['total_messages'] for h in hourly) == len(dashboard.df[dashboard.df.chat == 'Club'])
+    assert dashboard.response('/chat/Nobody')[0] == 404
+
+
+def test_dashboard_server_answers_concurrent_requests(dashboard):
+    server = make_server(dashboard, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        results = []
+        threads = [threading.Thread(target=lambda path=path: results.append(urlopen(url + path).read()))
+                   for path in ['/', '/api/chats', f'/{PLOTLY_JS}', '/chat/Club', '/chat/Contact%201'] * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 10
+        assert json.loads(urlopen(url + '/api/chats').read()) == dashboard.chats
+        with pytest.raises(HTTPError):
+            urlopen(url + '/api/chats/Club/unknown')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_dashboard_aggregates_chats_from_the_metrics_cube(tmp_path):
+    path_chats, path_store, path_cube = tmp_path / "chats", str(tmp_path / "store"), str(tmp_path / "cube.parquet")
+    path_chats.mkdir()
+    write_whatsapp_export(str(path_chats / "WhatsApp Chat with Max.txt"), 300, seed=1)
+    write_whatsapp_export(str(path_chats / "WhatsApp Chat with Club.txt"), 300, seed=2, n_senders=4)
+    agg_to_parquet(str(path_chats), None, path_store, str(tmp_path / "cache"), path_cube)
+
+    from_rows = Dashboard.open(path_store)
+    dashboard = Dashboard.open(path_store, path_metrics_cube=path_cube)
+
+    assert dashboard.chats == from_rows.chats == ['Club', 'Contact 1']
+    assert set(dashboard.df['chat']) == {'Club'}
+    for chat in dashboard.chats:
+        aggregates, expected = dashboard.aggregates(chat), from_rows.aggregates(chat)
+        assert_frame_equal(aggregates.metrics, expected.metrics)
+        assert_frame_equal(aggregates.hourly, expected.hourly)
+        assert aggregates.latency.to_numpy().sum() == expected.latency.to_numpy().sum()
+        assert dashboard.response(f'/chat/{chat.replace(" ", "%20")}')[0] == 200
+    assert_frame_equal(dashboard.aggregates('Club').pair_metrics, from_rows.aggregates('Club').pair_metrics)
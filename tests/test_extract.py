@@ -1,12 +1,15 @@
 from pandas import Timestamp, Timedelta
 from pandas.testing import assert_frame_equal
 
+import numpy as np
 import pandas as pd
 import pytest
 from pandera.typing import DataFrame
 
-from chat_analyzer.data_processing.extract import parse_whatsapp, merge_consecutive_msg
+from chat_analyzer.data_processing.extract import parse_whatsapp, merge_consecutive_msg, iter_parse_whatsapp, \
+    detect_whatsapp_datetime_format, merge_sorted_chats, merge_consecutive_msg_groupby
 from chat_analyzer.utils.data_definitions import RawChat
+from chat_analyzer.utils.synthetic import generate_whatsapp_export
 
 
 def test_parse_whatsapp_ignores_whatsapp_disclaimer():
@@ -74,13 +77,91 @@ def test_parse_whatsapp_can_handle_spaces_in_name():
 
 def test_parse_whatsapp_raises_change_in_datetime_format():
     raw_text_input = '''
-06/21/2020, 23:39 - Max: Hello there
-07/21/2020, 07:00 - Veronika: Who are you?
+21/06/2020, 23:39 - Max: Hello there
+06/22/2020, 07:00 - Veronika: Who are you?
         '''
     with pytest.raises(ValueError):
         _ = parse_whatsapp(raw_text_input)
 
 
+@pytest.mark.parametrize('timestamps, datetime_format', [
+    (['06/21/2020, 23:39', '07/21/2020, 07:00'], '%m/%d/%Y, %H:%M'),
+    (['1/6/20, 11:39\u202fPM', '1/7/20, 1:09\u202fAM'], '%m/%d/%y, %I:%M\u202f%p'),
+    (['06.01.20 23:39', '21.01.20 07:00'], '%d.%m.%y %H:%M'),
+    (['06/01/2020, 23:39', '01/02/2020, 07:00'], '%d/%m/%Y, %H:%M'),
+    (['01/02/2020, 23:39', '02/01/2020, 07:00'], '%m/%d/%Y, %H:%M'),
+])
+def test_detect_whatsapp_datetime_format(timestamps, datetime_format):
+    assert detect_whatsapp_datetime_format(timestamps) == datetime_format
+
+
+def test_parse_whatsapp_parses_us_exports_with_12h_clock():
+    raw_text_input = '''
+6/21/20, 11:39 PM - Max: Hello there
+6/22/20, 7:00 AM - Veronika: Who are you?
+'''
+    result = parse_whatsapp(raw_text_input)
+
+    assert list(result.datetime) == [pd.Timestamp('2020-06-21 23:39:00'), pd.Timestamp('2020-06-22 07:00:00')]
+
+
+def test_parse_whatsapp_joins_multi_line_messages():
+    raw_text_input = '''
+06/01/2020, 23:39 - Max: Hello there
+how are you?
+
+still there?
+07/01/2020, 07:00 - Messages and calls are end-to-end encrypted.
+No one outside of this chat can read them.
+07/01/2020, 07:00 - Veronika: Who are you?
+
+        '''
+    result = parse_whatsapp(raw_text_input)
+
+    expected = {
+        'index': [0, 1], 'columns': ['sender', 'message', 'datetime'],
+        'data': [
+            ['Max', 'Hello there\nhow are you?\n\nstill there?', pd.Timestamp('2020-01-06 23:39:00')],
+            ['Veronika', 'Who are you?', pd.Timestamp('2020-01-07 07:00:00')]],
+        'index_names': [None], 'column_names': [None]}
+    df_expected = pd.DataFrame.from_dict(expected, orient='tight')
+
+    assert_frame_equal(result, df_expected)
+
+
+def test_parse_whatsapp_splits_lines_at_newlines_only():
+    raw_text_input = ('06/01/2020, 23:39 - Max: Hello\u2028there\x0cand\x85here\r\n'
+                      '07/01/2020, 07:00 - Veronika: Who are you?\n')
+    result = parse_whatsapp(raw_text_input)
+
+    assert list(result.message) == ['Hello\u2028there\x0cand\x85here', 'Who are you?']
+
+
+def test_iter_parse_whatsapp_batches_match_full_parse():
+    raw_text_input = '''06/01/2020, 23:39 - Max: Hello there
+07/01/2020, 07:00 - Veronika: Who are you?
+second line
+07/01/2020, 11:43 - Veronika: Leave me alone.
+07/01/2020, 13:01 - Max: Sorry.
+'''
+    batches = list(iter_parse_whatsapp(raw_text_input.splitlines(keepends=True), batch_size=3))
+
+    assert [len(b) for b in batches] == [3, 1]
+    assert_frame_equal(parse_whatsapp(raw_text_input), pd.concat(batches, ignore_index=True))
+
+
+def test_merge_sorted_chats_interleaves_batches_in_time_order():
+    def chat(sender, minutes, batch_size):
+        df = pd.DataFrame({'sender': sender, 'message': [f'{sender}{m}' for m in minutes],
+                           'datetime': pd.Timestamp('2020-01-01') + pd.to_timedelta(minutes, unit='min')})
+        return [df.iloc[i:i + batch_size] for i in range(0, len(df), batch_size)]
+
+    merged = pd.concat(merge_sorted_chats(chat('A', [0, 2, 2, 5, 9, 10], 4), chat('B', [1, 2, 3, 11], 1)),
+                       ignore_index=True)
+
+    assert list(merged.message) == ['A0', 'B1', 'A2', 'A2', 'B2', 'B3', 'A5', 'A9', 'A10', 'B11']
+
+
 def test_merge_consecutive_msg():
     raw = {
         'index': [0, 1, 2, 3, 4], 'columns': ['sender', 'message', 'datetime'],
@@ -111,3 +192,14 @@ def test_merge_consecutive_msg():
     df_expected = pd.DataFrame.from_dict(expected, orient='tight')
 
     assert_frame_equal(result, df_expected)
+
+
+@pytest.mark.parametrize('merge_window_s', [0, 30, 60, 3600, 1e9])
+def test_merge_consecutive_msg_matches_groupby(merge_window_s):
+    df = parse_whatsapp(''.join(generate_whatsapp_export(2000, n_senders=3, seed=1)))
+    df.loc[[3, 4, 5], 'message'] = ['', 'multi\nline', '']
+    df = df.assign(source='export.txt', offset=np.arange(len(df)) * 10)
+
+    assert_frame_equal(merge_consecutive_msg(df, merge_window_s), merge_consecutive_msg_groupby(df, merge_window_s))
+    assert_frame_equal(merge_consecutive_msg(df.iloc[:0], merge_window_s),
+                       merge_consecutive_msg_groupby(df.iloc[:0], merge_window_s))
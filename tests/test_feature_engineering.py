@@ -1,9 +1,13 @@
+import emoji
+import numpy as np
 import pandas as pd
 from pandas import Timedelta, NaT
 from pandas._testing import assert_series_equal
 
 from chat_analyzer.data_processing.feature_engineering import determine_duration_since_their_last_message, determine_duration_to_reply, \
-    extract_emojis
+    extract_emojis, extract_string_emojis, extract_emojis_long, count_emojis, compact_chat_features, \
+    reply_time_kernel, extract_single_chat_features
+from chat_analyzer.utils.data_definitions import cat_weekdays
 
 
 def test_determine_duration_since_their_last_message():
@@ -58,6 +62,43 @@ def test_determine_duration_to_reply():
     assert_series_equal(expected, out)
 
 
+def test_reply_time_kernel_matches_determine_functions():
+    rng = np.random.default_rng(0)
+    n = 1_000
+    datetime = pd.Series(pd.Timestamp('2023-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 100_000, n)), unit='min'))
+    datetime_last = datetime + pd.to_timedelta(rng.integers(0, 5, n), unit='min')
+    datetime_last[rng.random(n) < 0.2] = NaT
+    df = pd.DataFrame({'sender': rng.choice(list('XY'), n), 'datetime': datetime, 'datetime_last': datetime_last})
+
+    since_their_last, to_reply = reply_time_kernel(pd.Categorical(df.sender, categories=list('XY')).codes,
+                                                   df.datetime.to_numpy('datetime64[ns]').view(np.int64),
+                                                   df.datetime_last.to_numpy('datetime64[ns]').view(np.int64))
+
+    assert_series_equal(determine_duration_since_their_last_message(df),
+                        pd.Series(since_their_last.view('timedelta64[ns]')), check_names=False)
+    assert_series_equal(determine_duration_to_reply(df),
+                        pd.Series(to_reply.view('timedelta64[ns]')), check_names=False)
+
+
+def test_extract_single_chat_features_attributes_group_chat_replies_to_the_preceding_sender():
+    datetime = pd.Series(pd.to_datetime(['2023-01-01 12:00', '2023-01-01 12:10', '2023-01-01 12:20',
+                                         '2023-01-01 12:25', '2023-01-01 13:00']))
+    df = pd.DataFrame({'sender': list('ABCCA'), 'message': list('abcde'), 'datetime': datetime,
+                       'datetime_last': datetime})
+
+    out = extract_single_chat_features(df, group_name='Club')
+
+    assert list(out.chat.unique()) == ['Club']
+    assert list(df.columns) == ['sender', 'message', 'datetime', 'datetime_last']
+    assert list(out.receiver) == [None, 'A', 'B', 'B', 'C']
+    assert_series_equal(out.duration_to_reply,
+                        pd.Series([Timedelta(0), Timedelta(minutes=10), Timedelta(minutes=10), NaT,
+                                   Timedelta(minutes=35)], name='duration_to_reply'))
+    assert_series_equal(out.duration_since_their_last,
+                        pd.Series([Timedelta(0), Timedelta(minutes=10), Timedelta(minutes=10), Timedelta(minutes=15),
+                                   Timedelta(minutes=35)], name='duration_since_their_last'))
+
+
 def test_extract_emojis():
     s = pd.Series(['Regular Text', '❤️', '👍👍', 'mid😂moji', 'spaces ❤️ around ❤️ multiple'])
     out = extract_emojis(s)
@@ -121,3 +162,52 @@ def test_extract_emojis_maintains_multi_person_grouping():
     out = extract_emojis(s)
     expected = pd.Series([[], ['👨‍👩🏿‍👧🏻‍👦🏾']])
     assert_series_equal(out, expected)
+
+
+def test_extract_emojis_matches_extract_string_emojis_for_every_emoji():
+    s = pd.Series([f'a{e}b {e}{e} {e}' for e in emoji.EMOJI_DATA])
+    out = extract_emojis(s)
+    expected = s.apply(extract_string_emojis)
+    assert_series_equal(out, expected)
+
+
+def test_extract_emojis_long():
+    s = pd.Series(['Regular Text', '👍👍', 'mid😂moji'], index=[10, 11, 12])
+    out = extract_emojis_long(s)
+    expected = pd.Series(['👍', '👍', '😂'], name='emoji',
+                         index=pd.MultiIndex.from_tuples([(11, 0), (11, 1), (12, 0)], names=[None, 'match']))
+    assert_series_equal(out, expected)
+
+
+def test_count_emojis():
+    s = pd.Series(['Regular Text', '👍👍', 'mid😂moji', '❤️ 👍'])
+    out = count_emojis(s)
+    assert out.to_dict() == {'👍': 3, '😂': 1, '❤️': 1}
+
+
+def test_compact_chat_features():
+    df = pd.DataFrame({
+        'datetime': [pd.Timestamp('2019-12-31 23:00'), pd.Timestamp('2020-01-05 10:00')],
+        'sender': ['X', 'Y'],
+        'message': ['Hi 👍👍', 'Ho'],
+        'n_block': [1, 2],
+        'datetime_last': [pd.Timestamp('2019-12-31 23:00'), pd.Timestamp('2020-01-05 10:01')],
+        'block_duration': [Timedelta(0), Timedelta(minutes=1)],
+        'chat': ['Y', 'Y'],
+        'receiver': ['Y', 'X'],
+        'duration_since_their_last': [Timedelta(0), Timedelta(days=4)],
+        'duration_to_reply': [Timedelta(0), Timedelta(days=4)],
+        'week': ['2019-52', '2020-01'],
+        'weekday': pd.Series(['Tuesday', 'Sunday'], dtype=cat_weekdays),
+        'n_symbols': [5, 2],
+        'emojis': [['👍', '👍'], []],
+        'n_emojis': [2, 0],
+    })
+
+    out = compact_chat_features(df)
+
+    assert out.sender.dtype == 'category' and out.chat.dtype == 'category'
+    assert out.n_block.dtype == np.uint8 and out.n_symbols.dtype == np.uint8
+    assert out.week.tolist() == [201952, 202001]
+    assert out.emojis.tolist() == [['👍', '👍'], []]
+    assert out.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum()
@@ -0,0 +1,69 @@
+import json
+
+import pandas as pd
+import pytest
+
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations
+from chat_analyzer.utils import instrumentation
+from chat_analyzer.utils.synthetic import write_whatsapp_export
+
+
+@pytest.fixture
+def enabled_instrumentation():
+    instrumentation.clear_records()
+    instrumentation.enable()
+    yield
+    instrumentation.enable(False)
+    instrumentation.clear_records()
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_stages_are_recorded_per_chat(tmp_path, enabled_instrumentation, n_workers):
+    for seed, name in enumerate(['a', 'b']):
+        write_whatsapp_export(str(tmp_path / f"{name}.txt"), 200, seed=seed)
+
+    aggregate_whatsapp_conversations(str(tmp_path), n_workers=n_workers)
+
+    records = pd.DataFrame(instrumentation.records())
+    pipeline = records[~records.stage.str.startswith('validate_')]
+    per_chat = pipeline.dropna(subset='chat').groupby('chat').stage.apply(list).to_dict()
+    assert per_chat == {chat: ['parse', 'merge', 'single_chat_features', 'add_features']
+                        for chat in ['a.txt', 'b.txt']}
+    assert set(records.stage) >= {'validate_RawChat', 'validate_SingleChat', 'validate_ChatFeatures'}
+    parse = records[records.stage == 'parse']
+    assert (parse.rows_out == 200).all()
+    assert (records.seconds > 0).all() and (records.peak_rss_mib > 0).all()
+    assert records.peak_mib.isna().all()  # memory is only traced on request
+
+
+def test_memory_is_traced_on_request(enabled_instrumentation):
+    instrumentation.enable(trace_memory=True)
+    try:
+        with instrumentation.stage('outer'):
+            with instrumentation.stage('inner'):
+                data = bytearray(8 * 2 ** 20)
+            del data
+    finally:
+        instrumentation.enable(trace_memory=False)
+
+    peaks = {record['stage']: record['peak_mib'] for record in instrumentation.records()}
+    assert peaks['inner'] >= 8 and peaks['outer'] >= peaks['inner']
+
+
+def test_write_report(tmp_path, enabled_instrumentation):
+    with instrumentation.stage('parse', chat='x', rows_in=3) as stage:
+        stage.rows_out = 2
+
+    instrumentation.write_report(str(tmp_path / "report.csv"))
+    instrumentation.write_report(str(tmp_path / "report.json"))
+
+    df = pd.read_csv(tmp_path / "report.csv")
+    assert df[['stage', 'chat', 'rows_in', 'rows_out']].values.tolist() == [['parse', 'x', 3, 2]]
+    assert json.loads((tmp_path / "report.json").read_text())[0]['rows_out'] == 2
+
+
+def test_disabled_stages_record_nothing():
+    instrumentation.clear_records()
+    with instrumentation.stage('parse') as stage:
+        stage.rows_out = 1
+    assert instrumentation.records() == []
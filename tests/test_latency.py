@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from chat_analyzer.analysis.analysis import agg_chat_metrics
+from chat_analyzer.analysis.latency import build_latency_sketches, combine_latency_sketches, latency_quantiles, \
+    sketch_quantiles, N_LATENCY_BINS, latency_histograms
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations
+from chat_analyzer.utils.synthetic import write_whatsapp_export
+from chat_analyzer.visualization.visualize import fig_time_to_reply_per_weekday, fig_time_to_reply_violin
+
+
+@pytest.mark.parametrize('q', [0.01, 0.5, 0.9, 0.99])
+def test_sketch_quantiles_are_within_the_bin_width(q):
+    seconds = np.random.default_rng(0).lognormal(mean=6, sigma=2, size=10_000)
+    durations = pd.Series(pd.to_timedelta(seconds, unit='s'))
+
+    counts = latency_histograms(np.zeros(len(durations), dtype=np.int64), durations, 1)
+    estimate = sketch_quantiles(counts, q)[0] / np.timedelta64(1, 's')
+
+    assert abs(estimate / np.quantile(seconds, q) - 1) < 0.06
+
+
+def test_sketch_quantiles_of_empty_and_missing_durations():
+    durations = pd.Series(pd.to_timedelta([np.nan, 0, 30], unit='s'))
+    counts = latency_histograms(np.array([0, 1, 1]), durations, 3)
+
+    assert counts.sum() == 2 and counts.shape == (3, N_LATENCY_BINS)
+    assert pd.isna(sketch_quantiles(counts, 0.5)[[0, 2]]).all()
+
+
+def test_merged_sketches_match_sketches_of_all_messages(tmp_path):
+    write_whatsapp_export(str(tmp_path / "a.txt"), 600, n_senders=3, seed=1)
+    df = aggregate_whatsapp_conversations(str(tmp_path), n_workers=1)
+
+    halves = [build_latency_sketches(df.iloc[:300]), build_latency_sketches(df.iloc[300:])]
+    merged = combine_latency_sketches(halves, ['sender'])
+
+    assert_frame_equal(merged, build_latency_sketches(df, ['sender']))
+    metrics = agg_chat_metrics(df.groupby('sender', observed=True))
+    assert_frame_equal(metrics[['p50_time_to_reply', 'p90_time_to_reply', 'p99_time_to_reply']],
+                       latency_quantiles(merged))
+    assert (metrics['p50_time_to_reply'] <= metrics['p99_time_to_reply']).all()
+
+
+def test_reply_time_quantiles_align_with_unobserved_categories(tmp_path):
+    write_whatsapp_export(str(tmp_path / "a.txt"), 600, n_senders=3, seed=1)
+    df = aggregate_whatsapp_conversations(str(tmp_path), n_workers=1)
+    df = df[df.weekday != 'Tuesday']
+
+    metrics = agg_chat_metrics(df.groupby('weekday', observed=False))
+    observed = agg_chat_metrics(df.groupby('weekday', observed=True))
+
+    assert pd.isna(metrics.loc['Tuesday', 'p50_time_to_reply'])
+    assert_frame_equal(metrics.drop(index='Tuesday'), observed, check_index_type=False)
+
+
+def test_reply_time_figures_hold_summaries_only(tmp_path):
+    write_whatsapp_export(str(tmp_path / "a.txt"), 2000, seed=1)
+    df = aggregate_whatsapp_conversations(str(tmp_path), n_workers=1)
+    sketches = build_latency_sketches(df)
+
+    box = fig_time_to_reply_per_weekday(sketches)
+    violin = fig_time_to_reply_violin(sketches)
+
+    assert [len(trace.median) for trace in box.data] == [7, 7]
+    assert len(violin.data) == 2 and all(len(trace.y) <= 2 * N_LATENCY_BINS for trace in violin.data)
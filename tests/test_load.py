@@ -0,0 +1,152 @@
+import os
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from chat_analyzer.data_processing import load
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations, ChatIngestionError
+
+def test_aggregate_whatsapp_conversations_parallel_matches_sequential(tmp_path, write_chats):
+    write_chats(tmp_path, ['Max', 'Anna', 'Veronika'])
+
+    sequential = aggregate_whatsapp_conversations(str(tmp_path), n_workers=1)
+    parallel = aggregate_whatsapp_conversations(str(tmp_path), n_workers=2)
+
+    assert list(pd.unique(parallel.chat)) == ['Anna', 'Max', 'Veronika']
+    assert_frame_equal(pd.DataFrame(sequential), pd.DataFrame(parallel))
+
+
+def test_aggregate_whatsapp_conversations_adds_features_once_per_chat(tmp_path, write_chats, monkeypatch):
+    write_chats(tmp_path, ['Max', 'Anna'])
+    n_rows = []
+    add_features = load.add_features
+    monkeypatch.setattr(load, 'add_features', lambda df: n_rows.append(len(df)) or add_features(df))
+
+    df = aggregate_whatsapp_conversations(str(tmp_path), n_workers=1)
+
+    assert n_rows == [4, 4]
+    assert df.n_symbols.tolist() == df.message.str.len().tolist()
+
+
+def test_aggregate_whatsapp_conversations_reports_failing_files(tmp_path, write_chats):
+    write_chats(tmp_path, ['Max'])
+    (tmp_path / "monologue.txt").write_text('06/01/2020, 23:39 - A: x\n06/01/2020, 23:40 - A: y\n',
+                                            encoding='utf-8')
+
+    with pytest.raises(ChatIngestionError) as exc_info:
+        aggregate_whatsapp_conversations(str(tmp_path), n_workers=2)
+
+    assert list(exc_info.value.errors) == [str(tmp_path / "monologue.txt")]
+    assert isinstance(exc_info.value.errors[str(tmp_path / "monologue.txt")], NotImplementedError)
+
+
+@pytest.mark.parametrize('export', ['', '06/01/2020, 23:39 - Messages and calls are end-to-end encrypted.\n'])
+def test_exports_without_messages_fail_clearly(tmp_path, write_chats, export):
+    write_chats(tmp_path, ['Max'])
+    (tmp_path / "empty.txt").write_text(export, encoding='utf-8')
+
+    df, n_bytes = load.read_whatsapp_file(str(tmp_path / "empty.txt"))
+    assert df.empty and list(df.columns) == ['sender', 'message', 'datetime', 'offset', 'source']
+    assert n_bytes == len(export.encode('utf-8'))
+    with pytest.raises(ChatIngestionError) as exc_info:
+        aggregate_whatsapp_conversations(str(tmp_path), n_workers=1)
+    assert "No messages found in empty.txt" in str(exc_info.value)
+
+
+def test_aggregate_whatsapp_conversations_names_group_chats_by_export(tmp_path, write_chats):
+    write_chats(tmp_path, ['Max'])
+    (tmp_path / "WhatsApp Chat with Hiking Club.txt").write_text(
+        '06/01/2020, 23:39 - A: x\n06/01/2020, 23:40 - B: y\n06/01/2020, 23:41 - C: z\n', encoding='utf-8')
+
+    df = aggregate_whatsapp_conversations(str(tmp_path), n_workers=1)
+
+    df_group = df[df.chat == 'Hiking Club']
+    assert list(df_group.receiver) == [None, 'A', 'B']
+    assert list(pd.unique(df.chat)) == ['Hiking Club', 'Max']
+
+
+def test_aggregate_whatsapp_conversations_reprocesses_only_changed_chats(tmp_path, write_chats, monkeypatch):
+    path_chats, path_cache = tmp_path / "chats", tmp_path / "cache"
+    path_chats.mkdir()
+    write_chats(path_chats, ['Max', 'Anna', 'Veronika'])
+    first = aggregate_whatsapp_conversations(str(path_chats), n_workers=1, path_cache=str(path_cache))
+
+    calls = []
+    for func_name in ['process_whatsapp_file', 'extend_whatsapp_file']:
+        func = getattr(load, func_name)
+        monkeypatch.setattr(load, func_name, lambda filepath, *args, name=func_name, f=func:
+                            calls.append((name, os.path.basename(filepath))) or f(filepath, *args))
+    unchanged = aggregate_whatsapp_conversations(str(path_chats), n_workers=1, path_cache=str(path_cache))
+    assert calls == []
+    assert_frame_equal(pd.DataFrame(first), pd.DataFrame(unchanged))
+
+    with open(path_chats / "WhatsApp Chat with Max.txt", 'a', encoding='utf-8') as f:
+        f.write('08/01/2020, 09:00 - Fabio Meier: Fine.\n')
+    path_anna = path_chats / "WhatsApp Chat with Anna.txt"
+    path_anna.write_text(path_anna.read_text(encoding='utf-8').replace('Hello', 'Hi'), encoding='utf-8')
+    changed = aggregate_whatsapp_conversations(str(path_chats), n_workers=1, path_cache=str(path_cache))
+
+    assert calls == [('process_whatsapp_file', "WhatsApp Chat with Anna.txt"),
+                     ('extend_whatsapp_file', "WhatsApp Chat with Max.txt")]
+    assert len(changed) == len(first) + 1
+    assert len(list(path_cache.glob('*.pkl'))) == 3
+
+
+def test_aggregate_whatsapp_conversations_renames_cached_group_chats(tmp_path):
+    path_chats, path_cache = tmp_path / "chats", tmp_path / "cache"
+    path_chats.mkdir()
+    path_group = path_chats / "WhatsApp Chat with Hiking Club.txt"
+    path_group.write_text('06/01/2020, 23:39 - A: x\n06/01/2020, 23:40 - B: y\n06/01/2020, 23:41 - C: z\n',
+                          encoding='utf-8')
+    aggregate_whatsapp_conversations(str(path_chats), n_workers=1, path_cache=str(path_cache),
+                                     path_metrics_cube=str(tmp_path / "cube.parquet"))
+
+    path_renamed = path_chats / "WhatsApp Chat with Climbing Club.txt"
+    os.rename(path_group, path_renamed)
+    df = aggregate_whatsapp_conversations(str(path_chats), n_workers=1, path_cache=str(path_cache),
+                                          path_metrics_cube=str(tmp_path / "cube.parquet"))
+
+    assert list(pd.unique(df.chat)) == ['Climbing Club']
+    assert list(pd.unique(df.source)) == [str(path_renamed)]
+    assert set(pd.read_parquet(tmp_path / "cube.parquet").chat) == {'Climbing Club'}
+
+
+@pytest.mark.parametrize('appended', [
+    '',
+    'continues the last message\n',
+    '02/01/2020, 13:01 - Max: within the merge window\n',
+    '02/01/2020, 13:30 - Max: same sender after a pause\n02/01/2020, 13:31 - Fabio Meier: Ok 👍\n',
+    '08/01/2020, 09:00 - Fabio Meier: Fine.\nsecond line\n08/01/2020, 09:05 - Max: 😁\n',
+])
+def test_extend_whatsapp_file_matches_full_rebuild(tmp_path, write_chats, appended):
+    write_chats(tmp_path, ['Max'])
+    path = tmp_path / "WhatsApp Chat with Max.txt"
+    previous = load.process_whatsapp_file(str(path))
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(appended)
+    extended = load.extend_whatsapp_file(str(path), previous.df, previous.resume_offset)
+    rebuilt = load.process_whatsapp_file(str(path))
+
+    assert_frame_equal(pd.DataFrame(extended.df), pd.DataFrame(rebuilt.df))
+    assert (extended.n_bytes, extended.resume_offset) == (rebuilt.n_bytes, rebuilt.resume_offset)
+
+
+def test_aggregate_whatsapp_conversations_reads_only_the_given_exports(tmp_path, write_chats, monkeypatch):
+    path_chats, path_cache = tmp_path / "chats", str(tmp_path / "cache")
+    path_chats.mkdir()
+    write_chats(path_chats, ['Max', 'Anna', 'Veronika', 'Tim', 'Lea'])
+    paths = dict(n_workers=1, path_cache=path_cache, path_metrics_cube=str(tmp_path / "cube.parquet"))
+    aggregate_whatsapp_conversations(str(path_chats), **paths)
+
+    reads = []
+    read_cached_chat = load.read_cached_chat
+    monkeypatch.setattr(load, 'read_cached_chat', lambda path, key: reads.append(key) or read_cached_chat(path, key))
+    path_anna = path_chats / "WhatsApp Chat with Anna.txt"
+    path_anna.write_text(path_anna.read_text(encoding='utf-8').replace('Hello', 'Hi'), encoding='utf-8')
+    df = aggregate_whatsapp_conversations(str(path_chats), **paths, exports=[str(path_anna)])
+
+    assert list(pd.unique(df.chat)) == ['Anna']
+    assert len(reads) == 1
+    assert set(pd.read_parquet(paths['path_metrics_cube']).chat) == {'Max', 'Anna', 'Veronika', 'Tim', 'Lea'}
@@ -0,0 +1,47 @@
+import base64
+import hashlib
+
+import numpy as np
+
+from chat_analyzer.data_processing.load import load_whatsapp_chat
+from chat_analyzer.data_processing.feature_engineering import add_features
+from chat_analyzer.utils.synthetic import generate_whatsapp_export
+from chat_analyzer.visualization.offline import encode_arrays, PLOTLY_JS, REPORT_JS, REPORT_JS_SOURCE
+from chat_analyzer.visualization.visualize import create_chat_html
+
+
+def decode(encoded: dict) -> np.ndarray:
+    dtype = {'u1': '<u1', 'i1': '<i1', 'u2': '<u2', 'i2': '<i2', 'u4': '<u4', 'i4': '<i4', 'f4': '<f4', 'f8': '<f8'}
+    return np.frombuffer(base64.b64decode(encoded['bdata']), dtype=dtype[encoded['dtype']])
+
+
+def test_encode_arrays_encodes_numeric_arrays_in_the_smallest_typed_array():
+    figure = {'data': [{'x': np.array([1, 2, 300]), 'y': np.array([0.5, np.nan]), 'z': np.array([-1, 2 ** 40]),
+                        'text': np.array(['a', 'b'], dtype=object)}], 'layout': {'height': 10}}
+
+    encoded = encode_arrays(figure)
+
+    trace = encoded['data'][0]
+    assert [trace[axis]['dtype'] for axis in 'xyz'] == ['u2', 'f4', 'f8']
+    assert decode(trace['x']).tolist() == [1, 2, 300]
+    np.testing.assert_array_equal(decode(trace['y']), [0.5, np.nan])
+    assert decode(trace['z']).tolist() == [-1, 2 ** 40]
+    assert trace['text'] is figure['data'][0]['text'] and encoded['layout'] == {'height': 10}
+
+
+def test_offline_reports_share_the_plotly_assets(tmp_path):
+    df = add_features(load_whatsapp_chat(''.join(generate_whatsapp_export(500, seed=0))))
+
+    paths = [create_chat_html(df, chat, str(tmp_path), offline=True) for chat in ['Max', 'Anna']]
+
+    assert sorted(p.name for p in tmp_path.glob('*.js')) == sorted([PLOTLY_JS, REPORT_JS])
+    for path in paths:
+        html = open(path, encoding='utf-8').read()
+        assert f'<script src="{PLOTLY_JS}">' in html and 'cdn.plot.ly' not in html
+        assert html.count('renderChatFigure(') == 4 and '"bdata"' in html and 'data:image/png' not in html
+
+
+def test_report_js_is_named_after_its_content():
+    digest = hashlib.blake2b(REPORT_JS_SOURCE.encode(), digest_size=8).hexdigest()
+
+    assert REPORT_JS == f"chat_report-{digest}.js"
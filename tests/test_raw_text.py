@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+
+from chat_analyzer.data_processing.load import process_whatsapp_file, read_whatsapp_file
+from chat_analyzer.data_processing.raw_text import build_offset_index, read_raw_messages, read_offset_index, \
+    offset_index_filename
+from chat_analyzer.utils.synthetic import write_whatsapp_export
+
+CHAT = '''06/01/2020, 23:39 - Messages and calls are end-to-end encrypted.
+06/01/2020, 23:39 - Fabio Meier: Hello there
+07/01/2020, 07:00 - Max: Who are you? 😡
+07/01/2020, 07:00 - Max: Seriously
+
+who?
+07/01/2020, 07:05 - Anna joined
+07/01/2020, 11:43 - Fabio Meier: Leave me alone.
+'''
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / "WhatsApp Chat with Max.txt"
+    path.write_text(CHAT, encoding='utf-8')
+    return str(path)
+
+
+def test_build_offset_index_matches_parser(tmp_path, export):
+    path_synthetic = str(tmp_path / "synthetic.txt")
+    write_whatsapp_export(path_synthetic, 2000, n_senders=3, seed=0)
+
+    for filepath in [export, path_synthetic]:
+        df_raw, n_bytes = read_whatsapp_file(filepath)
+        assert np.array_equal(build_offset_index(filepath), np.append(df_raw.offset, n_bytes))
+
+
+def test_read_raw_messages_of_processed_rows(tmp_path, export):
+    df = process_whatsapp_file(export).df
+    path_index = str(tmp_path / "index")
+
+    row = df[df.sender == 'Max'].iloc[0]
+    assert row.source == export and row.n_block == 2
+    assert read_raw_messages(row.source, row.offset, row.n_block, path_index=path_index) == \
+        '07/01/2020, 07:00 - Max: Who are you? 😡\n07/01/2020, 07:00 - Max: Seriously\n\nwho?\n' \
+        '07/01/2020, 07:05 - Anna joined\n'
+    assert read_raw_messages(export, row.offset, n_context=1, path_index=path_index).startswith(
+        '06/01/2020, 23:39 - Fabio Meier: Hello there\n07/01/2020, 07:00 - Max: Who are you? 😡\n07/01/2020')
+    with pytest.raises(ValueError):
+        read_raw_messages(export, row.offset + 1, path_index=path_index)
+
+
+def test_read_offset_index_is_rebuilt_once_the_export_changed(tmp_path, export):
+    path_index = str(tmp_path / "index")
+    index = read_offset_index(export, path_index)
+    assert os.listdir(path_index) == [offset_index_filename(export)]
+    assert isinstance(read_offset_index(export, path_index), np.memmap)
+
+    with open(export, 'a', encoding='utf-8') as f:
+        f.write('07/01/2020, 13:01 - Max: Sorry.\n')
+
+    assert np.array_equal(read_offset_index(export, path_index)[:-1], np.append(index[:-1], index[-1]))
+
+
+def test_exports_of_the_same_name_keep_separate_offset_indices(tmp_path, export):
+    path_index = str(tmp_path / "index")
+    (tmp_path / "other").mkdir()
+    other = tmp_path / "other" / "WhatsApp Chat with Max.txt"
+    other.write_text('08/01/2020, 09:00 - Max: Hi\n', encoding='utf-8')
+
+    index = read_offset_index(export, path_index)
+    assert read_offset_index(str(other), path_index).tolist() == [0, len(other.read_bytes())]
+    assert len(os.listdir(path_index)) == 2
+    assert np.array_equal(read_offset_index(export, path_index), index)
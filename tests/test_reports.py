@@ -0,0 +1,22 @@
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations
+from chat_analyzer.data_processing.store import write_parquet_store
+from chat_analyzer.utils.synthetic import write_whatsapp_export
+from chat_analyzer.visualization.reports import build_chat_reports
+
+
+def test_build_chat_reports_renders_only_changed_chats(tmp_path):
+    path_chats, path_store, path_html = tmp_path / "chats", str(tmp_path / "store"), tmp_path / "html"
+    path_chats.mkdir()
+    write_whatsapp_export(str(path_chats / "a.txt"), 300, seed=1)
+    write_whatsapp_export(str(path_chats / "b.txt"), 300, seed=2, n_senders=2)
+    (path_chats / "b.txt").write_text((path_chats / "b.txt").read_text(encoding='utf-8')
+                                      .replace('Contact 1', 'Contact 2'), encoding='utf-8')
+    write_parquet_store(aggregate_whatsapp_conversations(str(path_chats), n_workers=1), path_store)
+
+    assert build_chat_reports(path_store, str(path_html), n_workers=2) == ['Contact 1', 'Contact 2']
+    assert len(list(path_html.glob('*.html'))) == 2
+    assert build_chat_reports(path_store, str(path_html), n_workers=1) == []
+
+    write_whatsapp_export(str(path_chats / "a.txt"), 301, seed=1)
+    write_parquet_store(aggregate_whatsapp_conversations(str(path_chats), n_workers=1), path_store)
+    assert build_chat_reports(path_store, str(path_html), n_workers=1) == ['Contact 1']
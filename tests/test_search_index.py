@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from chat_analyzer.analysis.corpus import Corpus
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations
+from chat_analyzer.data_processing.search_index import SearchIndex, tokenize, update_search_index, list_index_chats
+from chat_analyzer.data_processing.store import write_parquet_store, read_parquet_store
+from chat_analyzer.utils.synthetic import write_whatsapp_export
+
+
+@pytest.fixture(scope='module')
+def indexed_store(tmp_path_factory):
+    path = tmp_path_factory.mktemp('search')
+    path_chats, path_store, path_index = path / "chats", str(path / "store"), str(path / "search")
+    path_chats.mkdir()
+    write_whatsapp_export(str(path_chats / "WhatsApp Chat with Max.txt"), 2000, seed=1)
+    write_whatsapp_export(str(path_chats / "WhatsApp Chat with Club.txt"), 1000, seed=2, n_senders=4)
+    write_parquet_store(aggregate_whatsapp_conversations(str(path_chats), n_workers=1), path_store, path_index)
+    return path_store, path_index
+
+
+def test_tokenize_normalizes_words_and_keeps_emojis():
+    assert tokenize("Café, CAFE und Straße! 👍🏽👨‍👩‍👧 ok_1") == ['cafe', 'cafe', 'und', 'strasse', '👍🏽', '👨‍👩‍👧',
+                                                            'ok_1']
+
+
+@pytest.mark.parametrize('query, phrase', [('time', False), ('see you', False), ('see you', True), ('👍🏽', False),
+                                           ('you hello', True), ('unknown', False)])
+def test_search_matches_a_scan_of_the_messages(indexed_store, query, phrase):
+    path_store, path_index = indexed_store
+    df = read_parquet_store(path_store, columns=['chat', 'datetime', 'sender', 'message'])
+    terms = tokenize(query)
+    if phrase:
+        is_match = df.message.map(lambda m: f" {' '.join(terms)} " in f" {' '.join(tokenize(m))} ")
+    else:
+        is_match = df.message.map(lambda m: set(terms) <= set(tokenize(m)))
+    since, until = pd.Timestamp('2015-01-03'), pd.Timestamp('2015-01-20')
+    is_match &= (df.datetime >= since) & (df.datetime < until) & (df.sender != 'Fabio Meier')
+
+    result = SearchIndex(path_index).search(query, phrase, senders=['Contact 1', 'Contact 2', 'Contact 3'],
+                                            since=since, until=until)
+
+    expected = df[is_match]
+    assert result.chat.tolist() == expected.chat.tolist()
+    assert result.datetime.tolist() == expected.datetime.tolist()
+    assert result.sender.tolist() == expected.sender.astype(str).tolist()
+
+
+def test_corpus_search_reads_the_matching_messages(indexed_store):
+    path_store, path_index = indexed_store
+    corpus = Corpus.open(path_store).filter(chat='Club').select('datetime', 'sender', 'message')
+
+    result = corpus.search('hello there', phrase=True, path_index=path_index)
+    frequency = corpus.term_frequency('hello there', freq='D', phrase=True, path_index=path_index)
+
+    assert len(result) > 0 and result.message.str.lower().str.contains('hello there').all()
+    assert frequency.sum() == len(result)
+    assert frequency.index.freqstr == 'D'
+    assert len(corpus.search('nothing matches this', path_index=path_index)) == 0
+
+
+def test_update_search_index_replaces_and_removes_segments(indexed_store, tmp_path):
+    path_store, _ = indexed_store
+    df = read_parquet_store(path_store)
+    path_index = str(tmp_path / "search")
+    update_search_index(df, path_index)
+    index = SearchIndex(path_index)
+    n_hello = len(index.search('hello'))
+
+    df_max = df[df.chat == 'Contact 1'].copy()
+    df_max['message'] = 'hello again'
+    update_search_index(df_max, path_index, chats=['Contact 1', 'Club'])
+
+    assert list_index_chats(path_index) == ['Contact 1']
+    assert len(index.search('hello')) == len(df_max) != n_hello
+    assert_frame_equal(index.search('again').drop(columns='row'),
+                       df_max[['chat', 'datetime', 'sender']].astype({'sender': object}).reset_index(drop=True))
+    np.testing.assert_array_equal(index.search('again').row, np.arange(len(df_max)))
+
+
+def test_phrases_match_at_positions_beyond_uint16(indexed_store, tmp_path):
+    path_store, _ = indexed_store
+    df = read_parquet_store(path_store)
+    df = df[df.chat == 'Contact 1'].iloc[:2].copy()
+    df['message'] = [' '.join(['filler'] * 65_534 + ['good', 'x', 'morning']), 'good morning']
+    update_search_index(df, str(tmp_path / "search"))
+
+    assert SearchIndex(str(tmp_path / "search")).search('good morning', phrase=True).row.tolist() == [1]
@@ -0,0 +1,126 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from chat_analyzer.data_processing import cache
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations
+from chat_analyzer.data_processing.signal_export import iter_parse_signal_text, iter_parse_signal_json, \
+    iter_json_values, read_signal_file, iter_parse_signal_file
+
+SIGNAL_TEXT_EXPORT = '''Conversation: Max (+41 79 123 45 67)
+
+From: Max (+41 79 123 45 67)
+Type: incoming
+Sent: Tue, 7 Jan 2020 07:00:12 +0100
+Received: Tue, 7 Jan 2020 07:00:14 +0100
+
+Who are you? 😡
+
+From: You
+Type: outgoing
+Sent: Tue, 7 Jan 2020 11:43:00 +0100
+
+Leave me alone.
+
+and never come back
+
+From: Max (+41 79 123 45 67)
+Type: incoming
+Sent: Tue, 7 Jan 2020 13:01:00 +0100
+Attachment: sorry.jpg (image/jpeg, 51234 bytes)
+
+'''
+
+SIGNAL_JSON_MESSAGES = [
+    {'type': 'incoming', 'sent_at': 1578376812000, 'body': 'Who are you? 😡'},
+    {'type': 'keychange', 'sent_at': 1578376813000},
+    {'type': 'outgoing', 'sent_at': 1578393780000, 'body': 'Leave me alone.\n\nand never come back'},
+    {'type': 'incoming', 'sent_at': 1578398460000, 'body': None, 'attachments': [{'fileName': 'sorry.jpg'}]},
+]
+
+
+def expected_chat(seconds=(12, 0, 0)):
+    return pd.DataFrame({
+        'sender': ['Max', 'Fabio Meier', 'Max'],
+        'message': ['Who are you? 😡', 'Leave me alone.\n\nand never come back', '<Media omitted>'],
+        'datetime': [pd.Timestamp('2020-01-07 07:00') + pd.Timedelta(seconds=seconds[0]),
+                     pd.Timestamp('2020-01-07 11:43') + pd.Timedelta(seconds=seconds[1]),
+                     pd.Timestamp('2020-01-07 13:01') + pd.Timedelta(seconds=seconds[2])]})
+
+
+def test_iter_parse_signal_text():
+    batches = list(iter_parse_signal_text(io.StringIO(SIGNAL_TEXT_EXPORT), 'Max', batch_size=2))
+
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert_frame_equal(pd.concat(batches, ignore_index=True), expected_chat())
+
+
+def test_iter_parse_signal_json_reads_arrays_and_lines():
+    json_array = json.dumps(SIGNAL_JSON_MESSAGES, indent=1)
+    json_lines = '\n'.join(json.dumps(message) for message in SIGNAL_JSON_MESSAGES)
+
+    for export in [json_array, json_lines]:
+        df = pd.concat(iter_parse_signal_json(io.StringIO(export), 'Max'), ignore_index=True)
+        assert_frame_equal(df, expected_chat())
+
+
+def test_iter_parse_signal_file_sorts_messages_across_batches(tmp_path):
+    sent_at = [1578376812000, 1578398460000, 1578376800000, 1578393780000]  # received in this order
+    messages = [{'type': 'incoming', 'sent_at': t, 'body': str(i)} for i, t in enumerate(sent_at)]
+    (tmp_path / "Max.json").write_text(json.dumps(messages), encoding='utf-8')
+
+    batches = list(iter_parse_signal_file(str(tmp_path / "Max.json"), batch_size=2))
+
+    assert [len(batch) for batch in batches] == [2, 2]
+    df = pd.concat(batches, ignore_index=True)
+    assert list(df.message) == ['2', '0', '3', '1']
+    assert df.datetime.is_monotonic_increasing
+
+
+def test_iter_json_values_decodes_values_across_chunks():
+    values = [{'body': 'x' * n, 'n': n} for n in range(50)]
+
+    assert list(iter_json_values(io.StringIO(json.dumps(values)), chunk_size=7)) == values
+
+
+def test_aggregate_whatsapp_conversations_merges_signal_chats(tmp_path):
+    path_whatsapp, path_signal = tmp_path / "whatsapp", tmp_path / "signal"
+    path_whatsapp.mkdir()
+    path_signal.mkdir()
+    (path_whatsapp / "WhatsApp Chat with Max.txt").write_text(
+        '06/01/2020, 23:39 - Fabio Meier: Hello there\n07/01/2020, 12:00 - Fabio Meier: Hello?\n', encoding='utf-8')
+    (path_signal / "Max.txt").write_text(SIGNAL_TEXT_EXPORT, encoding='utf-8')
+    (path_signal / "Anna.txt").write_text(SIGNAL_TEXT_EXPORT.replace('Max', 'Anna'), encoding='utf-8')
+
+    df = aggregate_whatsapp_conversations(str(path_whatsapp), n_workers=1, path_signal_chats=str(path_signal))
+
+    assert list(pd.unique(df.chat)) == ['Max', 'Anna']
+    df_max = df[df.chat == 'Max']
+    assert df_max.datetime.is_monotonic_increasing
+    assert list(df_max.message) == ['Hello there', 'Who are you? 😡', 'Leave me alone.\n\nand never come back',
+                                    'Hello?', '<Media omitted>']
+    assert_frame_equal(read_signal_file(str(path_signal / "Anna.txt")),
+                       expected_chat().replace('Max', 'Anna'))
+
+
+def test_iter_parse_signal_file_merges_many_batches_in_time_order(tmp_path):
+    rng = np.random.default_rng(0)
+    sent_at = 1578376800000 + rng.integers(0, 10_000, 101) * 1000
+    messages = [{'type': 'incoming', 'sent_at': int(t), 'body': str(i)} for i, t in enumerate(sent_at)]
+    (tmp_path / "Max.json").write_text(json.dumps(messages), encoding='utf-8')
+
+    batches = list(iter_parse_signal_file(str(tmp_path / "Max.json"), batch_size=10))
+
+    assert [len(batch) for batch in batches] == [10] * 10 + [1]
+    df = pd.concat(batches, ignore_index=True)
+    assert list(df.message) == [str(i) for i in np.argsort(sent_at, kind='stable')]
+
+
+def test_signal_timezone_is_part_of_the_pipeline_config_key(monkeypatch):
+    config_key = cache.pipeline_config_key(60)
+    monkeypatch.setattr(cache, 'SIGNAL_TIMEZONE', 'UTC')
+
+    assert cache.pipeline_config_key(60) != config_key
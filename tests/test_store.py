@@ -0,0 +1,100 @@
+import os
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from chat_analyzer.data_processing import load
+from chat_analyzer.data_processing.load import aggregate_whatsapp_conversations
+from chat_analyzer.data_processing.search_index import list_index_chats
+from chat_analyzer.data_processing.store import write_parquet_store, read_parquet_store, list_store_chats, \
+    replace_store_chats
+
+@pytest.fixture
+def processed_chats(tmp_path, write_chats):
+    def process(names) -> pd.DataFrame:
+        path_chats = tmp_path / "chats"
+        path_chats.mkdir()
+        write_chats(path_chats, names)
+        return aggregate_whatsapp_conversations(str(path_chats), n_workers=1)
+    return process
+
+
+def test_parquet_store_round_trips_dtypes(tmp_path, processed_chats):
+    df = processed_chats(['Max', 'Anna Von Muster'])
+    write_parquet_store(df, str(tmp_path / "store"))
+
+    result = read_parquet_store(str(tmp_path / "store"))
+
+    expected = pd.DataFrame(df).sort_values(['chat', 'datetime'], kind='stable').reset_index(drop=True)
+    assert_frame_equal(result, expected)
+    assert list_store_chats(str(tmp_path / "store")) == ['Anna Von Muster', 'Max']
+
+
+def test_write_parquet_store_keeps_the_previous_store_until_swapped(tmp_path, processed_chats, monkeypatch):
+    df = processed_chats(['Max', 'Anna'])
+    write_parquet_store(df, str(tmp_path / "store"))
+    replace = os.replace
+
+    def crash_on_swap(src, dst):
+        if src.endswith('.tmp'):
+            raise KeyboardInterrupt
+        replace(src, dst)
+    monkeypatch.setattr(os, 'replace', crash_on_swap)
+    with pytest.raises(KeyboardInterrupt):
+        write_parquet_store(df[df.chat == 'Max'], str(tmp_path / "store"))
+
+    assert list_store_chats(str(tmp_path / "store.old")) == ['Anna', 'Max']
+    monkeypatch.setattr(os, 'replace', replace)
+    write_parquet_store(df[df.chat == 'Anna'], str(tmp_path / "store"))
+    assert list_store_chats(str(tmp_path / "store")) == ['Anna']
+    assert sorted(os.listdir(tmp_path)) == ['chats', 'store']
+
+
+def test_read_parquet_store_filters_chat_dates_and_columns(tmp_path, processed_chats):
+    df = processed_chats(['Max', 'Anna'])
+    write_parquet_store(df, str(tmp_path / "store"))
+
+    result = read_parquet_store(str(tmp_path / "store"), columns=['datetime', 'weekday', 'duration_to_reply'],
+                                chats=['Max'], since=pd.Timestamp('2020-01-01'), until=pd.Timestamp('2020-01-02'))
+
+    assert list(result.columns) == ['datetime', 'weekday', 'duration_to_reply']
+    assert list(result.datetime) == [pd.Timestamp('2020-01-01 07:00'), pd.Timestamp('2020-01-01 11:43')]
+    assert result.weekday.dtype == df.weekday.dtype
+
+
+def test_replace_store_chats_swaps_only_their_partitions(tmp_path, processed_chats):
+    df = processed_chats(['Max', 'Anna', 'Tim'])
+    write_parquet_store(df, str(tmp_path / "store"))
+    df_max = df[df.chat == 'Max'].iloc[:2]
+
+    replace_store_chats(df_max, str(tmp_path / "store"), chats=['Max', 'Tim'])
+
+    assert list_store_chats(str(tmp_path / "store")) == ['Anna', 'Max']
+    assert len(read_parquet_store(str(tmp_path / "store"), chats=['Max'])) == 2
+    assert len(read_parquet_store(str(tmp_path / "store"), chats=['Anna'])) == (df.chat == 'Anna').sum()
+    assert sorted(os.listdir(tmp_path)) == ['chats', 'store']
+
+
+def test_agg_to_parquet_rewrites_only_changed_chats(tmp_path, processed_chats, monkeypatch):
+    processed_chats(['Max', 'Anna', 'Tim'])
+    paths = [str(tmp_path / "chats"), None, str(tmp_path / "store"), str(tmp_path / "cache"), None,
+             str(tmp_path / "search")]
+    load.agg_to_parquet(*paths)
+
+    writes = []
+    for func_name in ['write_parquet_store', 'replace_store_chats']:
+        func = getattr(load, func_name)
+        monkeypatch.setattr(load, func_name, lambda df, *args, name=func_name, f=func, **kwargs:
+                            writes.append((name, kwargs.get('chats'))) or f(df, *args, **kwargs))
+    load.agg_to_parquet(*paths)
+    assert writes == []
+
+    path_anna = tmp_path / "chats" / "WhatsApp Chat with Anna.txt"
+    path_anna.write_text(path_anna.read_text(encoding='utf-8').replace('Hello', 'Hi'), encoding='utf-8')
+    os.remove(tmp_path / "chats" / "WhatsApp Chat with Tim.txt")
+    load.agg_to_parquet(*paths)
+
+    assert writes == [('replace_store_chats', ['Anna', 'Tim'])]
+    assert list_store_chats(paths[2]) == list_index_chats(paths[5]) == ['Anna', 'Max']
+    assert read_parquet_store(paths[2], chats=['Anna']).message.iloc[0] == 'Hi there'
@@ -0,0 +1,18 @@
+from chat_analyzer.data_processing.extract import parse_whatsapp
+from chat_analyzer.utils.synthetic import generate_whatsapp_export
+
+
+def test_generate_whatsapp_export_parses_to_requested_messages():
+    chat_txt = ''.join(generate_whatsapp_export(2_500, n_senders=3, multi_line_ratio=0.1, batch_size=1_000))
+
+    df = parse_whatsapp(chat_txt)
+
+    assert len(df) == 2_500
+    assert df.sender.nunique() == 3
+    assert df.datetime.is_monotonic_increasing
+    assert 0.05 < df.message.str.contains('\n').mean() < 0.15
+
+
+def test_generate_whatsapp_export_is_deterministic_per_seed():
+    assert ''.join(generate_whatsapp_export(100, seed=1)) == ''.join(generate_whatsapp_export(100, seed=1))
+    assert ''.join(generate_whatsapp_export(100, seed=1)) != ''.join(generate_whatsapp_export(100, seed=2))
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+from pandera.errors import SchemaError
+
+from chat_analyzer.utils import instrumentation
+from chat_analyzer.utils.data_definitions import RawChat
+from chat_analyzer.utils.validation import validate, set_validation_mode, N_SAMPLED_ROWS
+
+
+@pytest.fixture
+def validation_mode():
+    yield set_validation_mode
+    set_validation_mode('full')
+
+
+def raw_chat(n: int, invalid_row: int) -> pd.DataFrame:
+    df = pd.DataFrame({'datetime': pd.Timestamp('2020-01-01') + pd.to_timedelta(range(n), unit='min'),
+                       'sender': ['A'] * n, 'message': ['x'] * n})
+    df.loc[invalid_row, 'sender'] = None
+    return df
+
+
+@pytest.mark.parametrize('mode, detected', [('full', True), ('sampled', False), ('schema', False), ('off', False)])
+def test_validate_checks_rows_as_far_as_the_mode_asks_for(validation_mode, mode, detected):
+    df = raw_chat(10 * N_SAMPLED_ROWS, invalid_row=N_SAMPLED_ROWS + 1)
+    validation_mode(mode)
+
+    if detected:
+        with pytest.raises(SchemaError):
+            validate(df, RawChat)
+    else:
+        assert validate(df, RawChat) is df
+
+
+@pytest.mark.parametrize('mode', ['full', 'sampled', 'schema'])
+def test_validate_checks_columns_unless_off(validation_mode, mode):
+    validation_mode(mode)
+
+    with pytest.raises(SchemaError):
+        validate(raw_chat(10, invalid_row=0).drop(columns='message'), RawChat)
+
+
+def test_validate_reports_its_time_per_model(validation_mode):
+    instrumentation.enable()
+    try:
+        with instrumentation.stage('parse', chat='Max'):
+            validate(raw_chat(10, invalid_row=0).fillna('A'), RawChat)
+    finally:
+        instrumentation.enable(False)
+    records = instrumentation.records()
+    instrumentation.clear_records()
+
+    assert [(r['stage'], r['chat'], r['rows_in']) for r in records] == [('validate_RawChat', 'Max', 10),
+                                                                         ('parse', 'Max', None)]
@@ -0,0 +1,73 @@
+import os
+
+import pandas as pd
+
+from chat_analyzer.data_processing import load
+from chat_analyzer.data_processing.search_index import SearchIndex
+from chat_analyzer.data_processing.store import read_parquet_store, list_store_chats
+from chat_analyzer.data_processing.watch import ExportWatcher, watch
+from chat_analyzer.visualization.visualize import chat_html_path
+
+def test_export_watcher_waits_until_exports_settled():
+    watcher = ExportWatcher(debounce_s=5)
+
+    assert watcher.poll({'a.txt': (10, 1)}, now=0) == ([], [])
+    assert watcher.poll({'a.txt': (20, 2)}, now=4) == ([], [])  # still written to
+    assert watcher.poll({'a.txt': (20, 2)}, now=8) == ([], [])
+    assert watcher.poll({'a.txt': (20, 2)}, now=9) == (['a.txt'], [])
+
+    watcher.mark_ingested(['a.txt'], [], {'a.txt': (20, 2)})
+    assert watcher.poll({'a.txt': (20, 2)}, now=20) == ([], [])
+    assert watcher.poll({}, now=21) == ([], ['a.txt'])
+
+
+def test_watch_ingests_only_changed_chats(tmp_path, write_chats, monkeypatch):
+    path_chats = tmp_path / "chats"
+    path_chats.mkdir()
+    write_chats(path_chats, ['Max', 'Anna'])
+    paths = dict(path_whatsapp_chats=str(path_chats), path_signal_chats=None, path_store=str(tmp_path / "store"),
+                 path_cache=str(tmp_path / "cache"), path_metrics_cube=str(tmp_path / "cube.parquet"),
+                 path_html_output=str(tmp_path / "html"), path_search_index=str(tmp_path / "search"), n_workers=1,
+                 debounce_s=0, poll_interval_s=0)
+    watch(**paths, max_cycles=2)
+    assert list_store_chats(paths['path_store']) == ['Anna', 'Max']
+    assert os.path.exists(chat_html_path('Max', paths['path_html_output']))
+
+    processed = []
+    process_whatsapp_file = load.process_whatsapp_file
+    monkeypatch.setattr(load, 'process_whatsapp_file', lambda filepath, *args:
+                        processed.append(os.path.basename(filepath)) or process_whatsapp_file(filepath, *args))
+    path_anna = path_chats / "WhatsApp Chat with Anna.txt"
+    path_anna.write_text(path_anna.read_text(encoding='utf-8').replace('Hello', 'Hi'), encoding='utf-8')
+    os.remove(path_chats / "WhatsApp Chat with Max.txt")
+    watch(**paths, max_cycles=2)
+
+    assert processed == ["WhatsApp Chat with Anna.txt"]
+    df = read_parquet_store(paths['path_store'])
+    assert list(pd.unique(df.chat)) == ['Anna']
+    assert df.message.iloc[0] == 'Hi there'
+    assert not os.path.exists(chat_html_path('Max', paths['path_html_output']))
+    assert set(pd.read_parquet(paths['path_metrics_cube']).chat) == {'Anna'}
+    assert SearchIndex(paths['path_search_index']).search('hi there').chat.tolist() == ['Anna']
+
+
+def test_watch_keeps_ingesting_next_to_a_failing_export(tmp_path, write_chats, monkeypatch):
+    path_chats = tmp_path / "chats"
+    path_chats.mkdir()
+    write_chats(path_chats, ['Anna'])
+    (path_chats / "WhatsApp Chat with Max.txt").write_text(
+        '06/01/2020, 23:39 - Fabio Meier: x\n06/01/2020, 23:40 - Fabio Meier: y\n', encoding='utf-8')  # a monologue
+    paths = dict(path_whatsapp_chats=str(path_chats), path_signal_chats=None, path_store=str(tmp_path / "store"),
+                 path_cache=str(tmp_path / "cache"), path_metrics_cube=str(tmp_path / "cube.parquet"),
+                 path_html_output=None, path_search_index=str(tmp_path / "search"), n_workers=1,
+                 debounce_s=0, poll_interval_s=0)
+    processed = []
+    process_whatsapp_file = load.process_whatsapp_file
+    monkeypatch.setattr(load, 'process_whatsapp_file', lambda filepath, *args:
+                        processed.append(os.path.basename(filepath)) or process_whatsapp_file(filepath, *args))
+
+    watch(**paths, max_cycles=4)
+
+    assert list_store_chats(paths['path_store']) == ['Anna']
+    assert set(pd.read_parquet(paths['path_metrics_cube']).chat) == {'Anna'}
+    assert processed.count("WhatsApp Chat with Max.txt") == 1  # not retried while unchanged